@@ -2,11 +2,14 @@ import sys
 
 #sys.path.append("../..")
 sys.path.append("../")
+import copy
 import datetime
 from time import monotonic
+from HgcException import HgcException
 
 #----------------------------------------------------------------------
 ALL_POSES = ["ONE","TWO","THREE","FOUR","FIVE","SIX", "SEVEN", "EIGHT", "NINE", "TEN", "FIST","TRACK","BACK","OK", "HORNS", "WAKEUP"]
+ALL_TRIGGERS = ["enter", "enter_leave", "periodic", "continuous"]
 #----------------------------------------------------------------------
 
 # Default values for config parameters
@@ -48,6 +51,132 @@ DEFAULT_CONFIG = {
             'output': None,
         }
 
+    },
+
+    # Sliding-window voting over the per-frame gestures (see gestureVoting.py)
+    'voting':
+    {
+        'enable': False,
+        'window': 5,            # frames
+        'enter_ratio': 0.6,     # share of the votes needed to change to a new gesture
+        'exit_ratio': 0.4,      # share of the votes needed to keep the current gesture
+    },
+
+    # Pose sequences (see comboRecognizer.py), used if the config has a 'combos' list
+    'combo_params':
+    {
+        'gap_timeout': 1.5,     # s, max time between 2 poses of a combo
+        'min_hold': 0.15,       # s, how long a pose has to stand to count
+        'release_time': 0.2,    # s, how long a pose has to be released to count again
+    },
+
+    # Dynamic gestures (see dynamicGestures.py), used if the config has a 'motion_actions' list
+    'motion_params':
+    {
+        'window': 15,           # frames
+        'swipe_dist': 1.2,      # hand sizes
+        'circle_turns': 0.8,
+        'circle_min_path': 2.5, # hand sizes
+        'push_ratio': 1.3,
+        'cooldown': 0.6,        # s
+    },
+
+    # Hot reload of item tree and pose actions (see configReloader.py)
+    'reload':
+    {
+        'enable': False,
+        'interval': 1.0,    # s, how often the watched files are checked
+    },
+
+    # Smart home backend (see backends.py): 'openhab' (REST API, 'url' default iface.url_str)
+    # or 'fake' (in-process items, with 'latency', 'jitter', 'failure_rate', 'drop_rate', 'seed')
+    'backend':
+    {
+        'type': 'openhab',
+    },
+
+    # Client of the openHAB REST API (see iface.RestClient)
+    'rest':
+    {
+        'pool_size': 8,             # max number of kept-alive connections
+        'connect_timeout': 3.05,    # s
+        'read_timeout': 5,          # s
+    },
+
+    # Spoken feedback (see SpeechController.py)
+    'speech':
+    {
+        'engine': 'auto',           # 'libespeak', 'espeak' or 'auto'
+        'rate': 180,                # words per minute
+        'voice': 'en',
+    },
+
+    # Speech of the known phrases synthesized in advance (see audioCache.py)
+    'audio_cache':
+    {
+        'enable': False,
+        'max_mb': 32,               # size of the LRU cache
+        'storage': 'memory',        # 'memory' or 'disk' (.audio_cache/, kept between runs)
+        'workers': 2,               # espeak processes synthesizing in the background
+    },
+
+    # Synthesis of the prompts that can follow the selected menu level (see promptPredictor.py),
+    # needs the audio cache
+    'prompt_prediction':
+    {
+        'enable': False,
+    },
+
+    # Circuit breaker around the backend (see circuitBreaker.py)
+    'circuit_breaker':
+    {
+        'enable': False,
+        'failure_threshold': 3,     # consecutive failures that open the breaker
+        'open_time': 5,             # s, before a trial request is let through
+        'probe_interval': 2,        # s, health probe while the breaker is not closed
+        'min_timeout': 0.5,         # s, lower bound of the adaptive timeout
+        'timeout_factor': 3,        # adaptive timeout = timeout_factor * p99 latency
+    },
+
+    # Item states kept up to date by the openHAB events stream (see itemStateCache.py)
+    'state_cache':
+    {
+        'enable': False,
+        'ttl': 30,          # s, age after which a state is fetched again while the events stream is down
+    },
+
+    # Trackbar (see liveTrackbar.py)
+    'trackbar':
+    {
+        'live': False,      # send the values while TRACK is held, not only on OK
+        'max_rate': 4,      # max number of live requests per second (0: no limit)
+    },
+
+    # Outbound queue of the posted states (see commandQueue.py)
+    'command_queue':
+    {
+        'enable': False,
+        'max_retries': 5,   # on connection errors
+        'backoff': 0.5,     # s, delay before the first retry, doubled for each retry
+        'max_backoff': 8.0, # s
+        'max_age': 300,     # s, older commands saved by a previous run are not sent
+    },
+
+    # Prefetch of the item states below a selected area / function (see statePrefetch.py)
+    'prefetch':
+    {
+        'enable': False,
+        'workers': 4,       # number of concurrent requests
+        'max_items': 40,    # max number of items fetched per selection
+        'ttl': 10,          # s, how long a prefetched state is used (without state_cache)
+    },
+
+    # Item tree discovered from openHAB instead of itemTree.py (see itemDiscovery.py)
+    'discovery':
+    {
+        'enable': False,
+        'refresh_interval': 600,    # s, how often the server is checked for changed items
+        'tag': None,                # if set, only the items with this tag
     }
 }
 
@@ -81,6 +210,22 @@ class PoseEvent(Event):
                     pose_action,
                     trigger = trigger)
 
+class ComboEvent(Event):
+    def __init__(self, hand, combo):
+        super().__init__("Combo",
+                    hand,
+                    combo,
+                    trigger = "enter")
+        self.combo = combo
+
+class MotionEvent(Event):
+    def __init__(self, hand, motion_action, motion):
+        super().__init__("Motion",
+                    hand,
+                    motion_action,
+                    trigger = "enter")
+        self.motion = motion
+
 class EventHist:
     def __init__(self, triggered=False, first_triggered=False, time=0, frame_nb=0):
         self.triggered = triggered
@@ -109,7 +254,8 @@ def merge_config(c1, c2):
     for k1,v1 in c1.items():
         if k1 in c2:
             if isinstance(v1, dict):
-                assert isinstance(c2[k1], dict), f"{c2[k1]} should be a dictionary"
+                if not isinstance(c2[k1], dict):
+                    raise HgcException(f"{c2[k1]} should be a dictionary")
                 res[k1] = merge_config(v1, c2[k1])
             else:
                 res[k1] = c2[k1]
@@ -125,32 +271,86 @@ def check_mandatory_keys(dic, mandatory_keys):
     Check that mandatory keys are present in a dic
     """
     for k in mandatory_keys:
-        assert k in dic.keys(), f"Mandatory key '{k}' not present in {dic}"
+        if k not in dic.keys():
+            raise HgcException(f"Mandatory key '{k}' not present in {dic}")
+
+def parse_pose_actions(pose_actions, pose_params):
+    """
+    Check the pose actions of a config and complete them with the default 'pose_params'.
+    Returns a new list, 'pose' of each pose action is expanded into a list of poses.
+    Raises HgcException on an invalid pose action (unlike assert, this also works with python -O).
+    """
+    mandatory_keys = ['name', 'pose']
+    optional_keys = pose_params.keys()
+    res = []
+    for pa in pose_actions:
+        if not isinstance(pa, dict):
+            raise HgcException(f"Pose action {pa} should be a dictionary")
+        check_mandatory_keys(pa, mandatory_keys)
+        pose = pa['pose']
+        if isinstance(pose, (list, tuple)):
+            for x in pose:
+                if x not in ALL_POSES:
+                    raise HgcException(f"Incorrect pose {x} in {pa} !")
+            pose = list(pose)
+        elif pose == 'ALL':
+            pose = list(ALL_POSES)
+        else:
+            # 'pose' is a single pose. Transform it into a list
+            if pose not in ALL_POSES:
+                raise HgcException(f"Incorrect pose {pose} in {pa} !")
+            pose = [pose]
+        optional_args = {k:pa.get(k, pose_params[k]) for k in optional_keys}
+        mandatory_args = {'name': pa['name'], 'pose': pose}
+        all_args = merge_dicts(mandatory_args, optional_args)
+        if all_args['trigger'] not in ALL_TRIGGERS:
+            raise HgcException(f"Incorrect trigger {all_args['trigger']} in {pa} !")
+        if all_args['hand'] not in ['left', 'right', 'any']:
+            raise HgcException(f"Incorrect hand {all_args['hand']} in {pa} !")
+        for k in ['first_trigger_delay', 'next_trigger_delay', 'max_missing_frames']:
+            if not isinstance(all_args[k], (int, float)) or isinstance(all_args[k], bool) or all_args[k] < 0:
+                raise HgcException(f"Incorrect {k} {all_args[k]} in {pa} !")
+        res.append(all_args)
+    return res
 
 class HandController:
-    def __init__(self, ic, config={}):
+    def __init__(self, ic, config={}, tracker=None):
+        """
+        ic: the item controller (callbacks and config), see itemControl.py
+        tracker: a HandTracker-like object, created from the config if None
+                 (a fake tracker can be given here, see replayHarness.py)
+        """
         self.item_controller = ic
-        self.config = merge_config(DEFAULT_CONFIG, ic.config)
+        from configLoader import CompiledConfig
+        if isinstance(ic.config, CompiledConfig):
+            # Already merged, validated and parsed by configLoader (read-only)
+            self.config = ic.config
+            self.pose_actions = list(self.config['pose_actions'])
+        else:
+            self.config = merge_config(copy.deepcopy(DEFAULT_CONFIG), ic.config)
 
-        # Parse pose config (Pose list is stored in self.poses)
-        self.parse_poses()
+            # Parse pose config (Pose list is stored in self.poses)
+            self.parse_poses()
+
+            # Forcing solo mode and use_gesture
+            self.config['tracker']['args']['solo'] = True
+            self.config['tracker']['args']['use_gesture'] = True
 
         # Keep records of previous pose status 
         self.poses_hist = [EventHist() for i in range(len(self.pose_actions))]
 
         # HandTracker
-        tracker_version = self.config['tracker']['version']
-        if tracker_version == 'edge':
-            from HandTrackerEdge import HandTracker
-        else: # 'host'
-            #from HandTracker import HandTracker
-            print(f'tracker version {tracker_version} not supported on Pi. Continuing with version edge.')
-            pass
-        # Forcing solo mode and use_gesture
-        self.config['tracker']['args']['solo'] = True
-        self.config['tracker']['args']['use_gesture'] = True
-        # Init tracker
-        self.tracker = HandTracker(**self.config['tracker']['args'])
+        if tracker is None:
+            tracker_version = self.config['tracker']['version']
+            if tracker_version == 'edge':
+                from HandTrackerEdge import HandTracker
+            else: # 'host'
+                #from HandTracker import HandTracker
+                print(f'tracker version {tracker_version} not supported on Pi. Continuing with version edge.')
+                from HandTrackerEdge import HandTracker
+            # Init tracker
+            tracker = HandTracker(**self.config['tracker']['args'])
+        self.tracker = tracker
 
         # Renderer
         self.use_renderer = self.config['renderer']['enable']
@@ -159,6 +359,52 @@ class HandController:
             self.renderer = HandTrackerRenderer(self.tracker, **self.config['renderer']['args'])
 
         self.frame_nb = 0
+
+        # Gesture voting
+        self.voter = None
+        if self.config['voting']['enable']:
+            from gestureVoting import GestureVoter
+            voting = self.config['voting']
+            self.voter = GestureVoter(voting['window'], voting['enter_ratio'], voting['exit_ratio'])
+
+        # Pose sequences (combos)
+        self.combo_recognizer = None
+        self.set_combos(self.config.get('combos'))
+
+        # Dynamic gestures
+        self.motion_recognizer = None
+        self.set_motion_actions(self.config.get('motion_actions'))
+
+        # Hot reload
+        self.reloader = None
+        if self.config['reload']['enable']:
+            from configReloader import ConfigReloader
+            self.reloader = ConfigReloader(self, self.config['reload']['interval'])
+            self.reloader.start()
+
+    def set_pose_actions(self, pose_actions):
+        """ Replace the (already parsed) pose actions, e.g. on hot reload. Resets the pose history. """
+        poses_hist = [EventHist() for i in range(len(pose_actions))]
+        self.pose_actions, self.poses_hist = pose_actions, poses_hist
+
+    def set_motion_actions(self, motion_actions):
+        """ Replace the motion actions (dynamic gestures). None or [] disables the motion recognition. """
+        if motion_actions:
+            from dynamicGestures import MotionRecognizer, parse_motion_actions
+            self.motion_actions = parse_motion_actions(motion_actions)
+            if self.motion_recognizer is None:
+                self.motion_recognizer = MotionRecognizer(**self.config['motion_params'])
+        else:
+            self.motion_actions = []
+            self.motion_recognizer = None
+
+    def set_combos(self, combos):
+        """ Replace the combos (pose sequences). None or [] disables the combo recognition. """
+        if combos:
+            from comboRecognizer import ComboRecognizer
+            self.combo_recognizer = ComboRecognizer(combos, **self.config['combo_params'])
+        else:
+            self.combo_recognizer = None
         
 
     def parse_poses(self):
@@ -183,26 +429,7 @@ class HandController:
                 - hand: specify the handedness = hand used to make the pose.
                         Values: 'left', 'right', 'any' (default)
         """
-        mandatory_keys = ['name', 'pose']
-        optional_keys = self.config['pose_params'].keys()
-        self.pose_actions = []
-        if 'pose_actions' in self.config:
-            for pa in self.config['pose_actions']:
-                check_mandatory_keys(pa, mandatory_keys)
-                pose = pa['pose']
-                if isinstance(pose, list):
-                    for x in pose:
-                        assert x in ALL_POSES, f"Incorrect pose {x} in {pa} !"
-                elif pose == 'ALL':
-                    pa['pose'] = ALL_POSES
-                else:
-                    # 'pose' is a single pose. Transform it into a list
-                    assert pose in ALL_POSES, f"Incorrect pose {pose} in {pa} !"
-                    pa['pose'] = [pose]
-                optional_args = {k:pa.get(k, self.config['pose_params'][k]) for k in optional_keys}
-                mandatory_args = { k:pa[k] for k in mandatory_keys}
-                all_args = merge_dicts(mandatory_args, optional_args)
-                self.pose_actions.append(all_args)
+        self.pose_actions = parse_pose_actions(self.config.get('pose_actions', []), self.config['pose_params'])
             
 
     def generate_events(self, hands):
@@ -254,12 +481,32 @@ class HandController:
                     hist.first_triggered = False 
                     if trigger == "enter_leave":
                         events.append(PoseEvent(hand, pa, "leave")) 
+
+        if self.motion_recognizer:
+            motion = self.motion_recognizer.update(hand, self.now)
+            if motion:
+                for ma in self.motion_actions:
+                    if ma['motion'] == motion:
+                        events.append(MotionEvent(hand, ma, motion))
+
+        if self.combo_recognizer:
+            for combo in self.combo_recognizer.update(hand, self.now):
+                events.append(ComboEvent(hand, combo))
+                # The pose ending the combo must not trigger its own pose action too
+                if hand and hand.gesture:
+                    for i, pa in enumerate(self.pose_actions):
+                        if hand.gesture in pa['pose'] and pa['trigger'] != "continuous":
+                            self.poses_hist[i].triggered = True
+                            self.poses_hist[i].frame_nb = self.frame_nb
         return events    
 
     def process_events(self, events):
         for e in events:
             if e.callback == "_DEFAULT_":
                 default_callback(e)
+            elif e.category == "Combo":
+                # A combo can start with the wake up pose, so it is handled even when sleeping
+                self.item_controller.handle_combo(e)
             else:
                 if e.callback == "wake_up":
                     self.item_controller.wake_up(e)
@@ -267,19 +514,37 @@ class HandController:
                     if self.item_controller.awake == True:
                         self.item_controller.handle_event(e)
 
+    def process_frame(self, hands, now=None):
+        """
+        Runs the controller logic for one frame: generates the events from hands
+        and processes them. now: timestamp in s (default: monotonic()).
+        Returns the list of events.
+        """
+        self.now = monotonic() if now is None else now
+        self.frame_nb += 1
+        if self.reloader:
+            self.reloader.apply()
+        self.item_controller.poll()
+        if self.voter:
+            hands = self.voter.filter(hands)
+        events = self.generate_events(hands)
+        self.process_events(events)
+        return events
+
     def loop(self):
         while True:
-            self.now = monotonic()
             frame, hands, bag = self.tracker.next_frame()
             if frame is None: break
-            self.frame_nb += 1
-            events = self.generate_events(hands)
-            self.process_events(events)
+            self.process_frame(hands)
 
             if self.use_renderer:
-                frame = self.renderer.draw(frame, hands, self.item_controller.to_display, self.item_controller.selections, bag)
+                frame = self.renderer.draw(frame, hands, self.item_controller.to_display, self.item_controller.selections, bag,
+                                           self.item_controller.status())
                 key = self.renderer.waitKey(delay=1)
                 if key == 27 or key == ord('q'):
                     break
-        self.renderer.exit()
+        if self.reloader:
+            self.reloader.stop()
+        if self.use_renderer:
+            self.renderer.exit()
         self.tracker.exit()
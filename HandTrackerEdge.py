@@ -407,8 +407,8 @@ class HandTracker:
             r.gesture = None
         # ---------------------------------------------------------------
         #print(f'HandTrackerEdge recognize_gesture: {r.gesture}')
-        if r.gesture is not None:
-            r.distance_4_8 = d_4_8
+        # Always set, the gesture voting of the HandController may replace a None gesture
+        r.distance_4_8 = d_4_8
         if r.gesture == 'FOUR':
             if d_8_12 < 0.1 and d_12_16 < 0.15 and d_15_20 < 0.1:
                 r.gesture = 'BACK'
@@ -458,7 +458,7 @@ class HandTracker:
             # hand.norm_landmarks contains the normalized ([0:1]) 3D coordinates of landmarks in the square rotated body bounding box
             hand.norm_landmarks = np.array(res['rrn_lms']).reshape(-1,3)
             # hand.landmarks = the landmarks in the image coordinate system (in pixel)
-            hand.landmarks = (np.array(res["sqn_lms"]) * self.frame_size).reshape(-1,2).astype(np.int)
+            hand.landmarks = (np.array(res["sqn_lms"]) * self.frame_size).reshape(-1,2).astype(int)
             if self.pad_h > 0:
                 hand.landmarks[:,1] -= self.pad_h
                 for i in range(len(hand.rect_points)):
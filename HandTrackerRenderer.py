@@ -6,6 +6,15 @@ LINES_HAND = [[0,1],[1,2],[2,3],[3,4],
             [5,9],[9,10],[10,11],[11,12],
             [9,13],[13,14],[14,15],[15,16],
             [13,17],[17,18],[18,19],[19,20],[0,17]]
+# Landmark indexes of the bones, shape (21, 2): hand.landmarks[LINES_HAND_IDX] are the segments to draw
+LINES_HAND_IDX = np.array(LINES_HAND)
+# Finger of each landmark (0: wrist, 1: thumb ... 5: little), index in the finger states of draw_landmarks()
+FINGER_OF_LANDMARK = np.array([0] + [1]*4 + [2]*4 + [3]*4 + [4]*4 + [5]*4)
+# Colors (BGR) of the landmarks by finger state + 1 (1=open, 0=close, -1=unknown)
+FINGER_STATE_COLORS = np.array([(50, 50, 50), (50, 50, 50), (205, 205, 205)])
+
+# Colors (BGR) of the status line, by circuit breaker state (see circuitBreaker.py)
+STATUS_COLORS = {'closed': (0,160,0), 'half-open': (0,140,255), 'open': (0,0,230)}
 
 
 class HandTrackerRenderer:
@@ -33,6 +42,9 @@ class HandTrackerRenderer:
         self.show_fps = False
         self.show_inferences_status = False
 
+        # Cached text overlays (selection, status): name -> (key, overlay), see draw_overlay()
+        self.overlays = {}
+
         if output is None:
             self.output = None
         else:
@@ -44,29 +56,87 @@ class HandTrackerRenderer:
         y = int(x_y[1] * self.tracker.frame_size - self.tracker.pad_h)
         return (x, y)
 
-    def draw_selection(self, todisplay, selection):
+    def selection_lines(self, todisplay, selection):
+        lines = [str(todisplay)]
+        for k, v in selection.items():
+            #text = f'{k}: {v}'
+            if k == 'item' and 'label' in selection:  # show label,  not name, if it's in selection
+                continue
+            if k == 'items':    # a group is shown by its label
+                continue
+            lines.append(str(v))
+        return lines
+
+    def render_selection(self, img, lines):
         font = cv2.FONT_HERSHEY_PLAIN
         font_thickness = 1
         dist_x = 20
         dist_y = 30
         
-        (w, h), _ = cv2.getTextSize(todisplay, font, 1, font_thickness)
-        cv2.rectangle(self.frame, (dist_x, dist_y-h-5), (dist_x + w, dist_y+5), (240, 240, 240), -1)
+        (w, h), _ = cv2.getTextSize(lines[0], font, 1, font_thickness)
+        cv2.rectangle(img, (dist_x, dist_y-h-5), (dist_x + w, dist_y+5), (240, 240, 240), -1)
         # cv2.putText(image, text, org, font, fontScale, color[, thickness[, lineType[, bottomLeftOrigin]]])
-        cv2.putText(self.frame, todisplay, (dist_x, dist_y), font, 1, (15,15,15), font_thickness)
+        cv2.putText(img, lines[0], (dist_x, dist_y), font, 1, (15,15,15), font_thickness)
         dist_y += (h + 13)
         # Draw user selections:
-        for k, v in selection.items():
-            #text = f'{k}: {v}'
-            if k == 'item' and 'label' in selection:  # show label,  not name, if it's in selection
-                continue
-            text = v
+        for text in lines[1:]:
             (w, h), _ = cv2.getTextSize(text, font, 1, 2)
-            cv2.rectangle(self.frame, (dist_x + 30, dist_y-h-5), (50 + w, dist_y+5), (240, 240, 240), -1)
+            cv2.rectangle(img, (dist_x + 30, dist_y-h-5), (50 + w, dist_y+5), (240, 240, 240), -1)
             # cv2.putText(image, text, org, font, fontScale, color[, thickness[, lineType[, bottomLeftOrigin]]])
-            cv2.putText(self.frame, text, (dist_x + 30, dist_y), font, 1, (15,15,15), font_thickness)
+            cv2.putText(img, text, (dist_x + 30, dist_y), font, 1, (15,15,15), font_thickness)
             dist_y += (h + 13)
 
+    def render_overlay(self, render, shape):
+        """
+        Renders an overlay once with render(img): returns the bounding box (y0, y1, x0, x1), the pixels
+        and the mask of the drawn pixels inside the box, or None if nothing is drawn.
+        """
+        # Drawn on a black and on a white canvas: the pixels that are the same on both are drawn
+        black = np.zeros(shape, dtype=np.uint8)
+        white = np.full(shape, 255, dtype=np.uint8)
+        render(black)
+        render(white)
+        mask = (black == white).all(axis=2)
+        rows = np.flatnonzero(mask.any(axis=1))
+        cols = np.flatnonzero(mask.any(axis=0))
+        if len(rows) == 0:
+            return None
+        y0, y1, x0, x1 = rows[0], rows[-1] + 1, cols[0], cols[-1] + 1
+        # Mask with the 3 channels: np.copyto() is much slower with a broadcast mask
+        mask = np.repeat(mask[y0:y1, x0:x1, None], 3, axis=2)
+        return (y0, y1, x0, x1), black[y0:y1, x0:x1].copy(), mask
+
+    def draw_overlay(self, name, key, render):
+        """ Draws the overlay name, rendered with render(img) again only when key changes. """
+        # The texts change a few times a minute: no text rendering in most frames
+        key = (key, self.frame.shape)
+        cached = self.overlays.get(name)
+        if cached is None or cached[0] != key:
+            cached = self.overlays[name] = (key, self.render_overlay(render, self.frame.shape))
+        if cached[1] is not None:
+            (y0, y1, x0, x1), pixels, mask = cached[1]
+            np.copyto(self.frame[y0:y1, x0:x1], pixels, where=mask)
+
+    def draw_selection(self, todisplay, selection):
+        lines = self.selection_lines(todisplay, selection)
+        self.draw_overlay('selection', tuple(lines), lambda img: self.render_selection(img, lines))
+
+    def draw_landmarks(self, hand, thick_coef):
+        # All the bones in one polylines() call
+        cv2.polylines(self.frame, hand.landmarks[LINES_HAND_IDX, :2].astype(np.int32), False, (255, 255, 255), int(1+thick_coef*1), cv2.LINE_AA)
+        radius = int(1+thick_coef*5)
+        points = hand.landmarks[:,:2].astype(np.int32).tolist()
+        if self.tracker.use_gesture:
+            # color depending on finger state
+            states = np.array([-1, hand.thumb_state, hand.index_state, hand.middle_state, hand.ring_state, hand.little_state])
+            colors = FINGER_STATE_COLORS[states[FINGER_OF_LANDMARK] + 1].tolist()
+        else:
+            colors = [(0,128,255)] * len(points)
+        # One cv2.circle() per landmark is faster than stamping a cached disc with numpy
+        # (see benchmarks/bench_draw_hand.py)
+        for point, color in zip(points, colors):
+            cv2.circle(self.frame, point, radius, color, -1)
+
     def draw_hand(self, hand):
         if self.tracker.use_lm:
             # (info_ref_x, info_ref_y): coords in the image of a reference point 
@@ -80,26 +150,7 @@ class HandTrackerRenderer:
                 if self.show_rot_rect:
                     cv2.polylines(self.frame, [np.array(hand.rect_points)], True, (0,255,255), 2, cv2.LINE_AA)
                 if self.show_landmarks:
-                    lines = [np.array([hand.landmarks[point] for point in line]).astype(np.int) for line in LINES_HAND]
-                    cv2.polylines(self.frame, lines, False, (255, 255, 255), int(1+thick_coef*1), cv2.LINE_AA)
-                    radius = int(1+thick_coef*5)
-                    if self.tracker.use_gesture:
-                        # color depending on finger state (1=open, 0=close, -1=unknown)
-                        color = { 1: (205, 205, 205), 0: (50, 50, 50), -1:(50, 50, 50)}
-                        cv2.circle(self.frame, (hand.landmarks[0][0], hand.landmarks[0][1]), radius, color[-1], -1)
-                        for i in range(1,5):
-                            cv2.circle(self.frame, (hand.landmarks[i][0], hand.landmarks[i][1]), radius, color[hand.thumb_state], -1)
-                        for i in range(5,9):
-                            cv2.circle(self.frame, (hand.landmarks[i][0], hand.landmarks[i][1]), radius, color[hand.index_state], -1)
-                        for i in range(9,13):
-                            cv2.circle(self.frame, (hand.landmarks[i][0], hand.landmarks[i][1]), radius, color[hand.middle_state], -1)
-                        for i in range(13,17):
-                            cv2.circle(self.frame, (hand.landmarks[i][0], hand.landmarks[i][1]), radius, color[hand.ring_state], -1)
-                        for i in range(17,21):
-                            cv2.circle(self.frame, (hand.landmarks[i][0], hand.landmarks[i][1]), radius, color[hand.little_state], -1)
-                    else:
-                        for x,y in hand.landmarks[:,:2]:
-                            cv2.circle(self.frame, (int(x), int(y)), radius, (0,128,255), -1)
+                    self.draw_landmarks(hand, thick_coef)
 
                 if self.show_handedness:
                     cv2.putText(self.frame, f"{hand.label.upper()} {hand.handedness:.2f}", 
@@ -147,13 +198,29 @@ class HandTrackerRenderer:
             if nb_lm_inferences:
                 cv2.rectangle(self.frame, (3*u, 8*u), ((3+nb_lm_inferences)*u, 9*u), (0,0,255), -1)
 
-    def draw(self, frame, hands, todisplay, selection, bag={}):
+    def render_status(self, img, status):
+        """ status: (state, text) """
+        state, text = status
+        font = cv2.FONT_HERSHEY_PLAIN
+        (w, h), _ = cv2.getTextSize(text, font, 1, 1)
+        x = img.shape[1] - w - 20
+        y = 30
+        color = STATUS_COLORS.get(state, (15,15,15))
+        cv2.rectangle(img, (x-5, y-h-5), (x+w+5, y+5), (240, 240, 240), -1)
+        cv2.putText(img, text, (x, y), font, 1, color, 1)
+
+    def draw_status(self, status):
+        self.draw_overlay('status', tuple(status), lambda img: self.render_status(img, status))
+
+    def draw(self, frame, hands, todisplay, selection, bag={}, status=None):
         self.frame = frame
         if bag:
             self.draw_bag(bag)
         for hand in hands:
             self.draw_hand(hand)
         self.draw_selection(todisplay, selection)
+        if status:
+            self.draw_status(status)
         return self.frame
 
     def exit(self):
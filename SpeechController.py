@@ -1,29 +1,438 @@
+"""
+Speech output with a long-lived speech engine, instead of a new espeak process per text.
+
+A worker thread speaks the texts with the first engine available:
+    - LibEspeakEngine: libespeak-ng (or libespeak) loaded with ctypes. The voice is loaded
+      once, the text is synthesized to PCM in the worker thread and played by a persistent
+      aplay process (AudioSink) reading raw PCM on its stdin.
+    - EspeakProcessEngine: one espeak process, started once, reading the texts line by line
+      on its stdin.
+    - no engine (no espeak installed): the texts are only printed.
+With an AudioCache (audioCache.py), the cached texts are played at once through a persistent
+AudioSink, only the other texts are synthesized.
+The texts wait in a queue ordered by priority (say()): a text with a coalescing key replaces
+a waiting text with the same key (trackbar values), and a text may interrupt the text being
+spoken, unless that one has a higher priority (a confirmation is not cut by a prompt).
+Cancelling stops the synthesis and cuts the audio already sent to the sound card by
+restarting the player (resp. the espeak process).
+Every child process is waited for, so no zombie processes are left.
+The time from say() to the first audio sample (time to first audio) is measured, see metrics().
+"""
+import ctypes
+import ctypes.util
+import shutil
 import subprocess
-import os
-import signal
+import threading
+from collections import deque
+from time import monotonic, perf_counter
+
+import numpy as np
+
+RATE = 180      # words per minute
+VOICE = 'en'
+
+
+def stop_process(proc, timeout=0.5):
+    """ Terminates proc and waits for it (no zombie). """
+    if proc is None:
+        return
+    if proc.stdin:
+        try:
+            proc.stdin.close()
+        except OSError:
+            pass
+    if proc.poll() is None:
+        proc.terminate()
+        try:
+            proc.wait(timeout)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+            proc.wait()
+
+
+def terminate_process(proc):
+    """ Signals proc to terminate, without waiting: stop_process() reaps it later. """
+    if proc is not None and proc.poll() is None:
+        proc.terminate()
+
+
+def reap_processes(procs):
+    """ stop_process() the processes terminated by a cancel() (list emptied). """
+    while procs:
+        stop_process(procs.pop())
+
+
+class AudioSink:
+    """ Persistent aplay process playing raw mono 16 bit PCM written to its stdin. """
+    def __init__(self, sample_rate):
+        self.sample_rate = sample_rate
+        self.proc = None
+        self.stopping = []          # players terminated by cancel(), reaped by write()
+        self.playing_until = 0      # monotonic time when the audio written so far has been played
+
+    def write(self, pcm):
+        reap_processes(self.stopping)
+        proc = self.proc
+        if proc is None or proc.poll() is not None:
+            stop_process(proc)
+            proc = self.proc = subprocess.Popen(['aplay', '-q', '-t', 'raw', '-f', 'S16_LE', '-c', '1', '-r', str(self.sample_rate)],
+                                                stdin=subprocess.PIPE)
+        # Before writing: a write blocks while the pipe is full, cancel() must see it is playing
+        self.playing_until = max(self.playing_until, monotonic()) + len(pcm) / (2 * self.sample_rate)
+        try:
+            proc.stdin.write(pcm)
+            proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            # Stopped by cancel()
+            return False
+        return True
+
+    def is_playing(self):
+        return monotonic() < self.playing_until
+
+    def cancel(self):
+        """
+        Cuts the audio being played, without waiting for the player (cancel() is called from
+        the gesture loop). The player is started again by the next write(). Returns True if it was playing.
+        """
+        playing = self.is_playing()
+        if playing and self.proc is not None:
+            terminate_process(self.proc)
+            self.stopping.append(self.proc)
+            self.proc = None
+        self.playing_until = 0
+        return playing
+
+    def close(self):
+        reap_processes(self.stopping)
+        stop_process(self.proc)
+        self.proc = None
+
+
+class LibEspeakEngine:
+    name = 'libespeak'
+
+    AUDIO_OUTPUT_SYNCHRONOUS = 2
+    espeakRATE = 1
+    POS_CHARACTER = 1
+    espeakCHARS_UTF8 = 1
+
+    SYNTH_CALLBACK = ctypes.CFUNCTYPE(ctypes.c_int, ctypes.POINTER(ctypes.c_short), ctypes.c_int, ctypes.c_void_p)
+
+    def __init__(self, rate=RATE, voice=VOICE):
+        """ Raises OSError if libespeak or aplay is not available. """
+        path = ctypes.util.find_library('espeak-ng') or ctypes.util.find_library('espeak')
+        if path is None or shutil.which('aplay') is None:
+            raise OSError('libespeak or aplay not found')
+        self.lib = ctypes.CDLL(path)
+        sample_rate = self.lib.espeak_Initialize(self.AUDIO_OUTPUT_SYNCHRONOUS, 100, None, 0)
+        if sample_rate <= 0:
+            raise OSError('espeak_Initialize failed')
+        # Keep a reference to the callback, it must not be garbage collected
+        self.callback = self.SYNTH_CALLBACK(self.synth_callback)
+        self.lib.espeak_SetSynthCallback(self.callback)
+        self.lib.espeak_SetParameter(self.espeakRATE, rate, 0)
+        self.lib.espeak_SetVoiceByName(voice.encode())
+        self.sink = AudioSink(sample_rate)
+        self.cancelled = threading.Event()
+        self.synthesizing = False
+        self.on_audio = None
+
+    def synth_callback(self, wav, nb_samples, events):
+        if self.cancelled.is_set():
+            return 1    # abort the synthesis
+        if nb_samples > 0:
+            self.on_audio(ctypes.string_at(wav, nb_samples * 2))
+        return 0
+
+    def synth(self, text, on_audio):
+        """ Synthesizes text, calls on_audio(pcm) for each chunk. Returns False if cancelled. """
+        self.on_audio = on_audio
+        data = text.encode() + b'\0'
+        self.synthesizing = True
+        try:
+            self.lib.espeak_Synth(data, len(data), 0, self.POS_CHARACTER, 0, self.espeakCHARS_UTF8, None, None)
+        finally:
+            self.synthesizing = False
+        return not self.cancelled.is_set()
+
+    def speak(self, text, first_audio):
+        """
+        Speaks text, calls first_audio() when the first sample goes to the sound card.
+        Returns when the text has been played, False if it was cancelled.
+        """
+        started = []
+        def play(pcm):
+            # Skip the leading silence
+            if not started:
+                samples = np.frombuffer(pcm, dtype=np.int16)
+                sound = np.flatnonzero(np.abs(samples) > 64)
+                if len(sound) == 0:
+                    return
+                pcm = pcm[2 * sound[0]:]
+                first_audio()
+                started.append(True)
+            if not self.sink.write(pcm):
+                self.cancelled.set()
+        if not self.synth(text, play):
+            return False
+        return not self.cancelled.wait(max(0, self.sink.playing_until - monotonic()))
+
+    def reset(self):
+        """ Called before the next text is taken: a cancel() from then on cancels it. """
+        self.cancelled.clear()
+
+    def cancel(self):
+        """ Returns True if a text was cut. """
+        self.cancelled.set()
+        return self.sink.cancel() or self.synthesizing
+
+    def close(self):
+        self.sink.close()
+        self.lib.espeak_Terminate()
+
+
+class EspeakProcessEngine:
+    name = 'espeak'
+
+    def __init__(self, rate=RATE, voice=VOICE):
+        """ Raises OSError if espeak is not installed. """
+        self.command = shutil.which('espeak') or shutil.which('espeak-ng')
+        if self.command is None:
+            raise OSError('espeak not found')
+        self.args = [self.command, '-s', str(rate), '-v', voice]
+        self.proc = None
+        self.stopping = []      # espeak processes terminated by cancel(), reaped by speak()
+        self.rate = rate
+        self.speaking_until = 0
+        self.cancelled = threading.Event()
+
+    def speak(self, text, first_audio):
+        """ Returns when the text has (probably) been spoken, False if it was cancelled. """
+        if self.cancelled.is_set():
+            return False
+        reap_processes(self.stopping)
+        proc = self.proc    # cancel() may reset self.proc meanwhile
+        if proc is None or proc.poll() is not None:
+            stop_process(proc)
+            # Without a text argument, espeak speaks each line read on stdin
+            proc = self.proc = subprocess.Popen(self.args, stdin=subprocess.PIPE, text=True)
+        try:
+            proc.stdin.write(' '.join(text.split()) + '\n')
+            proc.stdin.flush()
+        except (BrokenPipeError, ValueError):
+            return False
+        # espeak does not tell when it speaks: the time the text is handed over is taken
+        first_audio()
+        # espeak does not tell when it is done either: wait for the estimated end of the speech
+        self.speaking_until = max(self.speaking_until, monotonic()) + 0.3 + 60 * len(text.split()) / self.rate
+        return not self.cancelled.wait(self.speaking_until - monotonic())
+
+    def reset(self):
+        """ Called before the next text is taken: a cancel() from then on cancels it. """
+        self.cancelled.clear()
+
+    def cancel(self):
+        """ Returns True if a text was cut. """
+        self.cancelled.set()
+        speaking = monotonic() < self.speaking_until
+        if speaking and self.proc is not None:
+            # Without waiting, cancel() is called from the gesture loop
+            terminate_process(self.proc)
+            self.stopping.append(self.proc)
+            self.proc = None
+        self.speaking_until = 0
+        return speaking
+
+    def close(self):
+        reap_processes(self.stopping)
+        stop_process(self.proc)
+        self.proc = None
+
+
+ENGINES = {'libespeak': LibEspeakEngine, 'espeak': EspeakProcessEngine}
+
+
+# Priorities of say()
+LOW = 0         # e.g. trackbar values
+NORMAL = 1      # prompts
+HIGH = 2        # confirmations and errors
+
+
+class Utterance:
+    def __init__(self, text, priority, key, seq):
+        self.text = text
+        self.priority = priority
+        self.key = key
+        self.seq = seq
+        self.t_say = perf_counter()
+
 
 class SpeechController:
     """ This class handles the speech output to give an auditive feedback to the user's input. """
-    def __init__(self):
-        self.pid = None
-        self.proc = None
-        #------------------------------------------------
-        #print(f'SpeechController pid: {self.pid}')
-        #------------------------------------------------
-
-    def say(self, text):
-        #print(f'SpeechController say(): {text}')
-        #print(f'SpeechController os.getpid(): {os.getpid()}')
-        p = subprocess.Popen(["espeak","-s180 -ven+18 -z",text])
-        p.daemon = True
-        #print(p)
-        #print(f'SpeechController say() p.pid: {p.pid}')
-        self.proc = p
-        self.pid = p.pid
+    def __init__(self, engine='auto', rate=RATE, voice=VOICE, audio_cache=None, max_queue=5):
+        """
+        engine: 'libespeak', 'espeak' or 'auto' (the first one available, in this order)
+        audio_cache: AudioCache with the same rate and voice, or None
+        max_queue: max number of texts waiting, the oldest of the lowest priority are dropped
+        """
+        self.engine_names = list(ENGINES) if engine == 'auto' else [engine]
+        self.rate = rate
+        self.voice = voice
+        self.engine = None
+        self.audio_cache = audio_cache
+        self.sink = None        # plays the cached audio
+        self.max_queue = max_queue
+
+        self.lock = threading.Condition()
+        self.queue = []         # waiting Utterances, by priority (highest first), then in order
+        self.current = None     # Utterance being spoken
+        self.cancelled = threading.Event()
+        self.seq = 0
+        self.stopped = False
+
+        # Metrics
+        self.nb_said = 0
+        self.nb_cancelled = 0       # by kill_proc()
+        self.nb_interrupted = 0     # cut by a text with a higher or the same priority
+        self.nb_coalesced = 0       # replaced by a newer text with the same key
+        self.nb_dropped = 0         # dropped from the queue before being spoken
+        self.max_depth = 0
+        self.first_audio_times = deque(maxlen=100)  # s, from say() to the first audio sample
+        self.wait_times = deque(maxlen=100)         # s, from say() to the start of the speech
+
+        # Started last: the worker uses all of the above
+        self.thread = threading.Thread(target=self.run, name='SpeechController', daemon=True)
+        self.thread.start()
+
+    def create_engine(self):
+        for name in self.engine_names:
+            try:
+                engine = ENGINES[name](self.rate, self.voice)
+                print(f'SpeechController: using {engine.name}')
+                return engine
+            except OSError as e:
+                print(f'SpeechController: {name} not available ({e})')
+        print('SpeechController: no speech engine, texts are only printed')
+        return None
+
+    def say(self, text, priority=NORMAL, key=None, interrupt=True):
+        """
+        Speaks text after the texts waiting with a higher or the same priority.
+        key: a text with the same key replaces the waiting one, and cuts the one being spoken
+             (e.g. the trackbar values supersede each other).
+        interrupt: cut the text being spoken if its priority is not higher, and drop the waiting
+             texts with a lower priority. Otherwise the text waits its turn.
+        """
+        with self.lock:
+            self.seq += 1
+            utterance = Utterance(str(text), priority, key, self.seq)
+            if key is not None:
+                queue = [u for u in self.queue if u.key != key]
+                self.nb_coalesced += len(self.queue) - len(queue)
+                self.queue = queue
+            if interrupt:
+                queue = [u for u in self.queue if u.priority >= priority]
+                self.nb_dropped += len(self.queue) - len(queue)
+                self.queue = queue
+            self.queue.append(utterance)
+            self.queue.sort(key=lambda u: (-u.priority, u.seq))
+            if len(self.queue) > self.max_queue:
+                lowest = min(u.priority for u in self.queue)
+                self.queue.remove(next(u for u in self.queue if u.priority == lowest))
+                self.nb_dropped += 1
+            self.max_depth = max(self.max_depth, len(self.queue))
+            current = self.current
+            if current is not None and ((key is not None and current.key == key) or (interrupt and current.priority <= priority)):
+                self.nb_interrupted += 1
+                self.cancel_current()
+            self.lock.notify()
+
+    def cancel_current(self):
+        """ Cuts the text being spoken. Called with the lock held. """
+        self.cancelled.set()
+        if self.engine is not None and self.engine.cancel():
+            return True
+        return self.sink is not None and self.sink.cancel()
+
+    def busy(self):
+        """ True while a text is spoken or waiting. """
+        return self.current is not None or bool(self.queue)
 
     def kill_proc(self):
-        if self.pid is not None:
-            #print(f'SpeechController kill_proc(): {self.pid}')
-            os.kill(self.pid, signal.SIGKILL)
-        self.pid = None
-        self.proc = None
+        """ Cancels the text being spoken and the texts waiting. """
+        with self.lock:
+            self.nb_cancelled += len(self.queue)
+            self.queue = []
+            if self.cancel_current():
+                self.nb_cancelled += 1
+
+    def run(self):
+        self.engine = self.create_engine()
+        while True:
+            with self.lock:
+                while not self.queue and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    break
+                utterance = self.current = self.queue.pop(0)
+                # Cleared here, under the lock: a cancel while the audio cache is read is not lost
+                self.cancelled.clear()
+                if self.engine is not None:
+                    self.engine.reset()
+            self.wait_times.append(perf_counter() - utterance.t_say)
+            first_audio = lambda t_say=utterance.t_say: self.first_audio_times.append(perf_counter() - t_say)
+            pcm = self.audio_cache.get(utterance.text) if self.audio_cache else None
+            if self.cancelled.is_set():
+                # Cancelled meanwhile: not spoken at all
+                pass
+            elif pcm:
+                self.play(pcm, first_audio)
+            elif self.engine is not None:
+                self.engine.speak(utterance.text, first_audio)
+            with self.lock:
+                self.current = None
+                self.nb_said += 1
+        if self.engine is not None:
+            self.engine.close()
+        if self.sink is not None:
+            self.sink.close()
+
+    def play(self, pcm, first_audio):
+        """ Plays cached PCM, in chunks of 0.1 s so that a cancel stops it at once. """
+        if self.sink is None:
+            engine_sink = getattr(self.engine, 'sink', None)
+            if engine_sink is not None and engine_sink.sample_rate == self.audio_cache.sample_rate:
+                self.sink = engine_sink
+            else:
+                self.sink = AudioSink(self.audio_cache.sample_rate)
+        chunk = 2 * self.sink.sample_rate // 10
+        for i in range(0, len(pcm), chunk):
+            if self.cancelled.is_set() or not self.sink.write(pcm[i:i+chunk]):
+                return False
+            if i == 0:
+                first_audio()
+        return not self.cancelled.wait(max(0, self.sink.playing_until - monotonic()))
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+        self.kill_proc()
+        self.thread.join(timeout=2)
+        if self.audio_cache:
+            self.audio_cache.close()
+
+    def metrics(self):
+        def ms(times, f):
+            return round(float(f(np.array(times))) * 1000, 1) if len(times) else None
+        metrics = {'engine': self.engine.name if self.engine else None,
+                   'said': self.nb_said, 'cancelled': self.nb_cancelled, 'interrupted': self.nb_interrupted,
+                   'coalesced': self.nb_coalesced, 'dropped': self.nb_dropped,
+                   'queue_depth': len(self.queue), 'max_queue_depth': self.max_depth,
+                   'wait_p50_ms': ms(self.wait_times, np.median),
+                   'first_audio_p50_ms': ms(self.first_audio_times, np.median),
+                   'first_audio_max_ms': ms(self.first_audio_times, np.max)}
+        if self.audio_cache:
+            metrics['cache'] = self.audio_cache.metrics()
+        return metrics
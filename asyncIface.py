@@ -0,0 +1,284 @@
+"""
+asyncio client of the openHAB REST API, on the standard library only (asyncio streams
+and a minimal HTTP/1.1 implementation), besides the blocking functions of iface.py.
+
+    - at most max_connections requests at the same time (semaphore), on kept-alive
+      connections,
+    - every request has a deadline (timeout, default read_timeout), which includes the wait
+      for a free connection: on timeout or cancellation its connection is closed, never reused,
+    - the results are like iface.py: get_state() returns the state or 'Error ...',
+      post_state() 'OK' or None, connection errors raise HgcException,
+    - http:// and https:// URLs (TLS with the default certificate checks).
+
+AsyncLoopThread runs an event loop in a background thread, next to HandController.loop():
+    loop = AsyncLoopThread().start()
+    client = AsyncRestClient()
+    future = loop.submit(client.get_states(['Kueche_LichtDimmer', 'LED_On_Off']))
+    ...
+    states = future.result()    # concurrent.futures.Future
+
+AsyncOpenhabBackend (config 'backend': {'type': 'openhab_async', 'max_connections': 4}) sends
+the item requests of all its users (state prefetch, group commands, command queue, circuit
+breaker, ...) through one AsyncRestClient, so they share one budget of max_connections
+connections instead of a thread pool each.
+"""
+import asyncio
+import concurrent.futures
+import ssl
+import threading
+from urllib.parse import urlsplit, quote
+
+import iface
+from backends import OpenhabRestBackend
+from HgcException import HgcException
+
+DEFAULT_PORTS = {'http': 80, 'https': 443}
+# s, added to the timeouts of a request before AsyncOpenhabBackend gives up on the event loop
+LOOP_MARGIN = 1
+
+
+class Response:
+    def __init__(self, status, reason, headers, body):
+        self.status = status
+        self.reason = reason
+        self.headers = headers  # lower case names
+        self.body = body
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+
+class AsyncRestClient:
+    def __init__(self, url=None, max_connections=4, connect_timeout=iface.CONNECT_TIMEOUT, read_timeout=iface.READ_TIMEOUT):
+        """ url: URL of the items (default: iface.url_str, read when the first connection is opened). """
+        self.url = url
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.semaphore = None   # created in the event loop
+        self.idle = []          # kept-alive connections (reader, writer)
+        self.ssl_context = None # created for the first https connection
+
+        # Statistics
+        self.nb_requests = 0
+        self.nb_connections = 0
+        self.nb_timeouts = 0
+
+    def target(self):
+        """ Returns (scheme, host, port, path) of the items URL. Raises HgcException for other schemes than http and https. """
+        url = urlsplit(self.url or iface.url_str)
+        if url.scheme not in DEFAULT_PORTS:
+            raise HgcException(f"Unsupported URL {url.geturl()}, should be http:// or https://")
+        return url.scheme, url.hostname, url.port or DEFAULT_PORTS[url.scheme], url.path.rstrip('/')
+
+    async def connect(self):
+        scheme, host, port, _ = self.target()
+        if scheme == 'https' and self.ssl_context is None:
+            self.ssl_context = ssl.create_default_context()
+        context = self.ssl_context if scheme == 'https' else None
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port, ssl=context), self.connect_timeout)
+        self.nb_connections += 1
+        return reader, writer
+
+    @staticmethod
+    def close_connection(conn):
+        conn[1].close()
+
+    async def request(self, method, path, body=None, headers=None, timeout=None):
+        """
+        Send a request (path relative to the items URL), returns a Response.
+        Raises HgcException on connection errors and when the deadline (timeout in s) is over,
+        also if no connection got free before the deadline.
+        """
+        if self.semaphore is None:
+            self.semaphore = asyncio.Semaphore(self.max_connections)
+        async def send():
+            async with self.semaphore:
+                self.nb_requests += 1
+                return await self.send(method, path, body, headers)
+        try:
+            return await asyncio.wait_for(send(), timeout or self.read_timeout)
+        except asyncio.TimeoutError:
+            self.nb_timeouts += 1
+            raise HgcException("Connection time out.")
+        except (OSError, asyncio.IncompleteReadError, ValueError, ssl.SSLError) as e:
+            print(f'AsyncRestClient: {method} {path} error: {e!r}')
+            raise HgcException("No connection.")
+
+    async def send(self, method, path, body, headers):
+        _, host, port, base = self.target()
+        data = body.encode() if isinstance(body, str) else (body or b'')
+        lines = [f'{method} {base}{path} HTTP/1.1', f'Host: {host}:{port}', 'Connection: keep-alive']
+        for k, v in (headers or {}).items():
+            lines.append(f'{k}: {v}')
+        if data or method in ('POST', 'PUT'):
+            lines.append(f'Content-Length: {len(data)}')
+        raw = ('\r\n'.join(lines) + '\r\n\r\n').encode() + data
+
+        # A kept-alive connection may have been closed by the server meanwhile: one retry on a new one
+        for attempt in range(2):
+            reused = bool(self.idle)
+            conn = self.idle.pop() if reused else await self.connect()
+            try:
+                conn[1].write(raw)
+                await conn[1].drain()
+                response, keep_alive = await self.read_response(conn[0])
+            except (OSError, asyncio.IncompleteReadError):
+                self.close_connection(conn)
+                if reused and attempt == 0:
+                    # The other idle connections are probably closed too (e.g. server restarted)
+                    while self.idle:
+                        self.close_connection(self.idle.pop())
+                    continue
+                raise
+            except BaseException:
+                # Cancelled or deadline over: the connection is in an unknown state
+                self.close_connection(conn)
+                raise
+            if keep_alive:
+                self.idle.append(conn)
+            else:
+                self.close_connection(conn)
+            return response
+
+    @staticmethod
+    async def read_response(reader):
+        """ Returns (Response, keep_alive). """
+        status_line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+        if not status_line:
+            raise asyncio.IncompleteReadError(b'', None)
+        version, status, *reason = status_line.split(' ', 2)
+        status = int(status)
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode('latin-1').rstrip('\r\n')
+            if not line:
+                break
+            k, _, v = line.partition(':')
+            headers[k.strip().lower()] = v.strip()
+        keep_alive = headers.get('connection', '').lower() != 'close' and version == 'HTTP/1.1'
+        if status in (204, 304) or 100 <= status < 200:
+            body = b''
+        elif headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await reader.readline()).split(b';')[0], 16)
+                chunk = await reader.readexactly(size + 2)
+                if size == 0:
+                    break
+                chunks.append(chunk[:-2])
+            body = b''.join(chunks)
+        elif 'content-length' in headers:
+            body = await reader.readexactly(int(headers['content-length']))
+        else:
+            body = await reader.read()
+            keep_alive = False
+        return Response(status, reason[0] if reason else '', headers, body), keep_alive
+
+    async def get_state(self, item_name, timeout=None):
+        r = await self.request('GET', f'/{quote(item_name)}/state', timeout=timeout)
+        if r.status == 200:     # 200 OK
+            return r.text
+        return f'Error {r.status}: {r.reason}'
+
+    async def post_state(self, item_name, state, timeout=None):
+        r = await self.request('POST', f'/{quote(item_name)}', str(state), {'Content-Type': 'text/plain'}, timeout)
+        if r.status == 200:     # 200 OK
+            return 'OK'
+        return None
+
+    async def get_states(self, item_names, timeout=None):
+        """
+        States of several items, fetched concurrently (at most max_connections at a time).
+        Returns a dict item name -> state, 'Error ...' or the HgcException of a connection error.
+        """
+        results = await asyncio.gather(*(self.get_state(n, timeout) for n in item_names), return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException) and not isinstance(r, HgcException):
+                raise r
+        return dict(zip(item_names, results))
+
+    async def post_states(self, item_names, state, timeout=None):
+        """ Like iface.post_states(), concurrently. """
+        results = await asyncio.gather(*(self.post_state(n, state, timeout) for n in item_names), return_exceptions=True)
+        for r in results:
+            if isinstance(r, BaseException) and not isinstance(r, HgcException):
+                raise r
+        return dict(zip(item_names, results))
+
+    async def close(self):
+        while self.idle:
+            self.close_connection(self.idle.pop())
+
+
+class AsyncLoopThread:
+    """ An asyncio event loop running in a background thread. """
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.thread = None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='AsyncLoop', daemon=True)
+        self.thread.start()
+        return self
+
+    def run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, coro):
+        """ Run coro in the loop, from any thread. Returns a concurrent.futures.Future (cancel() cancels the coroutine). """
+        return asyncio.run_coroutine_threadsafe(coro, self.loop)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        if self.thread is not None:
+            self.thread.join(timeout=2)
+
+
+class AsyncOpenhabBackend(OpenhabRestBackend):
+    """
+    openHAB backend sending get_state(), post_state() and post_states() through an
+    AsyncRestClient running in an AsyncLoopThread: at most max_connections requests at the
+    same time for all the threads using the backend.
+    The requests with their own timeouts or connections (get_items(), the bulk get_states(),
+    the events stream and the health probe) use the blocking client of OpenhabRestBackend.
+    """
+    def __init__(self, url=None, max_connections=4, **rest):
+        """ url: URL of the items (default: iface.url_str), rest: see iface.RestClient """
+        super().__init__(url, **rest)
+        self.async_client = AsyncRestClient(url, max_connections,
+                                            rest.get('connect_timeout', iface.CONNECT_TIMEOUT),
+                                            rest.get('read_timeout', iface.READ_TIMEOUT))
+        # Fail at once on an unsupported URL, not at the first request
+        self.async_client.target()
+        self.loop = AsyncLoopThread().start()
+
+    def run(self, coro):
+        """
+        Runs coro in the event loop, waits for the result. Raises HgcException if there is no
+        result in time (e.g. the loop thread stalls), the requests have their own deadlines.
+        """
+        future = self.loop.submit(coro)
+        client = self.async_client
+        try:
+            return future.result(client.connect_timeout + client.read_timeout + LOOP_MARGIN)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            print('AsyncOpenhabBackend: no answer from the event loop')
+            raise HgcException("Connection time out.")
+
+    def get_state(self, item_name, timeout=None):
+        return self.run(self.async_client.get_state(item_name, timeout))
+
+    def post_state(self, item_name, state, timeout=None):
+        return self.run(self.async_client.post_state(item_name, state, timeout))
+
+    def post_states(self, item_names, state, timeout=None):
+        return self.run(self.async_client.post_states(item_names, state, timeout))
+
+    def close(self):
+        self.run(self.async_client.close())
+        self.loop.stop()
+        super().close()
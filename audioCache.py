@@ -0,0 +1,214 @@
+"""
+Cache of synthesized speech (raw mono 16 bit PCM) for the phrases that are known in advance:
+the fixed feedback phrases, the trackbar values and the prompts built from the item tree
+(see ItemController.cached_phrases()).
+
+The phrases are synthesized in the background by a pool of 'workers' threads, each running
+'espeak --stdout' (a separate process, so the speech worker is not blocked), and kept in a
+LRU bounded to max_mb megabytes:
+    - storage 'memory': the PCM is kept in memory,
+    - storage 'disk': the PCM is written to .audio_cache/ and only the index is kept in memory,
+      the cache then survives a restart.
+The key of a phrase includes the rate and the voice, so a changed setting is synthesized again.
+SpeechController plays a cached phrase directly through its persistent audio sink and
+synthesizes only the phrases not in the cache.
+"""
+import hashlib
+import os
+import shutil
+import struct
+import subprocess
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.audio_cache')
+
+# Samples below this amplitude at the start of a phrase are silence
+SILENCE = 64
+
+
+def normalize(text):
+    return ' '.join(str(text).split())
+
+def trim_silence(pcm):
+    """ Removes the leading silence of mono 16 bit PCM. """
+    samples = np.frombuffer(pcm, dtype=np.int16)
+    sound = np.flatnonzero(np.abs(samples) > SILENCE)
+    return pcm[2 * sound[0]:] if len(sound) else b''
+
+def parse_wav(data):
+    """ Returns (sample rate, PCM) of the WAV written by espeak --stdout. """
+    if data[:4] != b'RIFF' or data[8:12] != b'WAVE':
+        raise ValueError('not a WAV file')
+    pos = 12
+    sample_rate = None
+    while pos + 8 <= len(data):
+        chunk_id, size = struct.unpack('<4sI', data[pos:pos+8])
+        if chunk_id == b'fmt ':
+            sample_rate = struct.unpack('<I', data[pos+12:pos+16])[0]
+        elif chunk_id == b'data':
+            # The size is not set when espeak writes to a pipe: take the rest
+            return sample_rate, data[pos+8:]
+        pos += 8 + size
+    raise ValueError('no data in WAV file')
+
+
+class AudioCache:
+    def __init__(self, rate, voice, max_mb=32, storage='memory', cache_dir=DEFAULT_CACHE_DIR, workers=2):
+        """ rate, voice: see SpeechController. Raises OSError if espeak is not installed. """
+        self.command = shutil.which('espeak') or shutil.which('espeak-ng')
+        if self.command is None:
+            raise OSError('espeak not found')
+        if storage not in ('memory', 'disk'):
+            raise ValueError(f"Unknown storage {storage}, should be 'memory' or 'disk'")
+        self.rate = rate
+        self.voice = voice
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.storage = storage
+        self.cache_dir = cache_dir
+        self.sample_rate = None     # of the cached PCM, set by the first synthesis
+
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()    # key -> PCM (memory) or size (disk), least recently used first
+        self.nb_bytes = 0
+        self.in_flight = set()
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='AudioCache')
+
+        # Metrics
+        self.nb_hits = 0
+        self.nb_misses = 0
+        self.nb_synthesized = 0
+        self.nb_evicted = 0
+
+        if storage == 'disk':
+            self.load_index()
+
+    def key(self, text):
+        return hashlib.sha1(f'{self.rate}|{self.voice}|{normalize(text)}'.encode()).hexdigest()
+
+    def path(self, key):
+        return os.path.join(self.cache_dir, key + '.pcm')
+
+    def load_index(self):
+        """ Index the phrases cached on disk by an earlier run, oldest first. """
+        os.makedirs(self.cache_dir, exist_ok=True)
+        rate_file = os.path.join(self.cache_dir, 'sample_rate')
+        if os.path.exists(rate_file):
+            with open(rate_file) as f:
+                self.sample_rate = int(f.read())
+        files = [e for e in os.scandir(self.cache_dir) if e.name.endswith('.pcm')]
+        for e in sorted(files, key=lambda e: e.stat().st_mtime):
+            self.entries[e.name[:-4]] = e.stat().st_size
+            self.nb_bytes += e.stat().st_size
+        self.evict()
+
+    def get(self, text):
+        """ Returns the PCM of text, or None if it is not cached. """
+        key = self.key(text)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.nb_misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.nb_hits += 1
+        if self.storage == 'memory':
+            return entry
+        try:
+            with open(self.path(key), 'rb') as f:
+                return f.read()
+        except OSError:
+            with self.lock:
+                if self.entries.pop(key, None) is not None:
+                    self.nb_bytes -= entry
+            return None
+
+    def put(self, text, pcm):
+        key = self.key(text)
+        if self.storage == 'disk':
+            tmp = self.path(key) + '.tmp'
+            with open(tmp, 'wb') as f:
+                f.write(pcm)
+            os.replace(tmp, self.path(key))
+        with self.lock:
+            old = self.entries.pop(key, None)
+            if old is not None:
+                self.nb_bytes -= len(old) if self.storage == 'memory' else old
+            self.entries[key] = pcm if self.storage == 'memory' else len(pcm)
+            self.nb_bytes += len(pcm)
+        self.evict()
+
+    def evict(self):
+        with self.lock:
+            while self.nb_bytes > self.max_bytes and self.entries:
+                key, entry = self.entries.popitem(last=False)
+                self.nb_bytes -= len(entry) if self.storage == 'memory' else entry
+                self.nb_evicted += 1
+                if self.storage == 'disk':
+                    try:
+                        os.remove(self.path(key))
+                    except OSError:
+                        pass
+
+    def discard(self, texts):
+        """ Forget texts (e.g. prompts that will not be spoken any more). """
+        for text in texts:
+            key = self.key(text)
+            with self.lock:
+                entry = self.entries.pop(key, None)
+                if entry is None:
+                    continue
+                self.nb_bytes -= len(entry) if self.storage == 'memory' else entry
+            if self.storage == 'disk':
+                try:
+                    os.remove(self.path(key))
+                except OSError:
+                    pass
+
+    def synth(self, text):
+        """ Synthesizes text with espeak --stdout. Returns the PCM, without the leading silence. """
+        r = subprocess.run([self.command, '--stdout', '-s', str(self.rate), '-v', self.voice, normalize(text)],
+                           stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True)
+        sample_rate, pcm = parse_wav(r.stdout)
+        if self.sample_rate is None:
+            self.sample_rate = sample_rate
+            if self.storage == 'disk':
+                with open(os.path.join(self.cache_dir, 'sample_rate'), 'w') as f:
+                    f.write(str(sample_rate))
+        elif sample_rate != self.sample_rate:
+            raise ValueError(f'sample rate {sample_rate}, expected {self.sample_rate}')
+        return trim_silence(pcm)
+
+    def presynthesize(self, texts):
+        """ Synthesizes the texts not cached yet in the background. Returns the number of texts submitted. """
+        nb = 0
+        for text in dict.fromkeys(normalize(t) for t in texts):
+            key = self.key(text)
+            with self.lock:
+                if key in self.entries or key in self.in_flight:
+                    continue
+                self.in_flight.add(key)
+            self.executor.submit(self.synth_job, text, key)
+            nb += 1
+        return nb
+
+    def synth_job(self, text, key):
+        try:
+            self.put(text, self.synth(text))
+            self.nb_synthesized += 1
+        except (OSError, ValueError, subprocess.CalledProcessError) as e:
+            print(f'AudioCache: could not synthesize "{text}": {e}')
+        finally:
+            with self.lock:
+                self.in_flight.discard(key)
+
+    def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def metrics(self):
+        return {'storage': self.storage, 'phrases': len(self.entries), 'mb': round(self.nb_bytes / 1024 / 1024, 2),
+                'hits': self.nb_hits, 'misses': self.nb_misses,
+                'synthesized': self.nb_synthesized, 'evicted': self.nb_evicted}
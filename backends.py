@@ -0,0 +1,230 @@
+"""
+Home automation backends: the interface used by the ItemController (and the state cache,
+prefetcher, command queue, live trackbar and item discovery) to talk to the smart home.
+
+    Backend             the interface
+    OpenhabRestBackend  openHAB REST API (iface.RestClient)
+    AsyncOpenhabBackend openHAB REST API, the item requests of all threads through one
+                        asyncio client (asyncIface.py)
+    FakeBackend         in-process fake items (fakeOpenhab.FakeItems), with the same
+                        latency, jitter and failure injection as the fake server
+
+Selected with the config key 'backend', e.g.
+    'backend': {'type': 'openhab', 'url': 'http://10.5.55.3:8080/rest/items'}
+    'backend': {'type': 'openhab_async', 'max_connections': 4}
+    'backend': {'type': 'fake', 'latency': 0.05, 'jitter': 0.02, 'failure_rate': 0.05, 'seed': 1}
+Without 'url', the openHAB backends use iface.url_str.
+"""
+import json
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import ThreadPoolExecutor
+
+import iface
+from HgcException import HgcException
+
+POOL_SIZE = iface.POOL_SIZE
+
+
+class Backend(ABC):
+    """
+    The results are those of iface.py: get_state() returns the state or 'Error ...',
+    post_state() 'OK' or None, connection errors raise HgcException.
+    timeout: limit (s) of the timeouts of the request, None: the default timeouts.
+    Subclasses implement the abstract methods, checked when the backend is created.
+    """
+    name = None     # identifies the item source, e.g. in cache files
+
+    def __init__(self):
+        self.executor = None
+        self.lock = threading.Lock()
+
+    @abstractmethod
+    def get_state(self, item_name, timeout=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def post_state(self, item_name, state, timeout=None):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_items(self, params=None, etag=None):
+        """ Like iface.get_items(): (JSON body of the items, etag), body None if not modified. """
+        raise NotImplementedError
+
+    @abstractmethod
+    def subscribe(self, topics=None):
+        """
+        Opens the stream of item events (dicts with 'topic', 'payload', 'type', like the
+        openHAB events). Returns an iterator of the events, which raises HgcException when the
+        stream breaks. Raises HgcException if the stream can not be opened.
+        """
+        raise NotImplementedError
+
+    def run_concurrently(self, fn, item_names):
+        """ Returns dict item name -> fn(item name), or the HgcException it raised. """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=POOL_SIZE, thread_name_prefix=type(self).__name__)
+        def call(item_name):
+            try:
+                return fn(item_name)
+            except HgcException as he:
+                return he
+        return dict(zip(item_names, self.executor.map(call, item_names)))
+
+    @abstractmethod
+    def get_states(self, item_names=None, tag=None, group=None, timeout=None):
+        """
+        States of several items (item_names None: all the items, or those with tag,
+        or the members of group), with as few requests as possible.
+        Returns dict item name -> state, 'Error ...' or HgcException.
+        """
+        raise NotImplementedError
+
+    def post_states(self, item_names, state, timeout=None):
+        """ Returns dict item name -> 'OK', None or HgcException. """
+        return self.run_concurrently(lambda item_name: self.post_state(item_name, state, timeout), item_names)
+
+    @abstractmethod
+    def probe(self, timeout=None):
+        """ Health check: returns True if the server answers. Raises HgcException on a connection error. """
+        raise NotImplementedError
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+
+
+class OpenhabRestBackend(Backend):
+    def __init__(self, url=None, **rest):
+        """ url: URL of the items (default: iface.url_str), rest: see iface.RestClient """
+        super().__init__()
+        self.client = iface.RestClient(url, **rest) if url or rest else iface.client()
+
+    @property
+    def name(self):
+        return self.client.items_url
+
+    def get_state(self, item_name, timeout=None):
+        return self.client.get_state(item_name, timeout)
+
+    def post_state(self, item_name, state, timeout=None):
+        return self.client.post_state(item_name, state, timeout)
+
+    def post_states(self, item_names, state, timeout=None):
+        return self.client.post_states(item_names, state, timeout)
+
+    def get_states(self, item_names=None, tag=None, group=None, timeout=None):
+        return self.client.get_states(item_names, tag, group, timeout)
+
+    def get_items(self, params=None, etag=None):
+        return self.client.get_items(params, etag)
+
+    def probe(self, timeout=None):
+        return self.client.probe(timeout)
+
+    def subscribe(self, topics=None):
+        return iface.read_events(self.client.open_events(topics))
+
+    def close(self):
+        super().close()
+        if self.client is not iface.client():
+            self.client.close()
+
+
+class FakeBackend(Backend):
+    name = 'fake'
+
+    def __init__(self, items, **injection):
+        """ items: list of items (see fakeOpenhab.items_from_tree()), injection: see fakeOpenhab.FakeItems """
+        from fakeOpenhab import FakeItems
+        super().__init__()
+        self.store = FakeItems(items, **injection)
+
+    def check(self):
+        failure = self.store.simulate()
+        if failure == 'drop':
+            raise HgcException("No connection.")
+        return failure is None
+
+    def get_state(self, item_name, timeout=None):
+        if not self.check():
+            return 'Error 503: Service Unavailable'
+        item = self.store.items.get(item_name)
+        if item is None:
+            return 'Error 404: Not Found'
+        return item['state']
+
+    def post_state(self, item_name, state, timeout=None):
+        if self.check() and self.store.set_state(item_name, str(state), command=True):
+            return 'OK'
+        return None
+
+    def get_states(self, item_names=None, tag=None, group=None, timeout=None):
+        if not self.check():
+            if item_names is None:
+                raise HgcException('Error 503: Service Unavailable')
+            return self.run_concurrently(self.get_state, item_names)
+        with self.store.lock:
+            items = list(self.store.items.values())
+        if tag:
+            items = [it for it in items if tag in it.get('tags', [])]
+        if group:
+            items = [it for it in items if group in it.get('groupNames', [])]
+        states = {it['name']: it['state'] for it in items}
+        if item_names is None:
+            return states
+        return {name: states.get(name, 'Error 404: Not Found') for name in item_names}
+
+    def probe(self, timeout=None):
+        return self.check()
+
+    def get_items(self, params=None, etag=None):
+        if not self.check():
+            raise HgcException('Error 503: Service Unavailable')
+        fields = params['fields'].split(',') if params and 'fields' in params else None
+        body, new_etag = self.store.items_json(fields)
+        if etag and etag == new_etag:
+            return None, etag
+        return body, new_etag
+
+    def subscribe(self, topics=None):
+        q = self.store.subscribe()
+        def events():
+            try:
+                while True:
+                    event = q.get()
+                    if event is None:
+                        raise HgcException("Connection lost.")
+                    yield event
+            finally:
+                self.store.unsubscribe(q)
+        return events()
+
+
+def create(config=None, rest=None, item_tree=None):
+    """
+    Returns the backend of a 'backend' config. rest: the 'rest' config (openHAB),
+    item_tree: the items of the fake backend.
+    """
+    config = dict(config or {})
+    backend_type = config.pop('type', 'openhab')
+    if backend_type == 'openhab':
+        return OpenhabRestBackend(config.pop('url', None), **dict(rest or {}))
+    if backend_type == 'openhab_async':
+        from asyncIface import AsyncOpenhabBackend
+        return AsyncOpenhabBackend(config.pop('url', None), config.pop('max_connections', 4), **dict(rest or {}))
+    if backend_type == 'fake':
+        from fakeOpenhab import items_from_tree
+        return FakeBackend(items_from_tree(item_tree), **config)
+    raise HgcException(f"Unknown backend type {backend_type}, should be 'openhab', 'openhab_async' or 'fake'")
+
+_default = None
+
+def default():
+    """ The openHAB backend with the default iface client, used when no backend is given. """
+    global _default
+    if _default is None:
+        _default = OpenhabRestBackend()
+    return _default
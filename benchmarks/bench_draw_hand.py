@@ -0,0 +1,158 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark of the landmark drawing of HandTrackerRenderer (bones and joints of one hand),
+runs offline on synthetic hands.
+
+Paths:
+    current     the drawing before HandTrackerRenderer.draw_landmarks(): one array per bone
+                built in a list comprehension, colors looked up per finger (as reference)
+    batched     HandTrackerRenderer.draw_landmarks()
+    stamp       like batched, with the joints stamped with numpy: a disc of the landmark radius
+                cached as pixel offsets, all the joints written with one fancy-index assignment
+
+For each path and hand size, the time per hand (p50/p99, µs) is reported as JSON, with the
+number of pixels differing from the current path (should be 0). Target: under 1 ms per hand
+on the Raspberry Pi.
+
+Example:
+    python benchmarks/bench_draw_hand.py --hands 200 --output pi.json
+"""
+import argparse
+import json
+import os
+import sys
+from time import perf_counter
+from types import SimpleNamespace
+
+import cv2
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from HandTrackerRenderer import HandTrackerRenderer, LINES_HAND, FINGER_OF_LANDMARK, FINGER_STATE_COLORS
+
+PATHS = ['current', 'batched', 'stamp']
+
+# Landmarks of an open right hand, normalized in its bounding box
+OPEN_HAND = np.array([[0.50, 1.00], [0.30, 0.90], [0.18, 0.75], [0.10, 0.62], [0.02, 0.52],
+                      [0.35, 0.55], [0.33, 0.35], [0.32, 0.22], [0.31, 0.10],
+                      [0.48, 0.52], [0.48, 0.30], [0.48, 0.15], [0.48, 0.02],
+                      [0.61, 0.54], [0.63, 0.34], [0.64, 0.20], [0.65, 0.08],
+                      [0.73, 0.60], [0.78, 0.45], [0.81, 0.35], [0.84, 0.25]])
+
+
+def synthetic_hands(nb, size, frame_shape, rng):
+    """ nb hands of about size pixels, at random positions and with random finger states. """
+    h, w = frame_shape[:2]
+    hands = []
+    for _ in range(nb):
+        origin = rng.uniform([0, 0], [w - size, h - size])
+        landmarks = (origin + OPEN_HAND * size + rng.normal(0, size / 50, OPEN_HAND.shape)).astype(int)
+        states = rng.choice([-1, 0, 1], 5)
+        hands.append(SimpleNamespace(landmarks=landmarks, rect_w_a=size * 1.5,
+                                     thumb_state=states[0], index_state=states[1], middle_state=states[2],
+                                     ring_state=states[3], little_state=states[4]))
+    return hands
+
+def draw_current(renderer, hand, thick_coef):
+    """ The drawing of HandTrackerRenderer.draw_hand() before draw_landmarks(). """
+    lines = [np.array([hand.landmarks[point] for point in line]).astype(int) for line in LINES_HAND]
+    cv2.polylines(renderer.frame, lines, False, (255, 255, 255), int(1+thick_coef*1), cv2.LINE_AA)
+    radius = int(1+thick_coef*5)
+    color = { 1: (205, 205, 205), 0: (50, 50, 50), -1:(50, 50, 50)}
+    cv2.circle(renderer.frame, (int(hand.landmarks[0][0]), int(hand.landmarks[0][1])), radius, color[-1], -1)
+    for first, state in zip(range(1, 21, 4), [hand.thumb_state, hand.index_state, hand.middle_state, hand.ring_state, hand.little_state]):
+        for i in range(first, first+4):
+            cv2.circle(renderer.frame, (int(hand.landmarks[i][0]), int(hand.landmarks[i][1])), radius, color[state], -1)
+
+def draw_batched(renderer, hand, thick_coef):
+    renderer.draw_landmarks(hand, thick_coef)
+
+disc_offsets = {}
+
+def draw_stamp(renderer, hand, thick_coef):
+    frame = renderer.frame
+    h, w = frame.shape[:2]
+    cv2.polylines(frame, hand.landmarks[np.array(LINES_HAND)].astype(np.int32), False, (255, 255, 255), int(1+thick_coef*1), cv2.LINE_AA)
+    radius = int(1+thick_coef*5)
+    key = (radius, w)
+    if key not in disc_offsets:
+        disc = np.zeros((2*radius+1, 2*radius+1), np.uint8)
+        cv2.circle(disc, (radius, radius), radius, 1, -1)
+        ys, xs = np.nonzero(disc)
+        disc_offsets[key] = (ys - radius, xs - radius, (ys - radius) * w + xs - radius)
+    dy, dx, offsets = disc_offsets[key]
+    states = np.array([-1, hand.thumb_state, hand.index_state, hand.middle_state, hand.ring_state, hand.little_state])
+    colors = np.repeat(FINGER_STATE_COLORS[states[FINGER_OF_LANDMARK] + 1].astype(np.uint8), len(offsets), axis=0)
+    x, y = hand.landmarks[:, 0], hand.landmarks[:, 1]
+    if x.min() >= radius and y.min() >= radius and x.max() < w - radius and y.max() < h - radius:
+        pixels = ((y * w + x)[:, None] + offsets).ravel()
+        frame.reshape(-1, 3)[pixels] = colors
+    else:
+        # Disc partly out of the frame
+        ys, xs = (y[:, None] + dy).ravel(), (x[:, None] + dx).ravel()
+        inside = (xs >= 0) & (xs < w) & (ys >= 0) & (ys < h)
+        frame[ys[inside], xs[inside]] = colors[inside]
+
+DRAW = {'current': draw_current, 'batched': draw_batched, 'stamp': draw_stamp}
+
+def run(path, hands, background, renderer, repeat):
+    draw = DRAW[path]
+    renderer.frame = background.copy()
+    times = []
+    for _ in range(repeat):
+        for hand in hands:
+            thick_coef = hand.rect_w_a / 400
+            t0 = perf_counter()
+            draw(renderer, hand, thick_coef)
+            times.append(perf_counter() - t0)
+    return np.array(times) * 1e6
+
+def differing_pixels(path, hands, background, renderer):
+    """ Pixels differing from the current path, each hand drawn on a clean frame. """
+    nb = 0
+    for hand in hands:
+        thick_coef = hand.rect_w_a / 400
+        renderer.frame = background.copy()
+        draw_current(renderer, hand, thick_coef)
+        reference = renderer.frame
+        renderer.frame = background.copy()
+        DRAW[path](renderer, hand, thick_coef)
+        nb += int((renderer.frame != reference).any(axis=2).sum())
+    return nb
+
+def main():
+    parser = argparse.ArgumentParser(description='Micro-benchmark of the landmark drawing of HandTrackerRenderer')
+    parser.add_argument('--paths', nargs='+', choices=PATHS, default=PATHS)
+    parser.add_argument('--sizes', nargs='+', type=int, default=[150, 300], help='pixels, hand sizes')
+    parser.add_argument('--hands', type=int, default=100, help='synthetic hands per size')
+    parser.add_argument('--repeat', type=int, default=10, help='times each hand is drawn')
+    parser.add_argument('--width', type=int, default=640)
+    parser.add_argument('--height', type=int, default=480)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    background = rng.integers(0, 256, (args.height, args.width, 3), dtype=np.uint8)
+    renderer = HandTrackerRenderer(SimpleNamespace(use_lm=True, use_gesture=True))
+    results = []
+    for size in args.sizes:
+        hands = synthetic_hands(args.hands, size, background.shape, rng)
+        for path in args.paths:
+            times = run(path, hands, background, renderer, args.repeat)
+            p50, p99 = np.percentile(times, [50, 99])
+            results.append({'path': path, 'hand_size': size, 'draws': len(times),
+                            'p50_us': round(float(p50), 1), 'p99_us': round(float(p99), 1),
+                            'mean_us': round(float(times.mean()), 1),
+                            'differing_pixels': differing_pixels(path, hands, background, renderer)})
+            print(f'{path} {size}px: p50 {results[-1]["p50_us"]} us', file=sys.stderr)
+    report = json.dumps({'python': sys.version.split()[0], 'numpy': np.__version__, 'opencv': cv2.__version__,
+                         'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    print(report)
+
+if __name__ == '__main__':
+    main()
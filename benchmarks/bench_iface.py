@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""
+Latency and load benchmark of the REST functions of iface.py against the local fake
+openHAB server (fakeOpenhab.py), runs offline.
+
+Scenarios:
+    sequential          get_state() one after the other, on the kept-alive connection
+    sequential_post     post_state() one after the other
+    no_keepalive        like sequential, with a new connection per request (plain requests.get(),
+                        the client before RestClient), as reference
+    concurrent          get_state() from 'threads' threads
+    bulk                get_states() of all the bench items, one request each
+    latency             sequential, the server answers after latency +- jitter
+    latency_concurrent  concurrent, with the same latency
+    failures            concurrent, the server answers failure_rate of the requests with 503
+                        and drops drop_rate of the connections
+
+For each scenario, the latency percentiles (p50/p95/p99), the throughput, the errors and
+the TCP connections accepted by the server are reported as JSON, to compare runs before
+and after a change of the client.
+
+Example:
+    python benchmarks/bench_iface.py --requests 500 --threads 8 --output before.json
+"""
+import argparse
+import json
+import os
+import sys
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import redirect_stdout
+from time import perf_counter
+
+import numpy as np
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import iface
+from fakeOpenhab import FakeOpenhab
+from HgcException import HgcException
+
+SCENARIOS = ['sequential', 'sequential_post', 'no_keepalive', 'concurrent', 'bulk',
+             'latency', 'latency_concurrent', 'failures']
+
+
+def bench_items(nb_items):
+    return [{'name': f'bench_item_{i}', 'type': 'Dimmer', 'state': '0'} for i in range(nb_items)]
+
+def get_state(name):
+    """ Returns True on success. """
+    try:
+        return not iface.get_state(name).startswith('Error')
+    except HgcException:
+        return False
+
+def post_state(name):
+    try:
+        return iface.post_state(name, '50') == 'OK'
+    except HgcException:
+        return False
+
+def get_state_new_connection(name):
+    try:
+        r = requests.get(iface.client().item_url(name, 'state'), timeout=iface.client().timeout)
+        return r.status_code == 200
+    except requests.exceptions.RequestException:
+        return False
+
+def get_states(names):
+    try:
+        states = iface.get_states(names)
+    except HgcException:
+        return False
+    return all(isinstance(s, str) and not s.startswith('Error') for s in states.values())
+
+def timed(fn, arg):
+    t0 = perf_counter()
+    ok = fn(arg)
+    return perf_counter() - t0, ok
+
+def run(scenario, args):
+    injection = {}
+    if scenario.startswith('latency'):
+        injection = {'latency': args.latency, 'jitter': args.jitter}
+    elif scenario == 'failures':
+        injection = {'failure_rate': args.failure_rate, 'drop_rate': args.drop_rate}
+    threads = args.threads if scenario in ('concurrent', 'latency_concurrent', 'failures') else 1
+    items = bench_items(args.items)
+    names = [it['name'] for it in items]
+
+    openhab = FakeOpenhab(items, seed=args.seed, **injection).start()
+    iface.configure(url=openhab.url, pool_size=args.threads)
+    if scenario == 'bulk':
+        fn, calls = get_states, [names] * max(1, args.requests // args.items)
+    else:
+        fn = {'sequential_post': post_state, 'no_keepalive': get_state_new_connection}.get(scenario, get_state)
+        calls = [names[i % len(names)] for i in range(args.requests)]
+
+    t_start = perf_counter()
+    if threads == 1:
+        results = [timed(fn, arg) for arg in calls]
+    else:
+        with ThreadPoolExecutor(max_workers=threads) as executor:
+            results = list(executor.map(lambda arg: timed(fn, arg), calls))
+    elapsed = perf_counter() - t_start
+    nb_connections = openhab.nb_connections
+    nb_server_requests = openhab.nb_requests
+    openhab.stop()
+
+    latencies = np.array([r[0] for r in results]) * 1000
+    p50, p95, p99 = np.percentile(latencies, [50, 95, 99])
+    return {
+        'scenario': scenario,
+        'threads': threads,
+        'calls': len(calls),
+        'errors': sum(not r[1] for r in results),
+        'p50_ms': round(float(p50), 2),
+        'p95_ms': round(float(p95), 2),
+        'p99_ms': round(float(p99), 2),
+        'max_ms': round(float(latencies.max()), 2),
+        'calls_per_s': round(len(calls) / elapsed, 1),
+        'server_requests': nb_server_requests,
+        'connections': nb_connections,
+        **injection,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Latency and load benchmark of the iface REST functions')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument('--requests', type=int, default=500, help='calls per scenario')
+    parser.add_argument('--threads', type=int, default=8, help='threads of the concurrent scenarios, also pool size')
+    parser.add_argument('--items', type=int, default=20, help='items on the fake server')
+    parser.add_argument('--latency', type=float, default=0.02, help='s, server latency of the latency scenarios')
+    parser.add_argument('--jitter', type=float, default=0.005, help='s, +- on the latency')
+    parser.add_argument('--failure-rate', type=float, default=0.1, help='part of the requests answered with 503')
+    parser.add_argument('--drop-rate', type=float, default=0.02, help='part of the requests with the connection dropped')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the injected latency and failures')
+    parser.add_argument('--output', help='also write the JSON report to this file')
+    args = parser.parse_args()
+
+    results = []
+    for scenario in args.scenarios:
+        # iface prints every request
+        with open(os.devnull, 'w') as devnull, redirect_stdout(devnull):
+            results.append(run(scenario, args))
+        print(f'{scenario}: p50 {results[-1]["p50_ms"]} ms, {results[-1]["calls_per_s"]} calls/s', file=sys.stderr)
+    report = json.dumps({'python': sys.version.split()[0], 'requests': args.requests, 'results': results}, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(report)
+    print(report)
+
+if __name__ == '__main__':
+    main()
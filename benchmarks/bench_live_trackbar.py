@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the live trackbar (liveTrackbar.py) against the local fake openHAB server
+(fakeOpenhab.py): the trackbar callback is simulated at 'fps' frames per second with a
+value changing on every frame, for several max_rate settings (0: no limit).
+
+For each rate, the write rate sustained by LiveWriter, the number of coalesced values and
+the delay until the final value is on the server are reported (JSON).
+
+Example:
+    python benchmarks/bench_live_trackbar.py --duration 5 --rates 2 4 10 0
+"""
+import argparse
+import json
+import os
+import sys
+from time import monotonic, sleep
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import iface
+from fakeOpenhab import FakeOpenhab
+from liveTrackbar import LiveWriter
+
+ITEM = 'bench_dimmer'
+
+
+def run(openhab, max_rate, duration, fps):
+    writer = LiveWriter(max_rate).start()
+    nb_frames = int(duration * fps)
+    nb_requests = openhab.nb_requests
+    t_start = monotonic()
+    value = 0
+    for i in range(nb_frames):
+        # Value sweeping 0 ... 100 ... 0 by steps of 10, like the trackbar
+        value = 10 * abs(i % 20 - 10)
+        writer.write(ITEM, str(value))
+        sleep(max(0, t_start + (i + 1) / fps - monotonic()))
+    t_end = monotonic()
+    writer.flush(timeout=10)
+    final_delay = monotonic() - t_end
+    writer.stop()
+    elapsed = monotonic() - t_start
+    return {
+        'max_rate': max_rate,
+        'writes': writer.nb_writes,
+        'sent': writer.nb_sent,
+        'coalesced': writer.nb_coalesced,
+        'errors': writer.nb_errors,
+        'server_requests': openhab.nb_requests - nb_requests,
+        'sent_per_s': round(writer.nb_sent / elapsed, 2),
+        'final_value_delivered': openhab.items[ITEM]['state'] == str(value),
+        'final_delay_ms': round(final_delay * 1000, 1),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark of the live trackbar writes')
+    parser.add_argument('--duration', type=float, default=5, help='s per rate')
+    parser.add_argument('--fps', type=float, default=30, help='trackbar callbacks per second')
+    parser.add_argument('--rates', type=float, nargs='+', default=[2, 4, 10, 0], help='max_rate values (0: no limit)')
+    args = parser.parse_args()
+
+    openhab = FakeOpenhab([{'name': ITEM, 'type': 'Dimmer', 'state': '0'}]).start()
+    iface.url_str = openhab.url
+    results = [run(openhab, rate, args.duration, args.fps) for rate in args.rates]
+    openhab.stop()
+    print(json.dumps(results, indent=2))
+
+if __name__ == '__main__':
+    main()
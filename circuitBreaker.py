@@ -0,0 +1,247 @@
+"""
+Circuit breaker around the smart home backend (see backends.py).
+
+Without it, every request to an unreachable openHAB waits for the full timeout (seconds),
+and the user waits with it. The breaker has three states:
+    - closed: requests go through. After failure_threshold consecutive failures
+      (connection errors or HTTP 5xx), the breaker opens.
+    - open: requests fail at once with HgcException, without touching the network.
+      After open_time seconds the breaker is half-open.
+    - half-open: one trial request (a user request or the health probe) goes through,
+      the others still fail at once. Success closes the breaker, failure opens it again.
+A background thread probes the server every probe_interval seconds while the breaker is
+not closed, so the breaker usually closes before the user needs the server again.
+
+The timeout of the requests adapts to the observed latency: timeout_factor * p99 of the
+last successful requests, between min_timeout and the timeouts of the backend. A dead server
+is then detected after about one timeout per failure_threshold requests, instead of the
+full read timeout for each request.
+"""
+import threading
+from collections import deque
+from time import monotonic, perf_counter
+
+import numpy as np
+
+from HgcException import HgcException
+from backends import Backend
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half-open'
+
+# Status line of the renderer, by state
+STATUS_TEXT = {CLOSED: 'server OK', OPEN: 'server down', HALF_OPEN: 'server retrying'}
+
+# Successful requests needed before the timeout adapts
+MIN_SAMPLES = 20
+
+
+def is_failure(result):
+    """ Failure of a backend result: an HgcException or an 'Error 5xx ...' state. """
+    return isinstance(result, HgcException) or (isinstance(result, str) and result.startswith('Error 5'))
+
+
+class CircuitBreaker:
+    def __init__(self, failure_threshold=3, open_time=5, probe_interval=2,
+                min_timeout=0.5, timeout_factor=3, window=200):
+        self.failure_threshold = failure_threshold
+        self.open_time = open_time              # s
+        self.probe_interval = probe_interval    # s
+        self.min_timeout = min_timeout          # s
+        self.timeout_factor = timeout_factor
+        self.latencies = deque(maxlen=window)   # s, of the last successful requests
+
+        self.lock = threading.Lock()
+        self.state = CLOSED
+        self.nb_consecutive_failures = 0
+        self.opened_at = 0
+        self.trial = False      # a trial request is running (half-open)
+
+        # Metrics
+        self.nb_calls = 0
+        self.nb_failures = 0
+        self.nb_rejected = 0
+        self.nb_opened = 0
+        self.last_error = None
+
+    def allow(self, count=True):
+        """
+        Returns True if a request may be sent now. Each True must be followed by success() or failure().
+        count: count a refused request in the metrics.
+        """
+        with self.lock:
+            if self.state == OPEN and monotonic() - self.opened_at >= self.open_time:
+                self.set_state(HALF_OPEN)
+            if self.state == CLOSED or (self.state == HALF_OPEN and not self.trial):
+                self.trial = self.state == HALF_OPEN
+                self.nb_calls += 1
+                return True
+            if count:
+                self.nb_rejected += 1
+            return False
+
+    def success(self, latency=None):
+        with self.lock:
+            self.trial = False
+            self.nb_consecutive_failures = 0
+            if latency is not None:
+                self.latencies.append(latency)
+            if self.state != CLOSED:
+                self.set_state(CLOSED)
+
+    def failure(self, error=None):
+        with self.lock:
+            self.trial = False
+            self.nb_failures += 1
+            self.nb_consecutive_failures += 1
+            self.last_error = str(error) if error is not None else None
+            if self.state == HALF_OPEN or (self.state == CLOSED and self.nb_consecutive_failures >= self.failure_threshold):
+                self.opened_at = monotonic()
+                self.nb_opened += 1
+                self.set_state(OPEN)
+
+    def set_state(self, state):
+        """ Called with the lock held. """
+        print(f'CircuitBreaker: {self.state} -> {state}' + (f' ({self.last_error})' if state == OPEN and self.last_error else ''))
+        self.state = state
+
+    def p99(self):
+        if len(self.latencies) < MIN_SAMPLES:
+            return None
+        return float(np.percentile(self.latencies, 99))
+
+    def timeout(self):
+        """ Adaptive timeout (s), None as long as there are not enough samples. """
+        p99 = self.p99()
+        if p99 is None:
+            return None
+        return max(self.min_timeout, self.timeout_factor * p99)
+
+    def metrics(self):
+        p99 = self.p99()
+        timeout = self.timeout()
+        return {'state': self.state, 'calls': self.nb_calls, 'failures': self.nb_failures,
+                'rejected': self.nb_rejected, 'opened': self.nb_opened, 'last_error': self.last_error,
+                'p99_ms': None if p99 is None else round(p99 * 1000, 1),
+                'timeout_ms': None if timeout is None else round(timeout * 1000, 1)}
+
+
+class BreakerBackend(Backend):
+    """ Backend passing the requests to backend through a CircuitBreaker (args: see CircuitBreaker). """
+    def __init__(self, backend, **breaker_args):
+        super().__init__()
+        self.backend = backend
+        self.breaker = CircuitBreaker(**breaker_args)
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def name(self):
+        return self.backend.name
+
+    @property
+    def status(self):
+        """ (state, text) for the renderer. """
+        state = self.breaker.state
+        return state, STATUS_TEXT[state]
+
+    def rejected(self):
+        return HgcException("Server not reachable, retrying in the background.")
+
+    def call(self, fn):
+        """ Returns fn(adaptive timeout) through the breaker. Raises HgcException when the breaker is open. """
+        if not self.breaker.allow():
+            raise self.rejected()
+        t0 = perf_counter()
+        try:
+            result = fn(self.breaker.timeout())
+        except Exception as e:
+            self.breaker.failure(e)
+            raise
+        if is_failure(result):
+            self.breaker.failure(result)
+        else:
+            self.breaker.success(perf_counter() - t0)
+        return result
+
+    # timeout of the methods below: not used, the breaker passes its adaptive timeout
+
+    def get_state(self, item_name, timeout=None):
+        return self.call(lambda timeout: self.backend.get_state(item_name, timeout))
+
+    def post_state(self, item_name, state, timeout=None):
+        return self.call(lambda timeout: self.backend.post_state(item_name, state, timeout))
+
+    def get_items(self, params=None, etag=None):
+        # The list of all items keeps its own, longer timeout
+        return self.call(lambda timeout: self.backend.get_items(params, etag))
+
+    def call_many(self, item_names, fn):
+        """
+        Returns the dict item name -> result of fn(adaptive timeout) through the breaker, a failure
+        only if all the items failed. When the breaker is open, the results are HgcException.
+        """
+        if not self.breaker.allow():
+            if item_names is None:
+                raise self.rejected()
+            return {name: self.rejected() for name in item_names}
+        t0 = perf_counter()
+        try:
+            results = fn(self.breaker.timeout())
+        except Exception as e:
+            self.breaker.failure(e)
+            raise
+        failures = [r for r in results.values() if is_failure(r)]
+        if results and len(failures) == len(results):
+            self.breaker.failure(failures[0])
+        else:
+            self.breaker.success(perf_counter() - t0)
+        return results
+
+    def get_states(self, item_names=None, tag=None, group=None, timeout=None):
+        return self.call_many(item_names, lambda timeout: self.backend.get_states(item_names, tag, group, timeout))
+
+    def post_states(self, item_names, state, timeout=None):
+        return self.call_many(item_names, lambda timeout: self.backend.post_states(item_names, state, timeout))
+
+    def subscribe(self, topics=None):
+        # Not timed: the events stream stays open
+        if not self.breaker.allow():
+            raise self.rejected()
+        try:
+            events = self.backend.subscribe(topics)
+        except Exception as e:
+            self.breaker.failure(e)
+            raise
+        self.breaker.success()
+        return events
+
+    def probe(self, timeout=None):
+        return self.backend.probe(timeout)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='CircuitBreaker', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        """ Health probe: while the breaker is not closed, try the server every probe_interval seconds. """
+        while not self.stop_event.wait(self.breaker.probe_interval):
+            if self.breaker.state == CLOSED or not self.breaker.allow(count=False):
+                continue
+            try:
+                ok = self.backend.probe(self.breaker.timeout())
+            except Exception as e:
+                self.breaker.failure(e)
+                continue
+            if ok:
+                self.breaker.success()
+            else:
+                self.breaker.failure('probe failed')
+
+    def close(self):
+        self.stop()
+        self.backend.close()
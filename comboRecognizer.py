@@ -0,0 +1,150 @@
+"""
+Recognizes sequences of poses (combos), e.g. WAKEUP -> TWO -> ONE -> ONE, and maps them
+directly to an item action. This skips the area/function/item navigation and its
+speech and REST round trips.
+
+The combos are stored in a trie (one node per pose of a sequence). The recognizer keeps
+the list of partial matches, at most one per start position, so a new pose costs
+O(longest sequence) whatever the number of combos.
+
+A pose counts for a combo when it stands 'min_hold' seconds (usually shorter than the
+'first_trigger_delay' of the pose actions, so a quick combo does not trigger the menu
+navigation). The same pose has to be released for more than 'release_time' seconds to
+count again (ONE -> ONE). If the next pose does not come within 'gap_timeout' seconds,
+the partial matches are dropped.
+When several combos match, the one which started first wins, then the longest one:
+a complete combo waits while a match started earlier can still be completed (e.g.
+TWO -> ONE inside WAKEUP -> TWO -> ONE -> ONE), and a combo which is the beginning of a
+longer combo waits for it. The waiting combo is triggered when the other ones can not be
+completed anymore (other pose or gap timeout).
+"""
+from collections.abc import Mapping
+
+from HandController import ALL_POSES
+from HgcException import HgcException
+
+
+class ComboNode:
+    __slots__ = ('children', 'combo', 'depth')
+    def __init__(self, depth=0):
+        self.children = {}  # pose -> ComboNode
+        self.combo = None   # combo dict if a sequence ends here
+        self.depth = depth
+
+def parse_combos(combos):
+    """
+    Check the combo list of a config. A combo is a dict with the mandatory keys:
+        - name: arbitrary name,
+        - sequence: list of at least 2 poses from ALL_POSES,
+    and optional keys used by the callback (default callback: 'combo'), e.g. 'item' and 'state'.
+    Returns a new list. Raises HgcException on an invalid combo.
+    """
+    res = []
+    seen = {}
+    for c in combos:
+        if not isinstance(c, Mapping):
+            raise HgcException(f"Combo {c} should be a dictionary")
+        for k in ['name', 'sequence']:
+            if k not in c:
+                raise HgcException(f"Mandatory key '{k}' not present in {c}")
+        seq = c['sequence']
+        if not isinstance(seq, (list, tuple)) or len(seq) < 2:
+            raise HgcException(f"Combo sequence {seq} should be a list of at least 2 poses")
+        for pose in seq:
+            if pose not in ALL_POSES:
+                raise HgcException(f"Incorrect pose {pose} in combo {c['name']} !")
+        seq = tuple(seq)
+        if seq in seen:
+            raise HgcException(f"Combos {seen[seq]} and {c['name']} have the same sequence")
+        seen[seq] = c['name']
+        combo = dict(c)
+        combo['sequence'] = list(seq)
+        combo.setdefault('callback', 'combo')
+        res.append(combo)
+    return res
+
+
+class ComboRecognizer:
+    def __init__(self, combos, gap_timeout=1.5, min_hold=0.15, release_time=0.2):
+        self.gap_timeout = gap_timeout
+        self.min_hold = min_hold
+        self.release_time = release_time
+
+        # Build the trie
+        self.root = ComboNode()
+        for combo in parse_combos(combos):
+            node = self.root
+            for pose in combo['sequence']:
+                if pose not in node.children:
+                    node.children[pose] = ComboNode(node.depth + 1)
+                node = node.children[pose]
+            node.combo = combo
+
+        # Partial matches: list of (node, number of the pose where the match started)
+        self.active = []
+        # Complete combo waiting for a match started earlier or a longer combo: (node, start) or None
+        self.deferred = None
+        self.last_time = 0
+        self.nb_poses = 0
+
+        # Pose debouncing, per pose: time when it was entered, last time it was seen
+        self.pose_start = {}
+        self.pose_seen = {}
+        self.counted = set()
+
+    def reset(self):
+        self.active = []
+        self.deferred = None
+
+    def update(self, hand, now):
+        """
+        Call once per frame with the current hand (or None) and time.
+        Returns the list of completed combos (usually empty).
+        """
+        completed = []
+        if (self.active or self.deferred) and now - self.last_time > self.gap_timeout:
+            if self.deferred:
+                completed.append(self.deferred[0].combo)
+            self.reset()
+
+        pose = hand.gesture if hand else None
+        if pose:
+            if now - self.pose_seen.get(pose, -self.release_time - 1) > self.release_time:
+                # (Re)entering the pose
+                self.pose_start[pose] = now
+                self.counted.discard(pose)
+            self.pose_seen[pose] = now
+            if pose not in self.counted and now - self.pose_start[pose] >= self.min_hold:
+                self.counted.add(pose)
+                combo = self.push(pose, now)
+                if combo:
+                    completed.append(combo)
+        return completed
+
+    def push(self, pose, now):
+        """ Advance the partial matches with a new pose. Returns a completed combo or None. """
+        start = self.nb_poses
+        self.nb_poses += 1
+        self.last_time = now
+
+        new_active = []
+        # Best complete combo: the earliest start, then the longest
+        best = self.deferred
+        for node, s in self.active + [(self.root, start)]:
+            child = node.children.get(pose)
+            if child is None:
+                continue
+            if child.children:
+                new_active.append((child, s))
+            if child.combo and (best is None or (s, -child.depth) < (best[1], -best[0].depth)):
+                best = (child, s)
+        self.active = new_active
+        if best is None:
+            return None
+        earliest = min((s for _, s in new_active), default=None)
+        if earliest is not None and earliest <= best[1]:
+            # A match started earlier (or a longer combo with the same start) can still be completed
+            self.deferred = best
+            return None
+        self.reset()
+        return best[0].combo
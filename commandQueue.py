@@ -0,0 +1,250 @@
+"""
+Outbound queue of the commands (POST of an item state) to openHAB, so the gesture loop
+never waits for the network.
+
+    - submit() only queues the command: a background thread sends it with Backend.post_state(),
+    - latest wins: a command for an item which is still waiting replaces the waiting one
+      (e.g. several trackbar values, only the last one is sent), the callback of the replaced
+      command is called with the result SUPERSEDED,
+    - on a connection error the command is retried with exponential backoff
+      (backoff, 2*backoff, ... up to max_backoff seconds), at most max_retries times,
+    - when a command is done (sent or failed), its callback(command, result) is called
+      from poll(), i.e. in the thread of the gesture loop (ItemController.poll()),
+      result is 'OK' or an error text,
+    - a group command (items: list of item names) posts the state to all items concurrently
+      (Backend.post_states()); only the items with a connection error are retried, the result
+      of each item is in command.results,
+    - the waiting commands are saved in a JSON file by the background thread, and sent after
+      a restart (if they are not older than max_age seconds).
+"""
+import json
+import os
+import threading
+from collections import OrderedDict, deque
+from time import monotonic, time
+
+import backends
+from HgcException import HgcException
+
+DEFAULT_PERSIST_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.command_queue.json')
+
+# Result of a command replaced by a newer command for the same item before it was sent
+SUPERSEDED = 'Superseded'
+
+
+class Command:
+    def __init__(self, item_name, state, callback=None, context=None, created=None, items=None, barrier=None):
+        self.item_name = item_name  # for a group command: name of the group
+        self.state = state
+        self.items = items          # group command: the item names, None otherwise
+        self.results = {}           # group command: item name -> 'OK' or error
+        self.callback = callback    # callback(command, result)
+        self.context = context      # anything the callback needs
+        self.barrier = barrier      # called by the queue thread before the first try, e.g. to wait for other writes
+        self.created = time() if created is None else created
+        self.attempts = 0
+        self.next_try = 0           # monotonic time
+
+    def to_dict(self):
+        d = {'item': self.item_name, 'state': self.state, 'created': self.created}
+        if self.items is not None:
+            d['items'] = self.items
+        return d
+
+    def __repr__(self):
+        return f'Command({self.item_name}={self.state}, attempts={self.attempts})'
+
+
+class CommandQueue:
+    def __init__(self, persist_file=DEFAULT_PERSIST_FILE, max_retries=5, backoff=0.5, max_backoff=8.0, max_age=300, backend=None):
+        self.backend = backend or backends.default()
+        self.persist_file = persist_file
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_age = max_age
+
+        self.waiting = OrderedDict()    # item name -> Command, in order of submission
+        self.sending = None             # command being sent
+        self.completions = deque()      # (command, result), drained by poll()
+        self.dirty = False              # the persist file must be written again
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Statistics
+        self.nb_sent = 0
+        self.nb_failed = 0
+        self.nb_retries = 0
+        self.nb_coalesced = 0
+
+        self.restore()
+
+    def submit(self, item_name, state, callback=None, context=None, items=None, barrier=None):
+        """
+        Queue a command (a group command if items is given), returns immediately.
+        barrier: called in the thread of the queue before the command is sent (see Command).
+        """
+        command = Command(item_name, state, callback, context, items=items, barrier=barrier)
+        with self.cond:
+            old = self.waiting.pop(item_name, None)
+            if old is not None:
+                self.superseded(old, command)
+            self.waiting[item_name] = command
+            self.dirty = True
+            self.cond.notify()
+        return command
+
+    def superseded(self, old, command):
+        self.nb_coalesced += 1
+        print(f'CommandQueue: {old} replaced by {command}')
+        self.completions.append((old, SUPERSEDED))
+
+    def poll(self):
+        """ Call the callbacks of the done commands. Returns the number of done commands. """
+        n = 0
+        while self.completions:
+            command, result = self.completions.popleft()
+            n += 1
+            if command.callback:
+                command.callback(command, result)
+            else:
+                print(f'CommandQueue: {command}: {result}')
+        return n
+
+    def pending(self):
+        """ Number of commands waiting, without the one being sent. """
+        return len(self.waiting)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='CommandQueue', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=1):
+        """ Stops the thread, waits at most timeout seconds for it to save the waiting commands. """
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify()
+        if self.thread is not None:
+            self.thread.join(timeout)
+
+    def next_command(self):
+        """ Wait for the next command which is ready to be sent, remove it from the waiting commands. """
+        while True:
+            self.save()
+            with self.cond:
+                if self.stop_event.is_set():
+                    return None
+                if self.dirty:
+                    # Changed while saving
+                    continue
+                now = monotonic()
+                ready = [c for c in self.waiting.values() if c.next_try <= now]
+                if ready:
+                    self.sending = self.waiting.pop(ready[0].item_name)
+                    return self.sending
+                timeout = min((c.next_try for c in self.waiting.values()), default=now + 1) - now
+                self.cond.wait(timeout)
+
+    def run(self):
+        while True:
+            command = self.next_command()
+            if command is None:
+                self.save()
+                break
+            if command.barrier is not None:
+                command.barrier()
+                command.barrier = None
+            command.attempts += 1
+            result, error = self.send(command)
+            if error is not None:
+                if command.attempts <= self.max_retries and not self.stop_event.is_set():
+                    self.retry(command)
+                    continue
+                result = f'Sorry, could not set state. {error} Please check connection to rest API.'
+            if result == 'OK':
+                self.nb_sent += 1
+            else:
+                self.nb_failed += 1
+            self.completions.append((command, result))
+            with self.cond:
+                self.sending = None
+                self.dirty = True
+
+    def send(self, command):
+        """ Returns (result, connection error or None). """
+        if command.items is None:
+            try:
+                r = self.backend.post_state(command.item_name, command.state)
+            except HgcException as he:
+                return None, he.args[0]
+            return ('OK' if r == 'OK' else 'Sorry, request failed. Please check configuration.'), None
+        # Group: send to the items not done yet
+        todo = [n for n in command.items if command.results.get(n) != 'OK']
+        error = None
+        for name, r in self.backend.post_states(todo, command.state).items():
+            if isinstance(r, HgcException):
+                error = r.args[0]
+                r = f'{r.args[0]}'
+            elif r != 'OK':
+                r = 'Request failed.'
+            command.results[name] = r
+        if error is not None and any(r == 'OK' for r in command.results.values()):
+            print(f'CommandQueue: {command}: {sum(r == "OK" for r in command.results.values())} of {len(command.items)} items done')
+        if error is None:
+            nb_ok = sum(r == 'OK' for r in command.results.values())
+            result = 'OK' if nb_ok == len(command.items) else 'Sorry, request failed. Please check configuration.'
+            return result, None
+        return None, error
+
+    def retry(self, command):
+        delay = min(self.max_backoff, self.backoff * 2 ** (command.attempts - 1))
+        print(f'CommandQueue: {command} failed, retry in {delay:.1f} s')
+        self.nb_retries += 1
+        command.next_try = monotonic() + delay
+        with self.cond:
+            self.sending = None
+            # Latest wins: a newer command for the same item replaces the retry
+            if command.item_name not in self.waiting:
+                self.waiting[command.item_name] = command
+                self.waiting.move_to_end(command.item_name, last=False)
+            else:
+                self.superseded(command, self.waiting[command.item_name])
+            self.dirty = True
+
+    def save(self):
+        """ Save the waiting commands (and the one being sent) if they changed. Called from the thread of the queue. """
+        with self.cond:
+            if not self.dirty:
+                return
+            self.dirty = False
+            if not self.persist_file:
+                return
+            commands = list(self.waiting.values())
+            if self.sending is not None and self.sending.item_name not in self.waiting:
+                commands.insert(0, self.sending)
+            saved = [c.to_dict() for c in commands]
+        # Written without the lock, submit() does not wait for the file
+        try:
+            tmp = self.persist_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(saved, f)
+            os.replace(tmp, self.persist_file)
+        except OSError as e:
+            print(f'CommandQueue: could not write {self.persist_file}: {e}')
+
+    def restore(self):
+        """ Queue the commands saved by a previous run. """
+        if not self.persist_file:
+            return
+        try:
+            with open(self.persist_file) as f:
+                saved = json.load(f)
+            now = time()
+            for c in saved:
+                if now - c['created'] <= self.max_age:
+                    self.waiting[c['item']] = Command(c['item'], c['state'], created=c['created'], items=c.get('items'))
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if self.waiting:
+            print(f'CommandQueue: {len(self.waiting)} commands restored from {self.persist_file}')
@@ -0,0 +1,177 @@
+"""
+Loads the hand gesture control configuration from JSON or TOML files.
+
+A config file is compiled once: it is merged with HandController.DEFAULT_CONFIG,
+validated (pose actions, motion actions, combos and item tree) and the pose actions are expanded like
+HandController.parse_poses() does. The compiled result is stored with marshal in
+CACHE_DIR, keyed by the SHA-256 hash of the source file, of DEFAULT_CONFIG and of
+CACHE_VERSION, so the next start with an unchanged file skips parsing and validation.
+
+The returned CompiledConfig is read-only: nested dicts are MappingProxyType,
+lists are tuples.
+"""
+import copy
+import hashlib
+import json
+import marshal
+import os
+from collections.abc import Mapping
+from types import MappingProxyType
+
+from HandController import DEFAULT_CONFIG, merge_config, parse_pose_actions
+from comboRecognizer import parse_combos
+from dynamicGestures import parse_motion_actions
+from HgcException import HgcException
+from itemIndex import ItemIndex
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.config_cache')
+# Bump this when compile_config() or the layout of the compiled config changes,
+# old cache files are then ignored
+CACHE_VERSION = 2
+
+
+def freeze(obj):
+    """ Returns a read-only copy of obj: dict -> MappingProxyType, list -> tuple. """
+    if isinstance(obj, Mapping):
+        return MappingProxyType({k: freeze(v) for k, v in obj.items()})
+    if isinstance(obj, (list, tuple)):
+        return tuple(freeze(v) for v in obj)
+    return obj
+
+def thaw(obj):
+    """ Returns a mutable copy of a frozen object: Mapping -> dict, tuple -> list. """
+    if isinstance(obj, Mapping):
+        return {k: thaw(v) for k, v in obj.items()}
+    if isinstance(obj, (list, tuple)):
+        return [thaw(v) for v in obj]
+    return obj
+
+
+class CompiledConfig(Mapping):
+    """
+    Immutable, validated config. Behaves like a read-only dict.
+        source: path of the config file (None if compiled from a dict)
+        digest: SHA-256 hex digest of the source file
+        from_cache: True if the compiled config was read from the cache
+    """
+    def __init__(self, data, source=None, digest=None, from_cache=False):
+        self._data = freeze(data)
+        self.source = source
+        self.digest = digest
+        self.from_cache = from_cache
+
+    def __getitem__(self, key):
+        return self._data[key]
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+    def __repr__(self):
+        return f'CompiledConfig({self.source!r}, digest={self.digest!r})'
+
+    def thaw(self):
+        return thaw(self._data)
+
+
+def validate_item_tree(item_tree):
+    """
+    Check the structure of an item tree (menu levels of any depth, items with a 'name'
+    and a 'type', one of ITEM_TYPES) by compiling it. Raises HgcException on the first error.
+    """
+    ItemIndex(item_tree)
+
+def compile_config(raw):
+    """
+    Merge a user defined config (dict) with DEFAULT_CONFIG, validate it and
+    expand its pose actions. Returns a plain dict (see CompiledConfig for the frozen one).
+    """
+    if not isinstance(raw, dict):
+        raise HgcException(f"Config should be a dictionary, not {type(raw).__name__}")
+    config = merge_config(copy.deepcopy(DEFAULT_CONFIG), raw)
+    if not isinstance(config.get('pose_actions', []), list):
+        raise HgcException("'pose_actions' should be a list")
+    config['pose_actions'] = parse_pose_actions(config.get('pose_actions', []), config['pose_params'])
+    if 'combos' in config:
+        if not isinstance(config['combos'], list):
+            raise HgcException("'combos' should be a list")
+        config['combos'] = parse_combos(config['combos'])
+    if 'motion_actions' in config:
+        if not isinstance(config['motion_actions'], list):
+            raise HgcException("'motion_actions' should be a list")
+        config['motion_actions'] = parse_motion_actions(config['motion_actions'])
+    # Forcing solo mode and use_gesture (as HandController does for dict configs)
+    config['tracker']['args']['solo'] = True
+    config['tracker']['args']['use_gesture'] = True
+    if 'item_tree' in config:
+        validate_item_tree(config['item_tree'])
+    return config
+
+def parse_config_file(path, data):
+    """ Parse the content (bytes) of a JSON or TOML config file, depending on the file extension. """
+    ext = os.path.splitext(path)[1].lower()
+    try:
+        if ext == '.json':
+            return json.loads(data)
+        elif ext == '.toml':
+            try:
+                import tomllib
+            except ImportError:
+                try:
+                    import tomli as tomllib
+                except ImportError:
+                    raise HgcException("Reading TOML config files needs Python 3.11 or the 'tomli' package.")
+            return tomllib.loads(data.decode('utf-8'))
+        else:
+            raise HgcException(f"Unknown config file format '{ext}', use .json or .toml")
+    except (ValueError, UnicodeDecodeError) as e:
+        # json.JSONDecodeError and tomllib.TOMLDecodeError are ValueErrors
+        raise HgcException(f"Could not parse config file {path}: {e}")
+
+def cache_key(digest):
+    """ Key of the compiled config of a file with SHA-256 digest: also depends on the defaults merged in and the compiler. """
+    return hashlib.sha256(f'{CACHE_VERSION}|{DEFAULT_CONFIG!r}|{digest}'.encode()).hexdigest()
+
+def cache_path(path, key):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(CACHE_DIR, f'{name}-{key[:16]}.bin')
+
+def load_config(path, use_cache=True):
+    """
+    Load, compile and validate a config file. Returns a CompiledConfig.
+    Raises HgcException if the file can not be read or is not valid.
+    """
+    try:
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        raise HgcException(f"Could not read config file {path}: {e.strerror}")
+    digest = hashlib.sha256(data).hexdigest()
+    key = cache_key(digest)
+    cached = cache_path(path, key)
+
+    if use_cache:
+        try:
+            with open(cached, 'rb') as f:
+                version, cached_key, config = marshal.load(f)
+            if version == CACHE_VERSION and cached_key == key:
+                return CompiledConfig(config, source=path, digest=digest, from_cache=True)
+        except (OSError, EOFError, ValueError, TypeError):
+            # No cache file yet, or a broken one: compile again
+            pass
+
+    config = compile_config(parse_config_file(path, data))
+
+    if use_cache:
+        try:
+            os.makedirs(CACHE_DIR, exist_ok=True)
+            tmp = cached + '.tmp'
+            with open(tmp, 'wb') as f:
+                marshal.dump((CACHE_VERSION, key, config), f)
+            os.replace(tmp, cached)
+        except (OSError, ValueError) as e:
+            # ValueError: value not supported by marshal (e.g. TOML dates)
+            print(f'configLoader: could not write cache file {cached}: {e}')
+    return CompiledConfig(config, source=path, digest=digest)
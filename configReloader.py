@@ -0,0 +1,154 @@
+"""
+Hot reload of the item tree and the pose actions while the HandTracker keeps running.
+
+A background thread polls the modification time of the watched files:
+    - the config file (if the config was loaded with configLoader): pose actions, motion
+      actions, combos and the item tree if the config file has an 'item_tree',
+    - itemTree.py otherwise, for the item tree (unless the item tree is discovered from openHAB).
+A changed file is compiled and validated in the background thread. The new tables are
+then swapped in by HandController.loop() between two frames (apply()), so the
+gesture recognition never sees a half updated configuration.
+If compiling or validating fails, the running configuration is kept (rollback).
+"""
+import os
+import runpy
+import threading
+from time import monotonic
+
+import configLoader
+import itemTree
+from HgcException import HgcException
+
+
+class ConfigReloader:
+    def __init__(self, hand_controller, interval=1.0):
+        self.hand_controller = hand_controller
+        self.interval = interval
+
+        config = hand_controller.config
+        self.config_file = getattr(config, 'source', None)
+        self.tree_from_config = self.config_file is not None and 'item_tree' in config
+        self.watched = []
+        if self.config_file:
+            self.watched.append(self.config_file)
+        # A discovered item tree (itemDiscovery.py) is refreshed by ItemDiscovery
+        self.watch_item_tree = not self.tree_from_config and getattr(hand_controller.item_controller, 'discovery', None) is None
+        if self.watch_item_tree:
+            self.item_tree_file = os.path.abspath(itemTree.__file__)
+            self.watched.append(self.item_tree_file)
+        self.mtimes = {f: self.mtime(f) for f in self.watched}
+
+        self.lock = threading.Lock()
+        self.pending = None     # (item_tree, pose_actions, motion_actions, combos, detection time), None = nothing to apply
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Statistics
+        self.nb_reloads = 0
+        self.nb_errors = 0
+        self.last_error = None
+        self.last_latency = None    # s, from detection of the change to the swap
+
+    @staticmethod
+    def mtime(path):
+        try:
+            st = os.stat(path)
+            return (st.st_mtime_ns, st.st_size)
+        except OSError:
+            return None
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ConfigReloader', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            changed = []
+            for f in self.watched:
+                m = self.mtime(f)
+                if m != self.mtimes[f]:
+                    self.mtimes[f] = m
+                    changed.append(f)
+            if changed:
+                self.reload(changed)
+
+    def reload(self, changed):
+        """ Compile and validate the changed files. Called in the background thread. """
+        t0 = monotonic()
+        print(f'ConfigReloader: {", ".join(changed)} changed, reloading ...')
+        item_tree = None
+        pose_actions = None
+        motion_actions = None
+        combos = None
+        try:
+            if self.config_file in changed:
+                config = configLoader.load_config(self.config_file)
+                pose_actions = list(config['pose_actions'])
+                motion_actions = config.get('motion_actions', ())
+                combos = config.get('combos', ())
+                if self.tree_from_config:
+                    if 'item_tree' not in config:
+                        raise HgcException("'item_tree' was removed from the config file")
+                    item_tree = config['item_tree']
+            if self.watch_item_tree and self.item_tree_file in changed:
+                # Run the file in a fresh namespace: the itemTree module itself stays untouched
+                item_tree = runpy.run_path(self.item_tree_file).get('itemTree')
+                if item_tree is None:
+                    raise HgcException(f"No 'itemTree' in {self.item_tree_file}")
+                configLoader.validate_item_tree(item_tree)
+        except Exception as e:
+            # Any error (also a SyntaxError in itemTree.py) keeps the running configuration
+            self.nb_errors += 1
+            self.last_error = str(e)
+            print(f'ConfigReloader: reload failed, keeping current configuration: {e}')
+            return
+        compile_time = monotonic() - t0
+        print(f'ConfigReloader: compiled in {compile_time*1000:.1f} ms')
+        with self.lock:
+            self.pending = (item_tree, pose_actions, motion_actions, combos, t0)
+
+    def apply(self):
+        """
+        Swap in the pending item tree and pose actions, if any.
+        Must be called from the thread running HandController.loop(), between two frames.
+        """
+        if self.pending is None:
+            return False
+        with self.lock:
+            item_tree, pose_actions, motion_actions, combos, t0 = self.pending
+            self.pending = None
+        hc = self.hand_controller
+        ic = hc.item_controller
+        # set_item_tree() also replaces the index and may move or clear the selection
+        old_items = (ic.item_tree, ic.index, ic.node, ic.page, dict(ic.selections), ic.item_type)
+        old_pose_actions = hc.pose_actions
+        old_poses_hist = hc.poses_hist
+        old_motion = (hc.motion_actions, hc.motion_recognizer)
+        old_combo_recognizer = hc.combo_recognizer
+        try:
+            if pose_actions is not None:
+                hc.set_pose_actions(pose_actions)
+            if motion_actions is not None:
+                hc.set_motion_actions(motion_actions)
+            if combos is not None:
+                hc.set_combos(combos)
+            if item_tree is not None:
+                ic.set_item_tree(item_tree)
+        except Exception as e:
+            # Rollback
+            ic.item_tree, ic.index, ic.node, ic.page, ic.selections, ic.item_type = old_items
+            hc.pose_actions = old_pose_actions
+            hc.poses_hist = old_poses_hist
+            hc.motion_actions, hc.motion_recognizer = old_motion
+            hc.combo_recognizer = old_combo_recognizer
+            self.nb_errors += 1
+            self.last_error = str(e)
+            print(f'ConfigReloader: could not apply new configuration, rolled back: {e}')
+            return False
+        self.nb_reloads += 1
+        self.last_latency = monotonic() - t0
+        print(f'ConfigReloader: reload #{self.nb_reloads} applied, latency {self.last_latency*1000:.1f} ms')
+        return True
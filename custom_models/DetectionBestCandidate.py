@@ -17,7 +17,7 @@ class DetectionBestCandidate(nn.Module):
         # anchors shape is nb_anchorsx4 [x_center, y_center, width, height]
         # Here: width and height is always 1, so we keep just [x_center, y_center]
         self.anchors = torch.from_numpy(anchors[:,:2])
-        self.plus_anchor_center = np.array([[1,0,0,0,1,0,1,0,1,0,1,0,1,0,1,0,1,0], [0,1,0,0,0,1,0,1,0,1,0,1,0,1,0,1,0,1]], dtype=np.float)
+        self.plus_anchor_center = np.array([[1,0,0,0,1,0,1,0,1,0,1,0,1,0,1,0,1,0], [0,1,0,0,0,1,0,1,0,1,0,1,0,1,0,1,0,1]], dtype=float)
         self.plus_anchor_center = torch.from_numpy(self.plus_anchor_center)
 
     def forward(self, x, y):
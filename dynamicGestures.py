@@ -0,0 +1,128 @@
+"""
+Recognition of dynamic gestures (motions) from the trajectory of the hand landmarks:
+    - SWIPE_LEFT, SWIPE_RIGHT, SWIPE_UP, SWIPE_DOWN: fast move of the hand in one direction,
+    - CIRCLE_CW, CIRCLE_CCW: the hand draws a circle (clockwise / counterclockwise on the image),
+    - PUSH, PULL: the hand moves towards / away from the camera (the hand gets bigger / smaller).
+Directions are given in image coordinates: for a user facing the camera, a move to the
+user's right is a SWIPE_LEFT.
+
+The positions of the wrist and the 5 fingertips of the last 'window' frames are kept in a
+fixed-size numpy ring buffer, with the size of the hand. Each frame, the velocity features
+(displacement, path length, turning angle, scale ratio) are computed vectorized over the
+window, so the cost per frame is constant. Distances are measured in hand sizes, so the
+thresholds do not depend on the distance to the camera.
+After a motion is recognized, the buffer is cleared and no motion is recognized for
+'cooldown' seconds.
+"""
+from collections.abc import Mapping
+from math import pi
+
+import numpy as np
+
+from HgcException import HgcException
+
+ALL_MOTIONS = ["SWIPE_LEFT", "SWIPE_RIGHT", "SWIPE_UP", "SWIPE_DOWN", "CIRCLE_CW", "CIRCLE_CCW", "PUSH", "PULL"]
+
+# Wrist and fingertips
+TRACKED_LANDMARKS = [0, 4, 8, 12, 16, 20]
+
+
+def parse_motion_actions(motion_actions):
+    """
+    Check the motion actions of a config. A motion action is a dict with the mandatory keys
+    'name', 'motion' (one of ALL_MOTIONS) and 'callback'. Returns a new list.
+    Raises HgcException on an invalid motion action.
+    """
+    res = []
+    for ma in motion_actions:
+        if not isinstance(ma, Mapping):
+            raise HgcException(f"Motion action {ma} should be a dictionary")
+        for k in ['name', 'motion', 'callback']:
+            if k not in ma:
+                raise HgcException(f"Mandatory key '{k}' not present in {ma}")
+        if ma['motion'] not in ALL_MOTIONS:
+            raise HgcException(f"Incorrect motion {ma['motion']} in {ma} !")
+        res.append(dict(ma))
+    return res
+
+
+class MotionRecognizer:
+    def __init__(self, window=15, swipe_dist=1.2, circle_turns=0.8, circle_min_path=2.5,
+                push_ratio=1.3, cooldown=0.6):
+        self.window = window
+        self.swipe_dist = swipe_dist            # hand sizes
+        self.circle_turns = circle_turns        # number of turns
+        self.circle_min_path = circle_min_path  # hand sizes
+        self.push_ratio = push_ratio            # ratio of the hand sizes at the end and at the start
+        self.cooldown = cooldown                # s
+
+        # Ring buffer
+        self.points = np.zeros((window, len(TRACKED_LANDMARKS), 2), dtype=np.float32)
+        self.scales = np.ones(window, dtype=np.float32)
+        self.pos = 0
+        self.count = 0
+        # Chronological order of the buffer for each write position
+        self.orders = (np.arange(window)[None, :] + np.arange(window)[:, None]) % window
+        self.quarter = max(1, window // 4)
+        self.blocked_until = 0
+
+    def reset(self):
+        self.pos = 0
+        self.count = 0
+
+    def update(self, hand, now):
+        """ Call once per frame with the current hand (or None). Returns the recognized motion or None. """
+        if hand is None or getattr(hand, 'landmarks', None) is None:
+            self.reset()
+            return None
+        landmarks = hand.landmarks
+        self.points[self.pos] = landmarks[TRACKED_LANDMARKS, :2]
+        size = getattr(hand, 'rect_w_a', None)
+        if not size:
+            size = float(np.ptp(landmarks[:, :2], axis=0).max())
+        self.scales[self.pos] = max(size, 1.0)
+        self.pos = (self.pos + 1) % self.window
+        self.count = min(self.count + 1, self.window)
+        if self.count < self.window or now < self.blocked_until:
+            return None
+
+        motion = self.detect()
+        if motion:
+            self.reset()
+            self.blocked_until = now + self.cooldown
+        return motion
+
+    def detect(self):
+        order = self.orders[self.pos]
+        centers = self.points[order].mean(axis=1)   # (window, 2)
+        scales = self.scales[order]
+        ref = scales.mean()
+
+        displacement = (centers[-1] - centers[0]) / ref
+        v = np.diff(centers, axis=0)
+        speed = np.hypot(v[:, 0], v[:, 1])
+        path = speed.sum() / ref
+        moving = speed > 0.02 * ref
+        angles = np.arctan2(v[moving, 1], v[moving, 0])
+        turns = 0.0
+        if len(angles) > 1:
+            dtheta = (np.diff(angles) + pi) % (2 * pi) - pi
+            turns = dtheta.sum() / (2 * pi)
+        scale_ratio = scales[-self.quarter:].mean() / scales[:self.quarter].mean()
+
+        if abs(turns) >= self.circle_turns and path >= self.circle_min_path:
+            # Image y axis points down: a positive angle is clockwise on the screen
+            return "CIRCLE_CW" if turns > 0 else "CIRCLE_CCW"
+        dx, dy = displacement
+        dist = np.hypot(dx, dy)
+        if dist >= self.swipe_dist:
+            if abs(dx) >= 2 * abs(dy):
+                return "SWIPE_RIGHT" if dx > 0 else "SWIPE_LEFT"
+            if abs(dy) >= 2 * abs(dx):
+                return "SWIPE_DOWN" if dy > 0 else "SWIPE_UP"
+        elif dist < self.swipe_dist / 2:
+            if scale_ratio >= self.push_ratio:
+                return "PUSH"
+            if scale_ratio <= 1 / self.push_ratio:
+                return "PULL"
+        return None
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Local stand-in for the openHAB REST API, to try, benchmark and load-test the hand gesture
+control without an openHAB server.
+
+Implements the requests used by iface.py:
+    GET  /rest/items                 all items (JSON), optional 'fields', with ETag
+    GET  /rest/items/<name>/state    state of an item (text/plain)
+    POST /rest/items/<name>          command (text/plain), the state changes immediately
+    GET  /rest/events                server-sent events: ItemCommandEvent, ItemStateChangedEvent
+The items are taken from itemTree.py (bool -> Switch 'OFF', percentage -> Dimmer '0').
+
+Every request (except the events stream) can be slowed down and made to fail, with a
+seeded random generator, so runs are reproducible:
+    latency, jitter     s, each request takes latency +- jitter (uniform)
+    failure_rate        part of the requests answered with 503 Service Unavailable
+    drop_rate           part of the requests where the connection is closed without answer
+FakeItems (the items, the events and the injection) is also used in-process by
+backends.FakeBackend.
+
+Example:
+    python fakeOpenhab.py --port 8080 --latency 0.05 --jitter 0.02 --failure-rate 0.05
+and use the backend {'type': 'openhab', 'url': 'http://127.0.0.1:8080/rest/items'} in the config.
+"""
+import argparse
+import hashlib
+import json
+import queue
+import random
+import socket
+import sys
+import threading
+from time import sleep
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs
+
+import itemTree
+from itemIndex import ItemIndex
+
+ITEM_TYPES = {'bool': ('Switch', 'OFF'), 'percentage': ('Dimmer', '0')}
+
+
+def items_from_tree(item_tree):
+    """ Returns the list of items (dicts like the REST API) of an item tree. """
+    index = ItemIndex(item_tree)
+    items = {}
+    for node in index.leaf_order:
+        item = index.items[node]
+        item_type, state = ITEM_TYPES[item['type']]
+        items[item['name']] = {'name': item['name'], 'type': item_type, 'state': state,
+                               'label': item.get('label', ''), 'tags': [], 'groupNames': []}
+    return list(items.values())
+
+
+class FakeItems:
+    """ The items with their states, the events and the latency / failure injection. """
+    def __init__(self, items, latency=0, jitter=0, failure_rate=0, drop_rate=0, seed=0):
+        self.items = {it['name']: dict(it) for it in items}
+        self.lock = threading.Lock()
+        self.subscribers = []   # one queue of events per open events stream
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.drop_rate = drop_rate
+        self.random = random.Random(seed)
+        self.nb_requests = 0
+        self.nb_failures = 0
+        self.nb_drops = 0
+
+    def simulate(self):
+        """
+        Called for each request: waits for the simulated latency.
+        Returns None, 'fail' (answer with an error) or 'drop' (no answer).
+        """
+        with self.lock:
+            self.nb_requests += 1
+            delay = self.latency + (self.random.uniform(-self.jitter, self.jitter) if self.jitter else 0)
+            r = self.random.random()
+        if delay > 0:
+            sleep(delay)
+        if r < self.drop_rate:
+            self.nb_drops += 1
+            return 'drop'
+        if r < self.drop_rate + self.failure_rate:
+            self.nb_failures += 1
+            return 'fail'
+        return None
+
+    def items_json(self, fields=None):
+        """ Returns (body, etag) of the list of items, fields: list of the fields to keep. """
+        with self.lock:
+            items = [dict(it) for it in self.items.values()]
+        if fields:
+            items = [{k: v for k, v in it.items() if k in fields} for it in items]
+        body = json.dumps(items).encode()
+        return body, '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+
+    def subscribe(self):
+        """ Returns a queue receiving the events (None when the stream ends). """
+        q = queue.Queue()
+        with self.lock:
+            self.subscribers.append(q)
+        return q
+
+    def unsubscribe(self, q):
+        with self.lock:
+            if q in self.subscribers:
+                self.subscribers.remove(q)
+
+    def close_subscriptions(self):
+        with self.lock:
+            for q in self.subscribers:
+                q.put(None)
+
+    def set_state(self, name, state, command=False):
+        """ Change the state of an item (e.g. switched by hand), sends the events. Returns False if unknown item. """
+        with self.lock:
+            item = self.items.get(name)
+            if item is None:
+                return False
+            old_state = item['state']
+            item['state'] = state
+            events = []
+            if command:
+                events.append(self.event(f'openhab/items/{name}/command', 'ItemCommandEvent', {'type': 'String', 'value': state}))
+            events.append(self.event(f'openhab/items/{name}/stateupdated', 'ItemStateUpdatedEvent', {'type': 'String', 'value': state}))
+            if state != old_state:
+                events.append(self.event(f'openhab/items/{name}/statechanged', 'ItemStateChangedEvent',
+                                         {'type': 'String', 'value': state, 'oldType': 'String', 'oldValue': old_state}))
+            for q in self.subscribers:
+                for e in events:
+                    q.put(e)
+        return True
+
+    @staticmethod
+    def event(topic, event_type, payload):
+        return {'topic': topic, 'payload': json.dumps(payload), 'type': event_type}
+
+
+class FakeOpenhab(FakeItems):
+    """ HTTP server of FakeItems. """
+    def __init__(self, items, host='127.0.0.1', port=0, **injection):
+        super().__init__(items, **injection)
+        self.nb_connections = 0     # TCP connections accepted
+        self.connections = set()    # open connections, closed by stop()
+        handler = type('Handler', (RequestHandler,), {'openhab': self})
+        self.server = Server((host, port), handler)
+        self.server.daemon_threads = True
+        self.thread = None
+
+    @property
+    def url(self):
+        """ URL of the items, to be used as iface.url_str """
+        host, port = self.server.server_address[:2]
+        return f'http://{host}:{port}/rest/items'
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='FakeOpenhab', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.close_subscriptions()
+        self.server.shutdown()
+        self.server.server_close()
+        # Also close the kept-alive connections, like a server going down
+        for conn in list(self.connections):
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+class Server(ThreadingHTTPServer):
+    def handle_error(self, request, client_address):
+        # A client closing its connection (e.g. a cancelled request) is not an error
+        if not isinstance(sys.exc_info()[1], ConnectionError):
+            super().handle_error(request, client_address)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+    openhab = None  # set in FakeOpenhab
+
+    def setup(self):
+        super().setup()
+        self.openhab.nb_connections += 1
+        self.openhab.connections.add(self.connection)
+
+    def finish(self):
+        self.openhab.connections.discard(self.connection)
+        super().finish()
+
+    def log_message(self, format, *args):
+        pass
+
+    def send(self, status, body=b'', content_type='text/plain', headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def injected_failure(self):
+        """ Simulates latency and failures, returns True if the request is already answered. """
+        failure = self.openhab.simulate()
+        if failure == 'drop':
+            self.close_connection = True
+            self.connection.shutdown(socket.SHUT_RDWR)
+            return True
+        if failure == 'fail':
+            self.send(503, b'Service Unavailable')
+            return True
+        return False
+
+    def do_GET(self):
+        oh = self.openhab
+        url = urlsplit(self.path)
+        parts = url.path.strip('/').split('/')
+        query = parse_qs(url.query)
+        if parts == ['rest', 'events']:
+            self.stream_events()
+            return
+        if self.injected_failure():
+            return
+        if parts == ['rest']:
+            self.send(200, b'{"version": "fake"}', 'application/json')
+        elif parts == ['rest', 'items']:
+            fields = query['fields'][0].split(',') if 'fields' in query else None
+            body, etag = oh.items_json(fields)
+            if self.headers.get('If-None-Match') == etag:
+                self.send(304, headers={'ETag': etag})
+            else:
+                self.send(200, body, 'application/json', {'ETag': etag})
+        elif len(parts) == 4 and parts[:2] == ['rest', 'items'] and parts[3] == 'state':
+            item = oh.items.get(parts[2])
+            if item is None:
+                self.send(404, b'Item not found')
+            else:
+                self.send(200, item['state'].encode())
+        else:
+            self.send(404, b'Not found')
+
+    def do_POST(self):
+        oh = self.openhab
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        state = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode()
+        if self.injected_failure():
+            return
+        if len(parts) == 3 and parts[:2] == ['rest', 'items'] and oh.set_state(parts[2], state, command=True):
+            self.send(200)
+        else:
+            self.send(404, b'Item not found')
+
+    def stream_events(self):
+        oh = self.openhab
+        q = oh.subscribe()
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Transfer-Encoding', 'chunked')
+        self.end_headers()
+        try:
+            while True:
+                event = q.get()
+                if event is None:
+                    break
+                data = f'event: message\ndata: {json.dumps(event)}\n\n'.encode()
+                self.wfile.write(f'{len(data):x}\r\n'.encode() + data + b'\r\n')
+                self.wfile.flush()
+            self.wfile.write(b'0\r\n\r\n')
+        except OSError:
+            # Client disconnected
+            pass
+        finally:
+            oh.unsubscribe(q)
+            self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Stand-in for the openHAB REST API')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0, help='s per request')
+    parser.add_argument('--jitter', type=float, default=0, help='s, +- on the latency')
+    parser.add_argument('--failure-rate', type=float, default=0, help='part of the requests answered with 503')
+    parser.add_argument('--drop-rate', type=float, default=0, help='part of the requests without answer')
+    parser.add_argument('--seed', type=int, default=0, help='seed of the random generator')
+    args = parser.parse_args()
+    oh = FakeOpenhab(items_from_tree(itemTree.itemTree), args.host, args.port, latency=args.latency,
+                     jitter=args.jitter, failure_rate=args.failure_rate, drop_rate=args.drop_rate, seed=args.seed)
+    print(f'Fake openHAB serving {len(oh.items)} items on {oh.url}')
+    try:
+        oh.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+Sliding-window voting over the per-frame gestures, to filter single misclassified frames
+(e.g. FOUR/BACK or ONE/WAKEUP) before they reach the trigger logic of the HandController.
+
+The last 'window' gesture ids and scores (landmark score of the hand) are kept in a numpy
+ring buffer. The summed score per gesture is updated incrementally, so one frame costs
+O(number of poses), independent of the window size.
+Hysteresis: the voted gesture changes to a new gesture only when the new one gets at least
+'enter_ratio' of the votes, and the current gesture is kept as long as it has at least
+'exit_ratio' of the votes.
+"""
+import numpy as np
+
+from HandController import ALL_POSES
+
+NO_GESTURE = 0  # id of "no hand / no gesture", the poses have the ids 1..len(ALL_POSES)
+
+
+class GestureVoter:
+    def __init__(self, window=5, enter_ratio=0.6, exit_ratio=0.4, no_hand_score=1.0):
+        self.window = window
+        self.enter_ratio = enter_ratio
+        self.exit_ratio = exit_ratio
+        self.no_hand_score = no_hand_score
+        self.gesture_ids = {g: i + 1 for i, g in enumerate(ALL_POSES)}
+        self.gestures = [None] + list(ALL_POSES)
+
+        # Ring buffer, sum of scores per gesture id over the window
+        self.ids = np.zeros(window, dtype=np.int8)
+        self.scores = np.zeros(window, dtype=np.float64)
+        self.totals = np.zeros(len(self.gestures), dtype=np.float64)
+        self.reset()
+
+    def reset(self):
+        """ Fill the window with "no hand" votes. """
+        self.ids[:] = NO_GESTURE
+        self.scores[:] = self.no_hand_score
+        self.totals[:] = 0
+        self.totals[NO_GESTURE] = self.scores.sum()
+        self.total = float(self.totals[NO_GESTURE])
+        self.pos = 0
+        self.current = NO_GESTURE
+
+    def update(self, gesture, score=1.0):
+        """ Add the gesture (None if no hand) of a new frame. Returns the voted gesture (or None). """
+        gid = self.gesture_ids.get(gesture, NO_GESTURE)
+        if gid == NO_GESTURE and gesture is None:
+            score = self.no_hand_score
+        pos = self.pos
+        old_score = self.scores[pos]
+        self.totals[self.ids[pos]] -= old_score
+        self.ids[pos] = gid
+        self.scores[pos] = score
+        self.totals[gid] += score
+        self.total += score - old_score
+        self.pos = (pos + 1) % self.window
+        if self.pos == 0:
+            # Once per window: recompute the sums to get rid of rounding errors
+            self.totals = np.bincount(self.ids, weights=self.scores, minlength=len(self.gestures))
+            self.total = float(self.scores.sum())
+
+        total = self.total
+        if total <= 0:
+            return self.gestures[self.current]
+        winner = int(np.argmax(self.totals))
+        if winner != self.current:
+            if self.totals[winner] >= self.enter_ratio * total:
+                self.current = winner
+            elif self.totals[self.current] < self.exit_ratio * total:
+                self.current = NO_GESTURE
+        return self.gestures[self.current]
+
+    def filter(self, hands):
+        """
+        Replace the gesture of the hand (solo mode: hands=[] or [hand]) by the voted gesture.
+        The gesture recognized in the frame is kept in hand.raw_gesture (set only once, so
+        replaying the same hand object again votes on the recognized gesture).
+        """
+        hand = hands[0] if hands else None
+        if hand is None:
+            self.update(None)
+            return hands
+        if not hasattr(hand, 'raw_gesture'):
+            hand.raw_gesture = hand.gesture
+        hand.gesture = self.update(hand.raw_gesture, getattr(hand, 'lm_score', 1.0))
+        return hands
@@ -1,4 +1,10 @@
+import json
+import threading
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 import requests
+from requests.adapters import HTTPAdapter
 from furl import furl
 from HgcException import HgcException
 
@@ -8,46 +14,334 @@ test_url_string2 = 'http://192.168.43.62:8080/rest/items'
 
 url_str = test_url_string2
 
+# Max number of concurrent requests (and kept-alive connections)
+POOL_SIZE = 8
+# s, separate timeouts to open a connection and to wait for the response
+CONNECT_TIMEOUT = 3.05
+READ_TIMEOUT = 5
+
+
+class RestClient:
+    """
+    Client of the openHAB REST API with a persistent requests.Session: the connections
+    (at most pool_size) are kept alive and reused, instead of a new TCP connection
+    per request. The item URLs are built once and cached.
+    Every request is timed, see timing_summary().
+    url: URL of the items (default: url_str, read on each request).
+    """
+    def __init__(self, url=None, pool_size=POOL_SIZE, connect_timeout=CONNECT_TIMEOUT, read_timeout=READ_TIMEOUT):
+        self.url = url
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.executor = None    # for post_states(), created on first use
+        self.lock = threading.Lock()
+        self.item_urls = {}     # (items url, item name, suffix) -> url
+
+        # Timings: (method, status code or exception name, s) of the last requests
+        self.timings = deque(maxlen=1000)
+        self.nb_requests = 0
+
+    @property
+    def items_url(self):
+        return self.url or url_str
+
+    def item_url(self, item_name, suffix=None):
+        key = (self.items_url, item_name, suffix)
+        url = self.item_urls.get(key)
+        if url is None:
+            item_url = furl(self.items_url)
+            item_url.path = item_url.path / item_name
+            if suffix:
+                item_url.path = item_url.path / suffix
+            url = self.item_urls[key] = item_url.url
+        return url
+
+    def timeouts(self, limit=None):
+        """ The (connect, read) timeouts, each at most limit s if given. """
+        if limit is None:
+            return self.timeout
+        return tuple(min(t, limit) for t in self.timeout)
+
+    def request(self, method, url, timeout=None, **kwargs):
+        """ Timed request. Exceptions of requests are passed on. """
+        t0 = perf_counter()
+        status = None
+        try:
+            r = self.session.request(method, url, timeout=timeout or self.timeout, **kwargs)
+            status = r.status_code
+            return r
+        except requests.exceptions.RequestException as e:
+            status = type(e).__name__
+            raise
+        finally:
+            self.nb_requests += 1
+            self.timings.append((method, status, perf_counter() - t0))
+
+    def timing_summary(self):
+        """ Returns {method: {'count', 'mean_ms', 'p50_ms', 'p95_ms', 'max_ms', 'errors'}} of the last requests. """
+        by_method = defaultdict(list)
+        errors = defaultdict(int)
+        for method, status, t in list(self.timings):
+            by_method[method].append(t)
+            if not isinstance(status, int) or status >= 400:
+                errors[method] += 1
+        summary = {}
+        for method, times in by_method.items():
+            times.sort()
+            n = len(times)
+            summary[method] = {
+                'count': n,
+                'mean_ms': round(sum(times) / n * 1000, 2),
+                'p50_ms': round(times[n // 2] * 1000, 2),
+                'p95_ms': round(times[min(n - 1, int(n * 0.95))] * 1000, 2),
+                'max_ms': round(times[-1] * 1000, 2),
+                'errors': errors[method],
+            }
+        return summary
+
+    def get_state(self, item_name, timeout=None):
+        """ timeout: limit (s) of the timeouts of this request (also in the functions below). """
+        try:
+            r = self.request('GET', self.item_url(item_name, 'state'), self.timeouts(timeout))
+            print(f'GET request status_code: {r.status_code}')
+            print(f'GET request text: {r.text}')
+            print(f'GET request reason: {r.reason}')
+            if r.status_code == 200:    # 200 OK
+                return r.text
+            else:
+                return f'Error {r.status_code}: {r.reason}'
+        except requests.ConnectTimeout as ct:
+            print('get_state() ConnectTimeout: raising HgcException')
+            raise HgcException("Connection time out.")
+        except requests.exceptions.RequestException as re:
+            print("get_state() Error: ", re)
+            raise HgcException("No connection.")
+
+    def post_state(self, item_name, state, timeout=None):
+        headers = {'Content-type': 'text/plain'}
+        try:
+            r = self.request('POST', self.item_url(item_name), self.timeouts(timeout), data=state, headers=headers)
+            # TODO: add 404 Not Found, etc.
+            print(f'POST request status_code: {r.status_code}')
+            print(f'POST request text: {r.text}')
+            print(f'POST request reason: {r.reason}')
+            if r.status_code == 200:    # 200 OK 
+                return 'OK'
+        except requests.ConnectTimeout as ct:
+            print('raising HgcException')
+            raise HgcException("Connection time out.")
+        except requests.ConnectionError as e:
+            print('raising HgcException')
+            raise HgcException("Connection error.") 
+        except requests.exceptions.RequestException as re:
+            print("Error: ", re)
+            raise HgcException("No connection.")
+
+    def probe(self, timeout=None):
+        """ Health check: GET /rest/ of the server. Returns True if it answers without a server error. """
+        url = furl(self.items_url)
+        url.path = url.path.segments[:-1] + ['']
+        try:
+            r = self.request('GET', url.url, self.timeouts(timeout))
+            return r.status_code < 500
+        except requests.ConnectTimeout:
+            raise HgcException("Connection time out.")
+        except requests.exceptions.RequestException:
+            raise HgcException("No connection.")
+
+    def run_concurrently(self, fn, item_names):
+        """ Returns a dict item name -> fn(item name), or the HgcException it raised. """
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.pool_size, thread_name_prefix='RestClient')
+        def call(item_name):
+            try:
+                return fn(item_name)
+            except HgcException as he:
+                return he
+        return dict(zip(item_names, self.executor.map(call, item_names)))
+
+    def post_states(self, item_names, state, timeout=None):
+        """
+        POST the same state to several items concurrently.
+        Returns a dict item name -> 'OK', None (HTTP error, like post_state())
+        or the HgcException of a connection error.
+        """
+        return self.run_concurrently(lambda item_name: self.post_state(item_name, state, timeout), item_names)
+
+    def get_states(self, item_names=None, tag=None, group=None, timeout=None):
+        """
+        States of several items with one request: /rest/items?fields=name,state (only the
+        items with tag if given), or /rest/items/<group>?recursive=true for the members of a group.
+        item_names: the items wanted, None for all the items returned.
+        Items missing in the response (or all of them, if the server can not answer the
+        request) are fetched with parallel get_state() requests.
+        Returns a dict item name -> state, 'Error ...' or the HgcException of a connection error.
+        Raises HgcException if item_names is None and the request fails.
+        """
+        def get_state(item_name):
+            return self.get_state(item_name, timeout)
+        if item_names is not None and len(item_names) == 1:
+            return self.run_concurrently(get_state, item_names)
+        states = {}
+        try:
+            if group:
+                r = self.request('GET', self.item_url(group), self.timeouts(timeout),
+                                 params={'recursive': 'true', 'fields': 'name,state,members'})
+            else:
+                r = self.request('GET', self.items_url, self.timeouts(timeout),
+                                 params={'fields': 'name,state', **({'tags': tag} if tag else {})})
+            print(f'GET states request status_code: {r.status_code}')
+            if r.status_code == 200:    # 200 OK
+                items = r.json()
+                stack = items if isinstance(items, list) else [items]
+                while stack:
+                    it = stack.pop()
+                    if 'name' in it and 'state' in it:
+                        states[it['name']] = it['state']
+                    stack.extend(it.get('members', []))
+        except requests.exceptions.ConnectionError as ce:
+            # No use trying the items one by one
+            print("get_states() Error: ", ce)
+            he = HgcException("Connection time out." if isinstance(ce, requests.ConnectTimeout) else "No connection.")
+            if item_names is None:
+                raise he
+            return {name: he for name in item_names}
+        except (requests.exceptions.RequestException, ValueError, AttributeError, TypeError) as e:
+            print("get_states() Error: ", e)
+        if item_names is None:
+            if not states:
+                raise HgcException("No states received.")
+            return states
+        missing = [name for name in item_names if name not in states]
+        if missing:
+            print(f'get_states(): {len(missing)} of {len(item_names)} items fetched one by one')
+            states.update(self.run_concurrently(get_state, missing))
+        return {name: states[name] for name in item_names}
+
+    def get_items(self, params=None, etag=None):
+        """
+        GET the list of all items (JSON). With etag (ETag of a previous response), the
+        server can answer 304 Not Modified.
+        Returns (body, etag): body is None if the items were not modified.
+        """
+        headers = {'Accept': 'application/json'}
+        if etag:
+            headers['If-None-Match'] = etag
+        try:
+            r = self.request('GET', self.items_url, timeout=(self.timeout[0], 30), params=params, headers=headers)
+            print(f'GET items request status_code: {r.status_code}')
+            if r.status_code == 304:    # 304 Not Modified
+                return None, etag
+            if r.status_code == 200:    # 200 OK
+                return r.content, r.headers.get('ETag')
+        except requests.ConnectTimeout as ct:
+            print('get_items() ConnectTimeout: raising HgcException')
+            raise HgcException("Connection time out.")
+        except requests.exceptions.RequestException as re:
+            print("get_items() Error: ", re)
+            raise HgcException("No connection.")
+        raise HgcException(f'Error {r.status_code}: {r.reason}')
+
+    def events_url(self):
+        """ URL of the server-sent events stream, e.g. http://host:8080/rest/events """
+        url = furl(self.items_url)
+        url.path = str(url.path).rstrip('/').rsplit('/', 1)[0] + '/events'
+        return url.url
+
+    def open_events(self, topics=None, read_timeout=None):
+        """
+        Open the server-sent events stream. topics: e.g. 'openhab/items/*/statechanged'.
+        Returns the response, to be read with read_events(). Raises HgcException on errors.
+        The stream has its own connection (not from the pool).
+        """
+        params = {'topics': topics} if topics else None
+        try:
+            r = requests.get(self.events_url(), params=params, headers={'Accept': 'text/event-stream'},
+                             stream=True, timeout=(self.timeout[0], read_timeout))
+            print(f'GET events request status_code: {r.status_code}')
+        except requests.ConnectTimeout as ct:
+            print('open_events() ConnectTimeout: raising HgcException')
+            raise HgcException("Connection time out.")
+        except requests.exceptions.RequestException as re:
+            print("open_events() Error: ", re)
+            raise HgcException("No connection.")
+        if r.status_code != 200:    # 200 OK
+            r.close()
+            raise HgcException(f'Error {r.status_code}: {r.reason}')
+        r.encoding = 'utf-8'    # SSE is always UTF-8
+        return r
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False)
+        self.session.close()
+
+
+_client = None
+_client_lock = threading.Lock()
+
+def client():
+    """ The default RestClient used by the functions below, created on first use. """
+    global _client
+    with _client_lock:
+        if _client is None:
+            _client = RestClient()
+    return _client
+
+def configure(**kwargs):
+    """ Replace the default RestClient, kwargs: see RestClient (pool_size, connect_timeout, read_timeout). """
+    global _client
+    with _client_lock:
+        old, _client = _client, RestClient(**kwargs)
+    if old is not None:
+        old.close()
+
 def get_state(item_name):
-    item_url = furl(url_str)
-    item_url.path = item_url.path / item_name / 'state'
-    try:
-        r = requests.get(item_url.url, timeout=5)
-        print(f'GET request status_code: {r.status_code}')
-        print(f'GET request text: {r.text}')
-        print(f'GET request reason: {r.reason}')
-        if r.status_code == 200:    # 200 OK
-            return r.text
-        else:
-            return f'Error {r.status_code}: {r.reason}'
-    except requests.ConnectTimeout as ct:
-        print('get_state() ConnectTimeout: raising HgcException')
-        raise HgcException("Connection time out.")
-    except requests.exceptions.RequestException as re:
-        print("get_state() Error: ", re)
-        raise HgcException("No connection.")
+    return client().get_state(item_name)
 
 def post_state(item_name, state):
-    item_url = furl(url_str)
-    # Add item name to url:
-    item_url.path = item_url.path / item_name 
-    
-    headers = {'Content-type': 'text/plain'}
+    return client().post_state(item_name, state)
+
+def post_states(item_names, state):
+    return client().post_states(item_names, state)
+
+def get_states(item_names=None, tag=None, group=None):
+    return client().get_states(item_names, tag, group)
+
+def get_items(params=None, etag=None):
+    return client().get_items(params, etag)
+
+def events_url():
+    return client().events_url()
+
+def open_events(topics=None, read_timeout=None):
+    return client().open_events(topics, read_timeout)
+
+def read_events(r):
+    """
+    Generator of the events (dicts with 'topic', 'payload', 'type') of an events stream
+    opened with open_events(). Runs until the connection is closed.
+    Raises HgcException if the stream breaks.
+    """
     try:
-        r = requests.post(item_url.url, state, headers=headers, timeout=5)
-        # TODO: add 404 Not Found, etc.
-        print(f'POST request status_code: {r.status_code}')
-        print(f'POST request text: {r.text}')
-        print(f'POST request reason: {r.reason}')
-        if r.status_code == 200:    # 200 OK 
-            return 'OK'
-    except requests.ConnectTimeout as ct:
-        print('raising HgcException')
-        raise HgcException("Connection time out.")
-    except requests.ConnectionError as e:
-        print('raising HgcException')
-        raise HgcException("Connection error.") 
+        with r:
+            data = []
+            # chunk_size=None: lines are returned as soon as they arrive
+            for line in r.iter_lines(chunk_size=None, decode_unicode=True):
+                if line.startswith('data:'):
+                    data.append(line[5:].strip())
+                elif not line and data:
+                    # Blank line: end of the event
+                    try:
+                        yield json.loads('\n'.join(data))
+                    except ValueError:
+                        print(f'read_events(): invalid event {data}')
+                    data = []
     except requests.exceptions.RequestException as re:
-        print("Error: ", re)
-        raise HgcException("No connection.")
-
+        print("read_events() Error: ", re)
+        raise HgcException("Connection lost.")
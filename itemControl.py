@@ -1,15 +1,29 @@
 #!/usr/bin/env python3
 
 from HandController import HandController
-from SpeechController import SpeechController
+from SpeechController import SpeechController, RATE, VOICE, LOW, NORMAL, HIGH
 import time
-import iface
+import backends
 import mediapipe_utils as mpu
 import numpy as np
 import itemTree
 import sys
 import subprocess
+from collections.abc import Mapping
 from HgcException import HgcException
+import configLoader
+from itemIndex import ItemIndex, ROOT
+from itemDiscovery import ItemDiscovery
+from itemStateCache import ItemStateCache
+from statePrefetch import StatePrefetcher
+from commandQueue import CommandQueue, Command, SUPERSEDED
+from liveTrackbar import LiveWriter
+from circuitBreaker import BreakerBackend
+from audioCache import AudioCache
+from promptPredictor import PromptPredictor
+
+# Names of the menu levels in the selections, deeper levels are called 'level 3', ...
+LEVEL_NAMES = ['area', 'function']
 
 class ItemController():
     """
@@ -29,23 +43,32 @@ class ItemController():
     The 'first_trigger_delay' in seconds specifies how long the pose has to stand before triggering
     an initial event.
 
-    """
-    def __init__(self):
-        # Load Item Tree (= Smart Home configuration):
-        try:
-            self.item_tree = itemTree.itemTree
-        except AttributeError:
-            sys.exit("Item tree configuration not found")
+    The pose actions (and optionally the item tree, key 'item_tree') can also be loaded from
+    a JSON or TOML config file, see configLoader.py and config/example.json.
 
-        # For audio feedback:
-        self.speech_controller = SpeechController()
+    """
+    def __init__(self, config_file=None):
+        # Load compiled config file (if any):
+        compiled_config = None
+        if config_file:
+            try:
+                compiled_config = configLoader.load_config(config_file)
+            except HgcException as he:
+                sys.exit(he.args[0])
 
         # Stores the sequence of user selections:
         self.selections = {}
 
+        # Current menu level (node of self.index) and page:
+        self.node = ROOT
+        self.page = 0
+
         # Trackbar state:
         self.trackbar_state = 0
 
+        # Type of the selected item ('bool', 'percentage'):
+        self.item_type = None
+
         # Awake (when True: ready to recognize gestures other than the wakeup gesture)
         self.awake = False
 
@@ -56,6 +79,50 @@ class ItemController():
         self.config = {
             'renderer' : {'enable': True},
 
+            'reload' : {'enable': True},
+
+            'voting' : {'enable': True, 'window': 5},
+
+            # Smart home backend: {'type': 'openhab', 'url': ...}, {'type': 'openhab_async', 'max_connections': 4}
+            # or {'type': 'fake', 'latency': ...}
+            'backend' : {'type': 'openhab'},
+
+            # Requests fail at once while the server is down
+            'circuit_breaker' : {'enable': True},
+
+            # Item states kept up to date by the openHAB events stream
+            'state_cache' : {'enable': True},
+
+            # live: the trackbar values are sent at once (at most max_rate per second), not only on OK
+            'trackbar' : {'live': False, 'max_rate': 4},
+
+            # Post the states in the background, with retries
+            'command_queue' : {'enable': True},
+
+            # Fetch the states of the items below a selected area / function in the background
+            'prefetch' : {'enable': True},
+
+            # Build the item tree from the openHAB items instead of itemTree.py
+            'discovery' : {'enable': False},
+
+            # Synthesize the known phrases at start, kept in .audio_cache/
+            'audio_cache' : {'enable': True, 'storage': 'disk'},
+            # Synthesize the prompts that can follow while the user is posing
+            'prompt_prediction' : {'enable': True},
+
+            # Dynamic gestures (see dynamicGestures.py for the motions)
+            'motion_actions' : [
+                {'name': 'swipe_up', 'motion': 'SWIPE_UP', 'callback': 'nudge_up'},
+                {'name': 'swipe_down', 'motion': 'SWIPE_DOWN', 'callback': 'nudge_down'},
+                {'name': 'swipe_left', 'motion': 'SWIPE_LEFT', 'callback': 'next_page'},
+                {'name': 'swipe_right', 'motion': 'SWIPE_RIGHT', 'callback': 'previous_page'},
+            ],
+
+            # Pose sequences selecting an item directly, e.g.:
+            # {'name': 'livingroom_dimmer', 'sequence': ['WAKEUP', 'TWO', 'ONE', 'TWO'], 'item': 'WZ_LichtDimmer'},
+            # {'name': 'kitchen_blinds_up', 'sequence': ['WAKEUP', 'ONE', 'TWO', 'FIVE'], 'item': 'Kuche_Jalousie1', 'state': 0},
+            'combos' : [],
+
             'pose_actions' : [
                 {'name': '1_any_enter', 'pose':'ONE', 'hand':'any', 'callback': 'one',"trigger":"enter", "first_trigger_delay":0.3},
                 {'name': '2_any_enter', 'pose':'TWO', 'hand':'any', 'callback': 'two',"trigger":"enter", "first_trigger_delay":0.3},
@@ -71,18 +138,215 @@ class ItemController():
                 {'name': '12_any_enter', 'pose':'OK', 'hand':'any', 'callback': 'ok',"trigger":"enter", "first_trigger_delay":0.3},
                 {'name': '13_any_enter', 'pose':'HORNS', 'hand':'any', 'callback': 'shut_down',"trigger":"enter", "first_trigger_delay":1},
                 {'name': '14_any_enter', 'pose':'WAKEUP', 'hand':'any', 'callback': 'wake_up',"trigger":"enter", "first_trigger_delay":1},
+                {'name': '15_any_enter', 'pose':'FIST', 'hand':'any', 'callback': 'select_all',"trigger":"enter", "first_trigger_delay":0.5},
                 {'name': 'trackbar_periodic', 'pose':'TRACK', 'hand':'any', 'callback': 'trackbar',"trigger":"periodic", "first_trigger_delay":0.5, "next_trigger_delay": 0.3},
             ]
         }
+        if compiled_config:
+            self.config = compiled_config
+
+        # For audio feedback:
+        speech_config = dict(self.config.get('speech', {}))
+        audio_cache = None
+        audio_cache_config = dict(self.config.get('audio_cache', {}))
+        if audio_cache_config.pop('enable', False):
+            try:
+                audio_cache = AudioCache(speech_config.get('rate', RATE), speech_config.get('voice', VOICE), **audio_cache_config)
+            except OSError as e:
+                print(f'Audio cache disabled: {e}')
+        self.speech_controller = SpeechController(**speech_config, audio_cache=audio_cache)
+        self.predictor = None
+        if audio_cache and self.config.get('prompt_prediction', {}).get('enable', False):
+            self.predictor = PromptPredictor(self, audio_cache)
+
+        # Smart home backend (see backends.py), the fake backend gets the items of itemTree.py:
+        try:
+            self.backend = backends.create(self.config.get('backend'), self.config.get('rest'),
+                                           self.config.get('item_tree', getattr(itemTree, 'itemTree', None)))
+        except HgcException as he:
+            sys.exit(he.args[0])
+        self.breaker_backend = None
+        breaker_config = dict(self.config.get('circuit_breaker', {}))
+        if breaker_config.pop('enable', False):
+            self.backend = self.breaker_backend = BreakerBackend(self.backend, **breaker_config)
+
+        # Load Item Tree (= Smart Home configuration):
+        self.discovery = None
+        discovery_config = dict(self.config.get('discovery', {}))
+        if 'item_tree' in self.config:
+            self.item_tree = self.config['item_tree']
+        elif discovery_config.pop('enable', False):
+            # Discovered from openHAB (see itemDiscovery.py)
+            self.discovery = ItemDiscovery(**discovery_config, backend=self.backend)
+            try:
+                self.item_tree = self.discovery.load()
+            except HgcException as he:
+                sys.exit(f"Item discovery failed: {he.args[0]}")
+        else:
+            try:
+                self.item_tree = itemTree.itemTree
+            except AttributeError:
+                sys.exit("Item tree configuration not found")
+        # Compiled item tree, for the navigation:
+        try:
+            self.index = ItemIndex(self.item_tree)
+        except HgcException as he:
+            sys.exit(f"Item tree configuration not valid: {he.args[0]}")
+
+        # Item states (see itemStateCache.py):
+        self.state_cache = None
+        self.state_cache_events = False     # the cache is kept current by the events stream
+        state_cache_config = dict(self.config.get('state_cache', {}))
+        if state_cache_config.pop('enable', False):
+            self.state_cache = ItemStateCache(**state_cache_config, backend=self.backend)
+            self.state_cache_events = True
+        self.prefetcher = None
+        prefetch_config = dict(self.config.get('prefetch', {}))
+        if prefetch_config.pop('enable', False):
+            if self.state_cache is None:
+                # Short-lived cache, without events stream
+                self.state_cache = ItemStateCache(ttl=prefetch_config.get('ttl', 10), backend=self.backend)
+            prefetch_config.pop('ttl', None)
+            self.prefetcher = StatePrefetcher(self.state_cache, **prefetch_config, backend=self.backend)
+
+        # Outbound commands (see commandQueue.py):
+        self.command_queue = None
+        command_queue_config = dict(self.config.get('command_queue', {}))
+        if command_queue_config.pop('enable', False):
+            self.command_queue = CommandQueue(**command_queue_config, backend=self.backend)
+
+        # Live trackbar (see liveTrackbar.py):
+        self.live_writer = None
+        trackbar_config = self.config.get('trackbar', {})
+        if trackbar_config.get('live'):
+            self.live_writer = LiveWriter(trackbar_config.get('max_rate', 4), self.backend)
+
+    def set_item_tree(self, item_tree):
+        """ Replace the item tree (e.g. on hot reload). Keeps the user selections if they still exist. """
+        index = ItemIndex(item_tree)
+        path = self.index.paths[self.node]
+        self.item_tree, self.index = item_tree, index
+        self.presynthesize()
+        node = index.find_path(path)
+        item_name = self.selections.get('item')
+        if node is not None and (item_name is None or 'items' in self.selections or index.find(item_name) is not None):
+            self.node = node
+            self.page = min(self.page, index.nb_pages(node) - 1)
+            return
+        self.clear_selections()
+        if self.awake:
+            self.feedback('Configuration changed, please select area ...')
+
+    def get_state(self, item_name):
+        """ Current state of an item, from the state cache if enabled. """
+        if self.prefetcher:
+            self.prefetcher.wait(item_name)
+        if self.state_cache:
+            return self.state_cache.get(item_name)
+        return self.backend.get_state(item_name)
+
+    def prefetch(self, node):
+        """ Start fetching the states of the items below node. """
+        if self.prefetcher:
+            self.prefetcher.prefetch([self.index.items[n]['name'] for n in self.index.leaves(node)])
+
+    def predict(self, node):
+        """ Start synthesizing the prompts that can follow node. """
+        if self.predictor:
+            self.predictor.predict(node)
+
+    def poll(self):
+        """ Called by the HandController between two frames. """
+        if self.command_queue:
+            self.command_queue.poll()
+        if self.discovery:
+            item_tree = self.discovery.take()
+            if item_tree is not None:
+                print('Item tree changed on the server, updating ...')
+                self.set_item_tree(item_tree)
+
+    def clear_selections(self):
+        if self.prefetcher:
+            self.prefetcher.cancel()
+        self.selections = {}
+        self.node = ROOT
+        self.page = 0
+        self.item_type = None
+        self.predict(ROOT)
+
+    def level_name(self, depth):
+        """ Name of a menu level: area, function, level 3, ... """
+        if depth <= len(LEVEL_NAMES):
+            return LEVEL_NAMES[depth - 1]
+        return f'level {depth}'
+
+    def next_selection_name(self, node):
+        """ What the user selects next below node: area, function, ... or item. """
+        first_child = self.index.child(node, 0)
+        if first_child is not None and self.index.is_item(first_child):
+            return 'item'
+        return self.level_name(self.index.depth[node] + 1)
+
+    def page_hint(self, node):
+        nb_pages = self.index.nb_pages(node)
+        if nb_pages > 1:
+            return f' There are {nb_pages} pages, swipe to change the page.'
+        return ''
+
+    def wake_up_prompt(self):
+        return "Hi, please select area..." + self.page_hint(ROOT)
+
+    def area_prompt(self, node):
+        return f'You selected {self.index.key(node)}, please select {self.next_selection_name(node)}.' + self.page_hint(node)
+
+    def function_prompt(self, node):
+        return f'OK, which {self.index.key(node)}?' + self.page_hint(node)
+
+    def item_prompt(self, node):
+        item = self.index.items[node]
+        return f"You selected {item.get('label') or item['name']}."
+
+    def all_prompt(self, node, nb_items):
+        return f'You selected all {nb_items} items of {self.index.key(node)}.'
+
+    @staticmethod
+    def toggled(state):
+        """ Toggle state ON/OFF """
+        return 'ON' if state == 'OFF' else 'OFF'
+
+    def bool_question(self, node, current_state):
+        return f'The {self.index.key(node)} is {current_state.lower()}. Do you like to switch it {self.toggled(current_state).lower()}?'
+
+    def percentage_question(self, node, current_state):
+        return f'The {self.index.key(node)} is {current_state} percent. How much do you like?'
+
+    def cached_phrases(self):
+        """ The phrases known in advance: fixed phrases, trackbar values and the prompts of the item tree. """
+        phrases = ["OK!", "Going back.", "Please select area ...", "I am sleeping, please wake me up ...",
+                   'Please finish with OK.', 'zero', self.wake_up_prompt()]
+        phrases += [str(value) for value in range(10, 101, 10)]
+        for node in range(1, len(self.index)):
+            if self.index.is_item(node):
+                phrases.append(self.item_prompt(node))
+                continue
+            phrases.append(self.area_prompt(node) if self.index.depth[node] == 1 else self.function_prompt(node))
+            phrases.append(f"Please select {self.next_selection_name(node)} ...")
+        return phrases
+
+    def presynthesize(self):
+        """ Synthesize the known phrases in the background, if the audio cache is enabled. """
+        if self.speech_controller.audio_cache:
+            nb = self.speech_controller.audio_cache.presynthesize(self.cached_phrases())
+            print(f'Audio cache: synthesizing {nb} phrases in the background')
 
     def wake_up(self, event):
         if self.awake:
             self.awake = False
             fb = "I am sleeping, please wake me up ..."
             self.feedback(fb)
-            self.selections = {}
+            self.clear_selections()
         else:
-            fb = "Hi, please select area..."
+            fb = self.wake_up_prompt()
             self.feedback(fb)
             self.awake = True
 
@@ -93,135 +357,230 @@ class ItemController():
         self.feedback(fb)
 
     def select(self, index):
-        """ Handles the sequence of user selections. """
-        if 'area' not in self.selections:
-            area_list = list(self.item_tree)
-            if len(area_list) > index:
-                area = area_list[index]
-                self.select_area(area)
-            else:
-                fb = f'Sorry, there is no area {index + 1}, please select another area.'
-                self.feedback(fb)
-        elif 'function' not in self.selections:
-            function_list = list(self.item_tree[self.selections['area']])
-            if len(function_list) > index:
-                function = function_list[index]
-                self.select_function(function)
-            else:
-                fb = f'Sorry, there is no function {index + 1}, please select another function.'
-                self.feedback(fb)
-        elif 'item' not in self.selections:
-            item_list = list(self.item_tree[self.selections['area']][self.selections['function']])
-            if len(item_list) > index:
-                item_key = item_list[index]
-                self.select_item(item_key)
-            else:
-                fb = f'Sorry, there is no item {index + 1}, please select another item.'
-                self.feedback(fb)
-        else:
+        """ Handles the sequence of user selections. index: 0 ... 9 on the current page. """
+        if 'item' in self.selections:
             fb = 'Please finish with OK.'
             self.feedback(fb)
+        else:
+            node = self.index.page_child(self.node, self.page, index)
+            if node is None:
+                what = self.next_selection_name(self.node)
+                fb = f'Sorry, there is no {what} {index + 1}, please select another {what}.'
+                self.feedback(fb, HIGH)
+            elif self.index.is_item(node):
+                self.select_item(node)
+            elif self.index.depth[node] == 1:
+                self.select_area(node)
+            else:
+                self.select_function(node)
         print('selections: ') 
         for k, v in self.selections.items():
             print(f'    {k}: {v}')
         print('------------') 
 
-    def select_area(self, area):
+    def select_area(self, node):
         """ This is the function to select the area (e.g. kitchen, whole appartment, ...) 
         according to item_tree configuration. """
+        area = self.index.key(node)
         self.selections['area'] = area
-        fb = f'You selected {area}, please select function.'
+        self.node = node
+        self.page = 0
+        self.prefetch(node)
+        self.predict(node)
+        fb = self.area_prompt(node)
         self.feedback(fb)
         print(f'area selected: {area}.')
 
-    def select_function(self, function):
+    def select_function(self, node):
         """ This is the function to select the function (e.g. light, blind, temperature, ...) 
-        according to item_tree configuration. """
-        self.selections['function'] = function
-        fb = f'OK, which {function}?'
+        according to item_tree configuration. Also used for the deeper menu levels. """
+        function = self.index.key(node)
+        self.selections[self.level_name(self.index.depth[node])] = function
+        self.node = node
+        self.page = 0
+        self.prefetch(node)
+        self.predict(node)
+        fb = self.function_prompt(node)
         self.feedback(fb)
         print(f'function selected: {function}.')
 
-    def select_item(self, item_key):
+    def select_item(self, node):
         """ This is the function to select the item (e.g. dinner table light, ...) 
         according to item_tree configuration. """
-        print(f'item selected: {item_key}.')
-        item = self.item_tree[self.selections['area']][self.selections['function']][item_key] # dict
-        if isinstance(item, dict):
-            item_name = item.get('name')    # if 'name' is not in the dicts keys, item_name is None
-            item_type = item.get('type')
-            item_label = item.get('label')
-            if item_name:
-                self.selections['item'] = item_name
-                if item_label:
-                    self.selections['label'] = item_label
-                    fb = f'You selected {item_label}.'
-                    self.feedback(fb)
-                else:
-                    fb = f'You selected {item_name}.'
-                    self.feedback(fb)
-                if item_type:
-                    if item_type == 'bool':
-                        self.handle_booltype()
-                    elif item_type == 'percentage':
-                        self.handle_percentagetype()
-                else:
-                    fb = 'Sorry, item type not found. Please check configuration file or make another selection.'
-                    self.feedback(fb)
-                    del self.selections['item']
-            else:
-                fb = 'Sorry, item name not found. Please check configuration file or make another selection.'
-                self.feedback(fb)
-        else:
-            fb = 'Sorry, wrong item format. Please check configuration file or make another selection.'
+        item = self.index.items[node] # dict, validated by ItemIndex
+        item_name = item['name']
+        item_type = item['type']
+        item_label = item.get('label')
+        print(f'item selected: {self.index.key(node)}.')
+        self.selections['item'] = item_name
+        self.item_type = item_type
+        if 'items' in item:
+            # Group
+            self.selections['items'] = list(item['items'])
+        if item_label:
+            self.selections['label'] = item_label
+        fb = self.item_prompt(node)
+        self.feedback(fb)
+        self.handle_item_type()
+
+    def select_all(self):
+        """ Selects all items below the current menu level, as a group. """
+        if 'item' in self.selections:
+            fb = 'Please finish with OK.'
+            self.feedback(fb)
+            return
+        if self.node == ROOT:
+            fb = 'Please select area first.'
             self.feedback(fb)
+            return
+        items = [self.index.items[n] for n in self.index.leaves(self.node)]
+        item_names = list(dict.fromkeys(name for item in items for name in item.get('items', [item['name']])))
+        item_types = {item['type'] for item in items}
+        key = self.index.key(self.node)
+        if len(item_types) != 1:
+            fb = f'Sorry, the items of {key} can not be set together.'
+            self.feedback(fb, HIGH)
+            return
+        # Unique name of the group (the command queue and the live trackbar coalesce by name),
+        # e.g. 'all kitchen/blind', the label is spoken and shown
+        self.selections['item'] = 'all ' + '/'.join(self.index.paths[self.node])
+        self.selections['items'] = item_names
+        self.selections['label'] = f'all {key}'
+        self.item_type = item_types.pop()
+        fb = self.all_prompt(self.node, len(item_names))
+        self.feedback(fb)
+        print(f'items selected: {item_names}.')
+        self.handle_item_type()
+
+    def handle_item_type(self):
+        """ Asks for the state of the selected item (or group). """
+        group = 'items' in self.selections
+        if self.item_type == 'bool':
+            self.handle_bool_group() if group else self.handle_booltype()
+        elif self.item_type == 'percentage':
+            self.handle_percentage_group() if group else self.handle_percentagetype()
+
+    def change_page(self, step):
+        """ Shows the next (step=1) or previous (step=-1) page of the current menu level. """
+        if 'item' in self.selections:
+            return
+        nb_pages = self.index.nb_pages(self.node)
+        if nb_pages == 1:
+            self.feedback('There is only one page.')
+            return
+        self.page = (self.page + step) % nb_pages
+        self.feedback(f'Page {self.page + 1} of {nb_pages}.')
 
     def handle_booltype(self):
         # GET current state:
         try:
-            current_state = iface.get_state(self.selections['item'])
+            current_state = self.get_state(self.selections['item'])
             # TODO: make this better
             if current_state.startswith('Error'):
                 fb = f'Sorry, could not get current state. {current_state} Please check configuration.'
-                self.feedback(fb)
+                self.feedback(fb, HIGH)
                 # Clear selections:
-                self.selections = {}
+                self.clear_selections()
                 self.awake = False
             else:
                 self.selections['current state'] = current_state
                 print(f'current state: {current_state}.')
 
-                new_state = 'OFF'
-                if current_state == 'OFF':    	# toggle state ON/OFF
-                    new_state = 'ON'
-                fb = str(f'The {self.selections["function"]} is {current_state.lower()}. Do you like to switch it {new_state.lower()}?')
-                self.feedback(fb)
+                new_state = self.toggled(current_state)
+                fb = self.bool_question(self.node, current_state)
+                self.feedback(fb, interrupt=False)
                 self.selections['state'] = new_state
                 print(f'state selected: {self.selections["state"]}.')
         except HgcException as he:
             fb = f'Sorry, could not get current state. {he.args[0]} Please check connection to rest API.'
-            self.feedback(fb)
+            self.feedback(fb, HIGH)
             # Clear selections:
-            self.selections = {}
+            self.clear_selections()
             self.awake = False
             # TODO: maybe sys.exit(he.args[0]) after this?
 
     def handle_percentagetype(self):
         # GET current state:
         try:
-            current_state = iface.get_state(self.selections['item'])
+            current_state = self.get_state(self.selections['item'])
             # TODO: make this better
             self.selections['current state'] = current_state
             print(f'current state: {current_state}.')
-            fb = str(f'The {self.selections["function"]} is {current_state} percent. How much do you like?')
-            self.feedback(fb)
+            fb = self.percentage_question(self.node, current_state)
+            self.feedback(fb, interrupt=False)
         except HgcException as he:
             fb = f'Sorry, could not get current state. {he.args[0]} Please check connection to rest API.'
-            self.feedback(fb)
+            self.feedback(fb, HIGH)
             # Clear selections:
-            self.selections = {}
+            self.clear_selections()
             # TODO: maybe sys.exit(he.args[0]) after this?
 
+    def get_group_states(self):
+        """ States of the items of the selected group, without the items with an error. """
+        item_names = self.selections['items']
+        states = {}
+        if self.state_cache:
+            for name in item_names:
+                if self.prefetcher:
+                    self.prefetcher.wait(name)
+                if self.state_cache.is_current(name):
+                    states[name] = self.state_cache.get(name)
+        missing = [name for name in item_names if name not in states]
+        if missing:
+            # One request for all the missing states
+            for name, state in self.backend.get_states(missing).items():
+                if isinstance(state, HgcException):
+                    raise state
+                if self.state_cache and not state.startswith('Error'):
+                    self.state_cache.set(name, state)
+                states[name] = state
+        return [states[name] for name in item_names if not states[name].startswith('Error')]
+
+    def handle_bool_group(self):
+        try:
+            states = self.get_group_states()
+            if not states:
+                raise HgcException('No state received.')
+            nb_on = sum(state == 'ON' for state in states)
+            self.selections['current state'] = f'{nb_on} of {len(states)} ON'
+            print(f'current state: {self.selections["current state"]}.')
+            new_state = 'OFF' if nb_on else 'ON'
+            key = self.index.key(self.node)
+            if nb_on == 0 or nb_on == len(states):
+                fb = f'The {key} are {states[0].lower()}. Do you like to switch them {new_state.lower()}?'
+            else:
+                fb = f'{nb_on} of {len(states)} {key} are on. Do you like to switch them {new_state.lower()}?'
+            self.feedback(fb, interrupt=False)
+            self.selections['state'] = new_state
+            print(f'state selected: {self.selections["state"]}.')
+        except HgcException as he:
+            fb = f'Sorry, could not get current state. {he.args[0]} Please check connection to rest API.'
+            self.feedback(fb, HIGH)
+            # Clear selections:
+            self.clear_selections()
+            self.awake = False
+
+    def handle_percentage_group(self):
+        try:
+            values = []
+            for state in self.get_group_states():
+                try:
+                    values.append(float(state))
+                except ValueError:
+                    pass
+            if not values:
+                raise HgcException('No state received.')
+            current_state = str(round(sum(values) / len(values)))
+            self.selections['current state'] = current_state
+            print(f'current state: {current_state}.')
+            fb = f'The {self.index.key(self.node)} are at {current_state} percent on average. How much do you like?'
+            self.feedback(fb, interrupt=False)
+        except HgcException as he:
+            fb = f'Sorry, could not get current state. {he.args[0]} Please check connection to rest API.'
+            self.feedback(fb, HIGH)
+            # Clear selections:
+            self.clear_selections()
+
     def trackbar(self, event):
         """ Sets numbers dynamically between 0 and 100, e.g. state for dimmer, blinds, temperature """
         if 'item' in self.selections:
@@ -233,13 +592,40 @@ class ItemController():
             if value > self.trackbar_state or value < self.trackbar_state:
                 print(f"trackbar: value = {value}") 
                 self.trackbar_state = value
+                self.selections['state'] = str(value)
+                self.live_update()
                 if value == 0:
                     self.to_display = '0'
-                    self.audio_fb('zero')
+                    self.audio_fb('zero', LOW, key='value')
                 else:
-                    self.feedback(str(value))
+                    self.feedback(str(value), LOW, key='value')
             self.selections['state'] = str(value)
 
+    def nudge(self, step):
+        """ Changes the state of a selected percentage item by step, e.g. with a swipe up or down. """
+        if 'item' not in self.selections or self.item_type != 'percentage':
+            return
+        state = self.selections.get('state', self.selections.get('current state'))
+        try:
+            value = float(state)
+        except (TypeError, ValueError):
+            value = 0
+        value = int(min(100, max(0, value + step)))
+        print(f"nudge: value = {value}")
+        self.trackbar_state = value
+        self.selections['state'] = str(value)
+        self.live_update()
+        if value == 0:
+            self.to_display = '0'
+            self.audio_fb('zero', LOW, key='value')
+        else:
+            self.feedback(str(value), LOW, key='value')
+
+    def live_update(self):
+        """ Live trackbar: sends the selected state of a percentage item at once. """
+        if self.live_writer and self.item_type == 'percentage':
+            self.live_writer.write(self.selections['item'], self.selections['state'], self.selections.get('items'))
+
     def back(self, event):
         """ Goes one step back. """
         event.print_line() 
@@ -247,13 +633,18 @@ class ItemController():
         try:
             rk, rv = self.selections.popitem()
             print(f'removed: {rk} {rv}')
+            if rk == 'item':
+                self.item_type = None
+            elif rk not in ('items', 'label', 'current state', 'state'):
+                # A menu level
+                self.node = int(self.index.parent[self.node])
+                self.page = 0
+                if self.prefetcher:
+                    self.prefetcher.cancel()
+                self.predict(self.node)
             self.feedback("Going back.")
-            if 'area' not in self.selections:
-                self.feedback("Please select area ...")
-            elif 'function' not in self.selections:
-                self.feedback("Please select function ...")
-            elif 'item' not in self.selections:
-                self.feedback("Please select item ...")
+            if 'item' not in self.selections:
+                self.feedback(f"Please select {self.next_selection_name(self.node)} ...", interrupt=False)
         except KeyError:
             # Dictionary is empty
             print('Selections is empty.') 
@@ -269,11 +660,10 @@ class ItemController():
     #    # Clear selections:
     #    self.selections = {}
 
-    def audio_fb(self, text):
-        """ Gives auditive feedback. """
-        self.speech_controller.kill_proc()
+    def audio_fb(self, text, priority=NORMAL, key=None, interrupt=True):
+        """ Gives auditive feedback (priority, key, interrupt: see SpeechController.say()). """
         print(f'say: {text}')
-        self.speech_controller.say(str(text))    # make sure text is a string for espeak
+        self.speech_controller.say(str(text), priority, key, interrupt)    # make sure text is a string for espeak
 
     def ok(self, event):
         """ Completes the input, posts state. """
@@ -283,36 +673,111 @@ class ItemController():
             print(f'    {k}: {v}')
         print('------------') 
         self.feedback("OK!")
+        self.post_selection()
 
+    def post_selection(self):
+        """ Posts the selected state of the selected item and clears the selections. """
         # Post state:
         if 'item' in self.selections and 'state' in self.selections:
-            try:
-                r = iface.post_state(self.selections['item'], self.selections['state'])
-            except HgcException as he:
-                r = f'Sorry, could not set state. {he.args[0]} Please check connection to rest API.'
-                # TODO: maybe sys.exit(he.args[0]) after this?
-        else:
-            print('ERROR: item or state missing.')
-            r = 'Sorry, can not set state: item or state missing.'
-        #fb = f'Request is {r}.'
-        if r == 'OK':
             item_label = self.selections.get('label')
             item_text = item_label if item_label else self.selections['item']
-            fb = f"{self.selections['area']} {item_text} is now {self.selections['state']}"
-            if self.selections['state'] is 'ON' or self.selections['state'] is 'OFF':
-                fb = fb + '.'
+            context = f"{self.selections['area']} {item_text}"
+            items = self.selections.get('items')
+            barrier = None
+            if self.live_writer:
+                # The final state is posted below, after the live value being sent (if any):
+                # an older live value must not arrive after the final one
+                self.live_writer.discard(self.selections['item'])
+                barrier = self.live_writer.flush
+                if not self.command_queue:
+                    barrier()
+            if self.command_queue:
+                # Sent in the background, feedback in post_done()
+                self.command_queue.submit(self.selections['item'], self.selections['state'], self.post_done, context, items, barrier)
+            elif items:
+                command = Command(self.selections['item'], self.selections['state'], context=context, items=items)
+                results = self.backend.post_states(items, command.state)
+                command.results = {name: r if r == 'OK' else 'Request failed.' for name, r in results.items()}
+                r = 'OK' if all(r == 'OK' for r in results.values()) else 'Sorry, request failed.'
+                self.post_done(command, r)
             else:
-                fb = fb + ' percent.'
+                command = Command(self.selections['item'], self.selections['state'], context=context)
+                try:
+                    r = self.backend.post_state(command.item_name, command.state)
+                except HgcException as he:
+                    r = f'Sorry, could not set state. {he.args[0]} Please check connection to rest API.'
+                    # TODO: maybe sys.exit(he.args[0]) after this?
+                self.post_done(command, r)
         else:
-            fb = f'{r}'
-        self.feedback(fb)
-        print(f'Request is {r}.')
+            print('ERROR: item or state missing.')
+            self.feedback('Sorry, can not set state: item or state missing.', HIGH)
 
         # Clear selections:
-        self.selections = {}
+        self.clear_selections()
         self.awake = False
         #self.sleep_after_2s()
 
+    def post_done(self, command, r):
+        """ Feedback when a posted state is done. r: 'OK', SUPERSEDED or the error. """
+        state_text = command.state + ('.' if command.state in ('ON', 'OFF') else ' percent.')
+        if r == SUPERSEDED:
+            # A newer state for the same item was selected before this one was sent
+            self.feedback(f"{command.context}: {state_text[:-1]} replaced by a newer state.")
+            print(f'Request is {r}.')
+            return
+        if command.items is not None:
+            # Group: one summary for all items
+            done = [name for name in command.items if command.results.get(name) == 'OK']
+            if self.state_cache:
+                for name in done:
+                    self.state_cache.set(name, command.state)
+            if len(done) == len(command.items):
+                fb = f"{command.context}: {len(done)} items are now {state_text}"
+            elif done:
+                fb = f"{command.context}: {len(done)} of {len(command.items)} items are now {state_text} {len(command.items) - len(done)} failed."
+            else:
+                fb = f'{r}'
+        elif r == 'OK':
+            if self.state_cache:
+                self.state_cache.set(command.item_name, command.state)
+            fb = f"{command.context} is now {state_text}"
+        else:
+            fb = f'{r}'
+        # The result of a command is not cut by the next prompt
+        self.feedback(fb, HIGH)
+        print(f'Request is {r}.')
+
+    def handle_combo(self, event):
+        """
+        Handles a recognized pose sequence (see comboRecognizer.py). The combo selects
+        its 'item' directly. If the combo has a 'state', the state is posted at once,
+        otherwise the user is asked for the state as after a normal item selection.
+        """
+        event.print_line()
+        combo = event.combo
+        node = self.index.find(combo.get('item'))
+        if node is None:
+            self.feedback(f"Sorry, item of combo {combo['name']} not found. Please check configuration file.", HIGH)
+            return
+        self.awake = True
+        self.clear_selections()
+        # Select the menu levels above the item
+        self.node = int(self.index.parent[node])
+        for depth, key in enumerate(self.index.paths[self.node], 1):
+            self.selections[self.level_name(depth)] = key
+        if 'state' in combo:
+            item = self.index.items[node]
+            self.selections['item'] = item['name']
+            self.item_type = item['type']
+            if 'items' in item:
+                self.selections['items'] = list(item['items'])
+            if item.get('label'):
+                self.selections['label'] = item['label']
+            self.selections['state'] = str(combo['state'])
+            self.post_selection()
+        else:
+            self.select_item(node)
+
     #def shut_down(self, event):
     #    """ Shuts down the raspberry pi """
     #    # subprocess.Popen(['sudo','shutdown','-h','now'])
@@ -351,8 +816,18 @@ class ItemController():
             self.select(8)
         elif cb == 'ten':
             self.select(9)
+        elif cb == 'select_all':
+            self.select_all()
         elif cb == 'trackbar':
             self.trackbar(event)
+        elif cb == 'nudge_up':
+            self.nudge(10)
+        elif cb == 'nudge_down':
+            self.nudge(-10)
+        elif cb == 'next_page':
+            self.change_page(1)
+        elif cb == 'previous_page':
+            self.change_page(-1)
         elif cb == 'back':
             self.back(event)
         elif cb == 'ok':
@@ -360,18 +835,58 @@ class ItemController():
         elif cb == 'shut_down':
             self.shut_down(event)
     
-    def feedback(self, feedback):
+    def feedback(self, feedback, priority=NORMAL, key=None, interrupt=True):
         self.to_display = str(feedback)
-        self.audio_fb(feedback)
+        self.audio_fb(feedback, priority, key, interrupt)
     
+    def status(self):
+        """ Status line for the renderer: (state, text), None if there is nothing to show. """
+        if self.breaker_backend:
+            return self.breaker_backend.status
+        return None
+
     def start(self):
         #HandController(self.config).loop()
+        if self.breaker_backend:
+            self.breaker_backend.start()
+        self.presynthesize()
+        if self.predictor:
+            self.predictor.start()
+            self.predictor.predict(ROOT)
+        if self.discovery:
+            self.discovery.start()
+        if self.state_cache_events:
+            self.state_cache.start()
+        if self.command_queue:
+            self.command_queue.start()
+        if self.live_writer:
+            self.live_writer.start()
         HandController(self).loop()
+        if self.discovery:
+            self.discovery.stop()
+        if self.state_cache_events:
+            self.state_cache.stop()
+        if self.prefetcher:
+            self.prefetcher.shutdown()
+        if self.command_queue:
+            self.command_queue.stop()
+        if self.live_writer:
+            self.live_writer.stop()
+        if self.breaker_backend:
+            self.breaker_backend.stop()
+            print(f'Circuit breaker: {self.breaker_backend.breaker.metrics()}')
+        if self.predictor:
+            self.predictor.stop()
+            print(f'Prompt prediction: {self.predictor.metrics()}')
+        self.speech_controller.stop()
+        print(f'Speech: {self.speech_controller.metrics()}')
 
 
 
 def main():
-    itemControl = ItemController()
+    # Optional: path of a JSON or TOML config file
+    config_file = sys.argv[1] if len(sys.argv) > 1 else None
+    itemControl = ItemController(config_file)
     #print(itemControl.config)
     itemControl.start()
 
@@ -0,0 +1,228 @@
+"""
+Discovery of the item tree from the openHAB REST API (see backends.py), instead of
+maintaining itemTree.py by hand.
+
+The items are fetched once with their groups, tags and semantic metadata, and the
+area / function / item hierarchy is built from them:
+    - area: the semantic location (Location_...) of the item, found through the
+      semantic links (isPointOf, hasLocation, isPartOf) and the groups of the item,
+      'other' if the item has no location,
+    - function: from the semantic property and equipment, or the tags of the item
+      (FUNCTION_TAGS), otherwise from the item type (TYPE_FUNCTIONS),
+    - item: keyed by its label. Only the item types in ITEM_TYPE_MAP are controllable.
+Areas, functions and items are sorted by name, so the numbering (ONE, TWO, ...) stays
+stable when items are added.
+
+The tree is cached in a JSON file with the ETag and the SHA-256 hash of the server
+response. A normal start reads the cache file only, without network access. A background
+thread refreshes the tree every 'refresh_interval' seconds (a conditional GET, the tree is
+only rebuilt if the response changed); the new tree is swapped in between two frames by
+ItemController.poll().
+"""
+import hashlib
+import json
+import os
+import threading
+from collections import deque
+from collections.abc import Mapping
+from time import time
+
+import backends
+from HgcException import HgcException
+from itemIndex import ItemIndex
+
+DEFAULT_CACHE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), '.discovery_cache', 'items.json')
+# Bump this when the layout of the cache file or the tree building changes
+CACHE_VERSION = 1
+
+ITEM_TYPE_MAP = {'Switch': 'bool', 'Dimmer': 'percentage', 'Rollershutter': 'percentage'}
+
+# Semantic tags (last part of e.g. 'Property_Light', 'Equipment_Blinds') and item tags -> function
+FUNCTION_TAGS = {
+    'Light': 'light', 'Lightbulb': 'light', 'LightStripe': 'light',
+    'Blinds': 'blind', 'Rollershutter': 'blind', 'Window': 'window',
+    'Temperature': 'temperature', 'HVAC': 'heating', 'Heating': 'heating',
+    'Fan': 'fan', 'Speaker': 'audio', 'Television': 'tv',
+    'PowerOutlet': 'socket', 'Power': 'power',
+}
+TYPE_FUNCTIONS = {'Switch': 'switch', 'Dimmer': 'dimmer', 'Rollershutter': 'blind'}
+NO_AREA = 'other'
+
+QUERY_PARAMS = {
+    'recursive': 'false',
+    'metadata': 'semantics',
+    'fields': 'name,label,type,groupNames,tags,metadata',
+}
+
+
+def semantics(item):
+    """ Returns (semantic tag, semantic config) of an item, e.g. ('Point_Switch', {'isPointOf': ...}). """
+    meta = (item.get('metadata') or {}).get('semantics') or {}
+    return meta.get('value', ''), meta.get('config') or {}
+
+def base_type(item_type):
+    # e.g. 'Number:Temperature' -> 'Number'
+    return (item_type or '').split(':')[0]
+
+def find_location(item, items):
+    """ Returns the name of the nearest location of item (breadth-first over the semantic links and groups), or None. """
+    seen = {item['name']}
+    queue = deque([item['name']])
+    while queue:
+        it = items.get(queue.popleft())
+        if it is None:
+            continue
+        tag, config = semantics(it)
+        if tag.startswith('Location') and it['name'] != item['name']:
+            return it['name']
+        for name in [config.get(k) for k in ('hasLocation', 'isPointOf', 'isPartOf')] + list(it.get('groupNames', [])):
+            if name and name not in seen:
+                seen.add(name)
+                queue.append(name)
+    return None
+
+def find_function(item, items):
+    tag, config = semantics(item)
+    tags = [config.get('relatesTo', '')]
+    equipment = items.get(config.get('isPointOf'))
+    if equipment is not None:
+        tags.append(semantics(equipment)[0])
+    tags.append(tag)
+    tags += item.get('tags', [])
+    for t in tags:
+        function = FUNCTION_TAGS.get(t.split('_')[-1])
+        if function:
+            return function
+    return TYPE_FUNCTIONS[base_type(item['type'])]
+
+def build_item_tree(items, tag=None):
+    """
+    Build the item tree (see itemTree.py) from the list of items returned by the REST API.
+    tag: if given, only the items with this tag are taken.
+    """
+    by_name = {it['name']: it for it in items if isinstance(it, Mapping) and 'name' in it}
+    tree = {}
+    for it in by_name.values():
+        item_type = ITEM_TYPE_MAP.get(it.get('type'))
+        if item_type is None or (tag and tag not in it.get('tags', [])):
+            continue
+        location = find_location(it, by_name)
+        area = (by_name[location].get('label') or location) if location else NO_AREA
+        function = find_function(it, by_name)
+        entries = tree.setdefault(area, {}).setdefault(function, {})
+        key = it.get('label') or it['name']
+        if key in entries:
+            key = f"{key} ({it['name']})"
+        entries[key] = {'name': it['name'], 'type': item_type}
+        if it.get('label'):
+            entries[key]['label'] = it['label']
+    return {area: {function: dict(sorted(entries.items()))
+                   for function, entries in sorted(functions.items())}
+            for area, functions in sorted(tree.items())}
+
+
+class ItemDiscovery:
+    def __init__(self, cache_file=DEFAULT_CACHE_FILE, refresh_interval=600, tag=None, backend=None):
+        self.backend = backend or backends.default()
+        self.cache_file = cache_file
+        self.refresh_interval = refresh_interval
+        self.tag = tag
+        self.etag = None
+        self.hash = None
+
+        self.lock = threading.Lock()
+        self.pending = None     # new item tree, to be applied by ItemController.poll()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    def load(self):
+        """
+        Returns the item tree: from the cache file if there is a valid one (no network
+        access), otherwise discovered from the server. Raises HgcException if there is no
+        cache and the server can not be reached.
+        """
+        item_tree = self.read_cache()
+        if item_tree is not None:
+            print(f'ItemDiscovery: item tree loaded from {self.cache_file}')
+            return item_tree
+        item_tree = self.refresh()
+        if item_tree is None:
+            raise HgcException("No item tree discovered")
+        return item_tree
+
+    def read_cache(self):
+        try:
+            with open(self.cache_file) as f:
+                cache = json.load(f)
+            if cache['version'] != CACHE_VERSION or cache['url'] != self.backend.name or cache['tag'] != self.tag:
+                return None
+            self.etag = cache['etag']
+            self.hash = cache['hash']
+            return cache['item_tree']
+        except (OSError, ValueError, KeyError, TypeError):
+            # No cache file yet, or a broken one
+            return None
+
+    def write_cache(self, item_tree):
+        cache = {'version': CACHE_VERSION, 'url': self.backend.name, 'tag': self.tag,
+                 'etag': self.etag, 'hash': self.hash, 'time': time(), 'item_tree': item_tree}
+        try:
+            os.makedirs(os.path.dirname(self.cache_file) or '.', exist_ok=True)
+            tmp = self.cache_file + '.tmp'
+            with open(tmp, 'w') as f:
+                json.dump(cache, f, ensure_ascii=False)
+            os.replace(tmp, self.cache_file)
+        except OSError as e:
+            print(f'ItemDiscovery: could not write cache file {self.cache_file}: {e}')
+
+    def refresh(self):
+        """
+        Fetch the items from the server. Returns the new item tree, or None if the items
+        did not change since the last fetch (same ETag or same hash).
+        Raises HgcException on connection errors or an invalid response.
+        """
+        body, etag = self.backend.get_items(QUERY_PARAMS, self.etag)
+        if body is None:
+            return None
+        digest = hashlib.sha256(body).hexdigest()
+        self.etag = etag
+        if digest == self.hash:
+            return None
+        try:
+            items = json.loads(body)
+        except ValueError:
+            raise HgcException("Invalid response from the server")
+        if not isinstance(items, list):
+            raise HgcException("Invalid response from the server")
+        item_tree = build_item_tree(items, self.tag)
+        index = ItemIndex(item_tree)    # validate
+        self.hash = digest
+        self.write_cache(item_tree)
+        print(f'ItemDiscovery: {len(index.leaf_order)} items discovered')
+        return item_tree
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ItemDiscovery', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.wait(self.refresh_interval):
+            try:
+                item_tree = self.refresh()
+            except HgcException as he:
+                print(f'ItemDiscovery: refresh failed, keeping current item tree: {he.args[0]}')
+                continue
+            if item_tree is not None:
+                with self.lock:
+                    self.pending = item_tree
+
+    def take(self):
+        """ Returns the item tree discovered by the background refresh (only once), or None. """
+        if self.pending is None:
+            return None
+        with self.lock:
+            item_tree, self.pending = self.pending, None
+        return item_tree
@@ -0,0 +1,155 @@
+"""
+Flat index of the item tree (see itemTree.py), compiled once when the tree is loaded.
+
+The nested dict can have any depth: a dict with a 'name' is an item, any other dict is
+a menu level (area, function, ...). An item with 'items' (list of item names) is a group:
+its state is set on all these items at once. The nodes are numbered breadth-first, so the children
+of a node are contiguous and the n-th child of a node is found in O(1):
+    paths[i]        tuple of keys from the root (node 0, path ()) to node i
+    items[i]        the item dict of an item node, None for a menu level
+    parent[i], depth[i]
+    child_start[i], child_count[i]
+                    children of node i: child_start[i] ... child_start[i] + child_count[i] - 1
+    leaf_order      ids of the item nodes in depth-first order
+    leaf_start[i], leaf_count[i]
+                    items below node i: leaf_order[leaf_start[i] : leaf_start[i] + leaf_count[i]]
+    by_name         item name -> node id
+    by_path         path -> node id
+Menu levels with more than PAGE_SIZE entries (one pose per entry, ONE ... TEN) are split
+into pages.
+"""
+from collections.abc import Mapping
+
+import numpy as np
+
+from HgcException import HgcException
+
+ITEM_TYPES = ['bool', 'percentage']
+PAGE_SIZE = 10
+ROOT = 0
+
+
+def is_item(node):
+    return isinstance(node, Mapping) and 'name' in node and not isinstance(node['name'], Mapping)
+
+
+class ItemIndex:
+    def __init__(self, item_tree, page_size=PAGE_SIZE):
+        """ Compiles item_tree. Raises HgcException if the tree is not valid. """
+        if not isinstance(item_tree, Mapping):
+            raise HgcException(f"Item tree should be a dictionary, not {type(item_tree).__name__}")
+        self.page_size = page_size
+        self.paths = [()]
+        self.items = [None]
+        parent = [-1]
+        depth = [0]
+        child_start = []
+        child_count = []
+        nodes = [item_tree]
+        self.by_name = {}
+
+        # Breadth-first: the children of node i are appended together when node i is visited
+        i = 0
+        while i < len(nodes):
+            node = nodes[i]
+            child_start.append(len(nodes))
+            if self.items[i] is not None:
+                child_count.append(0)
+                i += 1
+                continue
+            for key, child in node.items():
+                path = self.paths[i] + (key,)
+                if not isinstance(child, Mapping):
+                    raise HgcException(f"'{'/'.join(path)}' should be a dictionary")
+                if is_item(child):
+                    if depth[i] == 0:
+                        raise HgcException(f"Item '{key}' needs at least one level (area) above it")
+                    self.check_item(child, path)
+                    self.by_name.setdefault(child['name'], len(nodes))
+                    self.items.append(child)
+                else:
+                    self.items.append(None)
+                nodes.append(child)
+                self.paths.append(path)
+                parent.append(i)
+                depth.append(depth[i] + 1)
+            child_count.append(len(nodes) - child_start[i])
+            i += 1
+
+        self.parent = np.array(parent, dtype=np.int32)
+        self.depth = np.array(depth, dtype=np.int32)
+        self.child_start = np.array(child_start, dtype=np.int32)
+        self.child_count = np.array(child_count, dtype=np.int32)
+
+        # Depth-first order of the items, with the range of items below each node
+        n = len(nodes)
+        leaf_order = []
+        self.leaf_start = np.zeros(n, dtype=np.int32)
+        self.leaf_count = np.zeros(n, dtype=np.int32)
+        stack = [(ROOT, False)]
+        while stack:
+            node, done = stack.pop()
+            if done:
+                self.leaf_count[node] = len(leaf_order) - self.leaf_start[node]
+                continue
+            self.leaf_start[node] = len(leaf_order)
+            if self.items[node] is not None:
+                leaf_order.append(node)
+            stack.append((node, True))
+            start = self.child_start[node]
+            for c in range(start + self.child_count[node] - 1, start - 1, -1):
+                stack.append((c, False))
+        self.leaf_order = np.array(leaf_order, dtype=np.int32)
+        self.by_path = {path: i for i, path in enumerate(self.paths)}
+
+    @staticmethod
+    def check_item(item, path):
+        if not isinstance(item.get('name'), str) or not item['name']:
+            raise HgcException(f"Item '{'/'.join(path)}' has no name")
+        if item.get('type') not in ITEM_TYPES:
+            raise HgcException(f"Item '{'/'.join(path)}' has incorrect type {item.get('type')}, should be one of {ITEM_TYPES}")
+        if 'items' in item:
+            items = item['items']
+            if isinstance(items, str) or not items or not all(isinstance(n, str) and n for n in items):
+                raise HgcException(f"Group '{'/'.join(path)}': 'items' should be a list of item names")
+
+    def __len__(self):
+        return len(self.paths)
+
+    def is_item(self, node):
+        return self.items[node] is not None
+
+    def key(self, node):
+        return self.paths[node][-1] if node else None
+
+    def child(self, node, n):
+        """ Returns the n-th child (0-based) of node, or None. """
+        if 0 <= n < self.child_count[node]:
+            return int(self.child_start[node] + n)
+        return None
+
+    def children(self, node):
+        start = int(self.child_start[node])
+        return range(start, start + int(self.child_count[node]))
+
+    def nb_pages(self, node):
+        return max(1, -(-int(self.child_count[node]) // self.page_size))
+
+    def page_child(self, node, page, index):
+        """ Returns the child selected with index (0 ... page_size-1) on page of node, or None. """
+        if not 0 <= index < self.page_size:
+            return None
+        return self.child(node, page * self.page_size + index)
+
+    def leaves(self, node):
+        """ Returns the ids of all items below node (node itself if it is an item). """
+        start = self.leaf_start[node]
+        return self.leaf_order[start:start + self.leaf_count[node]]
+
+    def find(self, item_name):
+        """ Returns the node id of the item with name item_name, or None. """
+        return self.by_name.get(item_name)
+
+    def find_path(self, path):
+        """ Returns the node id of a path (tuple of keys), or None. """
+        return self.by_path.get(tuple(path))
@@ -0,0 +1,114 @@
+"""
+Local cache of the item states (item name -> (state, timestamp)), kept up to date by the
+server-sent events stream of openHAB (/rest/events, Backend.subscribe()), so that selecting an item does not
+wait for a GET request.
+
+A background thread:
+    - loads the states of all items with one request (cold start, and again after each
+      reconnection, as events may have been missed),
+    - then reads the events 'openhab/items/<name>/statechanged' and '.../stateupdated'
+      and stores the new states,
+    - reconnects after 'reconnect_delay' seconds if the stream breaks.
+While the stream is connected, the cached states are always current. Otherwise a state
+older than 'ttl' seconds is fetched again with get_state() (TTL fallback).
+
+Can be tried without openHAB with the stand-in server fakeOpenhab.py.
+"""
+import json
+import threading
+from time import monotonic
+
+import backends
+from HgcException import HgcException
+
+EVENT_TOPICS = 'openhab/items/*/statechanged,openhab/items/*/stateupdated,openhab/items/*/state'
+
+
+class ItemStateCache:
+    def __init__(self, ttl=30, reconnect_delay=2.0, backend=None):
+        self.backend = backend or backends.default()
+        self.ttl = ttl
+        self.reconnect_delay = reconnect_delay
+        self.states = {}    # item name -> (state, timestamp)
+        self.connected = threading.Event()  # set while the events stream is open
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Statistics
+        self.hits = 0
+        self.misses = 0
+        self.nb_events = 0
+
+    def get(self, item_name):
+        """
+        Returns the state of an item: from the cache if it is current, otherwise with a GET
+        request (like Backend.get_state(), 'Error ...' on a HTTP error, HgcException on a connection error).
+        """
+        if self.is_current(item_name):
+            self.hits += 1
+            return self.states[item_name][0]
+        self.misses += 1
+        state = self.backend.get_state(item_name)
+        if not state.startswith('Error'):
+            self.set(item_name, state)
+        return state
+
+    def is_current(self, item_name):
+        """ True if the cached state of the item can be used without a GET request. """
+        entry = self.states.get(item_name)
+        return entry is not None and (self.connected.is_set() or monotonic() - entry[1] < self.ttl)
+
+    def set(self, item_name, state):
+        self.states[item_name] = (state, monotonic())
+
+    def invalidate(self, item_name=None):
+        """ Forget the state of an item (of all items if item_name is None). """
+        if item_name is None:
+            self.states = {}
+        else:
+            self.states.pop(item_name, None)
+
+    def load(self):
+        """ Load the states of all items with one request. Returns the number of items. """
+        now = monotonic()
+        states = {name: (state, now) for name, state in self.backend.get_states().items()}
+        self.states.update(states)
+        return len(states)
+
+    def handle_event(self, event):
+        """ Store the state of an item state event. Returns True if the event was an item state. """
+        topic = event.get('topic', '').split('/')
+        if len(topic) < 4 or topic[0] != 'openhab' or topic[1] != 'items':
+            return False
+        try:
+            payload = json.loads(event.get('payload') or '{}')
+        except ValueError:
+            return False
+        if topic[-1] not in ('statechanged', 'stateupdated', 'state') or 'value' not in payload:
+            return False
+        self.nb_events += 1
+        self.set(topic[2], str(payload['value']))
+        return True
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='ItemStateCache', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        self.stop_event.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            try:
+                # Open the stream before loading, so no change between load and stream is lost
+                events = self.backend.subscribe(EVENT_TOPICS)
+                print(f'ItemStateCache: {self.load()} item states loaded')
+                self.connected.set()
+                for event in events:
+                    if self.stop_event.is_set():
+                        break
+                    self.handle_event(event)
+            except HgcException as he:
+                print(f'ItemStateCache: events stream failed: {he.args[0]}')
+            self.connected.clear()
+            self.stop_event.wait(self.reconnect_delay)
@@ -0,0 +1,98 @@
+"""
+Live mode of the trackbar: while the TRACK pose is held, the values are sent to the item
+at once, so the light (or blind) follows the hand.
+
+LiveWriter sends the values in a background thread, at most 'max_rate' requests per second
+(max_rate 0: no limit). Values written in between are coalesced, only the latest value of
+an item is kept (latest wins), and the latest value is always sent in the end.
+"""
+import threading
+from collections import OrderedDict
+from time import monotonic
+
+import backends
+from HgcException import HgcException
+
+
+class LiveWriter:
+    def __init__(self, max_rate=4, backend=None):
+        self.backend = backend or backends.default()
+        self.min_interval = 1 / max_rate if max_rate else 0
+        self.waiting = OrderedDict()    # item name -> (state, items), latest wins
+        self.sending = False
+        self.last_send = 0
+        self.cond = threading.Condition()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+        # Statistics
+        self.nb_writes = 0
+        self.nb_sent = 0
+        self.nb_coalesced = 0
+        self.nb_errors = 0
+        self.last_sent = {}     # item name -> last state sent
+
+    def write(self, item_name, state, items=None):
+        """ Send state to the item (to the items of a group if items is given), returns immediately. """
+        with self.cond:
+            self.nb_writes += 1
+            if item_name in self.waiting:
+                self.nb_coalesced += 1
+            self.waiting[item_name] = (state, items)
+            self.cond.notify()
+
+    def discard(self, item_name):
+        """
+        Forget the value of an item not sent yet (e.g. the final value is posted by OK).
+        A value being sent is not affected: flush() before posting the final value.
+        """
+        with self.cond:
+            self.waiting.pop(item_name, None)
+
+    def flush(self, timeout=None):
+        """ Wait until all values are sent. Returns False on timeout. """
+        with self.cond:
+            return self.cond.wait_for(lambda: not self.waiting and not self.sending, timeout)
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='LiveWriter', daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        with self.cond:
+            self.cond.notify_all()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            with self.cond:
+                while not self.waiting and not self.stop_event.is_set():
+                    self.cond.wait()
+                # Rate limit: values written meanwhile are coalesced
+                delay = self.last_send + self.min_interval - monotonic()
+                while delay > 0 and not self.stop_event.is_set():
+                    self.cond.wait(delay)
+                    delay = self.last_send + self.min_interval - monotonic()
+                if not self.waiting:
+                    continue
+                item_name, (state, items) = self.waiting.popitem(last=False)
+                self.sending = True
+                self.last_send = monotonic()
+            try:
+                if items:
+                    results = self.backend.post_states(items, state)
+                    ok = all(r == 'OK' for r in results.values())
+                else:
+                    ok = self.backend.post_state(item_name, state) == 'OK'
+            except HgcException as he:
+                print(f'LiveWriter: could not set {item_name} to {state}: {he.args[0]}')
+                ok = False
+            with self.cond:
+                if ok:
+                    self.nb_sent += 1
+                    self.last_sent[item_name] = state
+                else:
+                    self.nb_errors += 1
+                self.sending = False
+                self.cond.notify_all()
@@ -0,0 +1,140 @@
+"""
+Predictive synthesis of the next prompts, while the user is still forming the next gesture.
+
+When the user selects a menu level (ItemController.select_area() / select_function()), the
+prompts that can follow are built from the children of the selected node:
+    - the prompts of the sub menus and items (also in ItemController.cached_phrases()),
+    - the question about the state of each item: "The light is on. Do you like to switch it off?",
+      with the state from the state cache (prefetched, see statePrefetch.py). For a bool item
+      both questions (on and off) are predicted if the state is not known yet,
+    - the prompt of select_all().
+A worker thread waits until the speech output is idle and hands the prompts to the
+AudioCache for synthesis in the background. When the user goes back, the prompts predicted
+for the menu levels left are removed from the cache again (except the fixed phrases).
+"""
+import threading
+
+from itemIndex import ROOT
+
+# s, max time to wait for the prefetched states of the items
+STATE_WAIT = 0.5
+
+
+class PromptPredictor:
+    def __init__(self, item_controller, audio_cache):
+        self.item_controller = item_controller
+        self.audio_cache = audio_cache
+        self.predicted = {}     # node -> set of texts predicted when node was selected
+        self.fixed = set()      # texts of ItemController.cached_phrases(), never removed
+        self.index = None       # item index the predictions belong to
+
+        self.lock = threading.Condition()
+        self.pending = None     # node to predict for
+        self.stopped = False
+        self.thread = None
+
+        # Metrics
+        self.nb_predictions = 0
+        self.nb_submitted = 0
+        self.nb_discarded = 0
+
+    def start(self):
+        self.thread = threading.Thread(target=self.run, name='PromptPredictor', daemon=True)
+        self.thread.start()
+
+    def stop(self):
+        with self.lock:
+            self.stopped = True
+            self.lock.notify()
+
+    def predict(self, node):
+        """ Called when node becomes the current menu level. """
+        with self.lock:
+            self.pending = node
+            self.lock.notify()
+
+    def run(self):
+        while True:
+            with self.lock:
+                while self.pending is None and not self.stopped:
+                    self.lock.wait()
+                if self.stopped:
+                    return
+                node = self.pending
+                self.pending = None
+            ic = self.item_controller
+            index = ic.index
+            if index is not self.index:
+                # New item tree
+                self.index = index
+                self.fixed = set(ic.cached_phrases())
+                self.discard(set(self.predicted))
+            self.discard([n for n in self.predicted if not self.is_on_path(n, node)])
+            texts = self.prompts(node)
+            self.predicted[node] = texts
+            self.nb_predictions += 1
+            # Synthesis competes with the speech for the CPU: start when the speech is idle
+            while ic.speech_controller.busy() and self.pending is None and not self.stopped:
+                with self.lock:
+                    self.lock.wait(0.05)
+            if self.pending is None:
+                self.nb_submitted += self.audio_cache.presynthesize(texts)
+
+    def is_on_path(self, node, current):
+        """ True if node is current or a menu level above it. """
+        while current >= ROOT:
+            if current == node:
+                return True
+            current = int(self.index.parent[current])
+        return False
+
+    def discard(self, nodes):
+        """ Removes the texts predicted for nodes from the cache, unless still needed. """
+        if not nodes:
+            return
+        texts = set()
+        for n in nodes:
+            texts |= self.predicted.pop(n, set())
+        keep = self.fixed.union(*self.predicted.values())
+        texts -= keep
+        self.audio_cache.discard(texts)
+        self.nb_discarded += len(texts)
+
+    def prompts(self, node):
+        ic = self.item_controller
+        index = self.index
+        texts = []
+        for child in index.children(node):
+            if not index.is_item(child):
+                texts.append(ic.area_prompt(child) if index.depth[child] == 1 else ic.function_prompt(child))
+                continue
+            item = index.items[child]
+            texts.append(ic.item_prompt(child))
+            if 'items' in item:
+                continue
+            state = self.known_state(item['name'])
+            if item['type'] == 'bool':
+                states = [state] if state in ('ON', 'OFF') else ['ON', 'OFF']
+                texts += [ic.bool_question(node, s) for s in states]
+            elif item['type'] == 'percentage' and state is not None:
+                texts.append(ic.percentage_question(node, state))
+        if node != ROOT:
+            leaves = index.leaves(node)
+            item_names = {name for n in leaves for name in index.items[n].get('items', [index.items[n]['name']])}
+            texts.append(ic.all_prompt(node, len(item_names)))
+        return set(texts)
+
+    def known_state(self, item_name):
+        """ The state of item_name if it is in the state cache (waits a little for the prefetch), else None. """
+        ic = self.item_controller
+        if ic.state_cache is None:
+            return None
+        if ic.prefetcher:
+            ic.prefetcher.wait(item_name, STATE_WAIT)
+        entry = ic.state_cache.states.get(item_name)
+        if entry is not None and ic.state_cache.is_current(item_name):
+            return entry[0]
+        return None
+
+    def metrics(self):
+        return {'predictions': self.nb_predictions, 'submitted': self.nb_submitted, 'discarded': self.nb_discarded}
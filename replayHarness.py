@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+Deterministic replay harness and benchmark for the HandController logic, without OAK-D device
+and without openHAB.
+
+A stream of hands ('hands' as returned by HandTracker.next_frame(), with timestamps) is fed
+through a FakeTracker into HandController.process_frame(). Callbacks go to a
+StubItemController which only records them. The events are written as an event log,
+which can be compared with a golden log for regression checks.
+
+A stream is a JSON lines file, one frame per line:
+    {"t": 0.033, "gesture": "ONE", "label": "right", "distance_4_8": 0.4}
+    {"t": 0.066}                                        <- no hand in this frame
+Streams can be recorded from the real tracker (--record-live) or generated from a
+script of (gesture, duration) steps (synthetic_stream()).
+
+Examples:
+    python replayHarness.py --stream replay/example_stream.jsonl --golden replay/example_golden.log
+    python replayHarness.py --stream replay/example_stream.jsonl --golden replay/example_golden.log --update
+    python replayHarness.py --bench 200000
+"""
+import argparse
+import difflib
+import json
+import sys
+from time import perf_counter
+
+import configLoader
+from HandController import HandController, ALL_POSES
+
+DEFAULT_CONFIG_FILE = 'config/example.json'
+
+# Script of the example stream: (gesture, duration in s), gesture None = no hand
+EXAMPLE_SCRIPT = [
+    (None, 0.5), ('WAKEUP', 1.2), (None, 0.2),
+    ('TWO', 0.5), ('ONE', 0.5), (None, 0.1), ('ONE', 0.5), ('ONE', 0.1), (None, 0.3),
+    ('TRACK', 1.5), ('OK', 0.5), (None, 0.5),
+    ('WAKEUP', 0.3), ('ONE', 0.3), (None, 0.3), ('ONE', 0.3), (None, 0.3), ('ONE', 0.3), (None, 2.0),
+    ('WAKEUP', 1.2), ('THREE', 0.5), ('BACK', 0.5), ('FOUR', 0.5), (None, 1.0),
+]
+
+
+class FakeHand:
+    """ The attributes of mediapipe_utils.HandRegion used by HandController and ItemController. """
+    def __init__(self, gesture=None, label='right', distance_4_8=0.4, lm_score=1.0):
+        self.gesture = gesture
+        self.label = label
+        self.handedness = 1.0 if label == 'right' else 0.0
+        self.distance_4_8 = distance_4_8
+        self.lm_score = lm_score
+
+    def to_dict(self):
+        return {'gesture': self.gesture, 'label': self.label, 'distance_4_8': self.distance_4_8}
+
+
+class FakeTracker:
+    """ Replays a list of frames (t, hands) like HandTracker.next_frame(). """
+    def __init__(self, frames):
+        self.frames = frames
+        self.index = 0
+        self.now = None     # timestamp of the last returned frame
+        self.use_lm = True
+        self.use_gesture = True
+
+    def next_frame(self):
+        if self.index >= len(self.frames):
+            return None, [], None
+        self.now, hands = self.frames[self.index]
+        self.index += 1
+        return self.index, hands, None
+
+    def exit(self):
+        pass
+
+
+class StubItemController:
+    """ Records the callbacks of the HandController, mimics the awake logic of ItemController. """
+    def __init__(self, config):
+        self.config = config
+        self.awake = False
+        self.to_display = ''
+        self.selections = {}
+        self.calls = []
+
+    def wake_up(self, event):
+        self.awake = not self.awake
+        self.calls.append(('wake_up', event.name))
+
+    def handle_event(self, event):
+        self.calls.append(('handle_event', event.name))
+
+    def handle_combo(self, event):
+        self.calls.append(('handle_combo', event.name))
+
+    def poll(self):
+        pass
+
+
+def load_config(path=DEFAULT_CONFIG_FILE):
+    """ Load a config file, with renderer and hot reload disabled. """
+    with open(path, 'rb') as f:
+        raw = configLoader.parse_config_file(path, f.read())
+    raw['renderer'] = {'enable': False}
+    raw['reload'] = {'enable': False}
+    return configLoader.CompiledConfig(configLoader.compile_config(raw), source=None)
+
+def synthetic_stream(script, fps=30, label='right', distance_4_8=0.4):
+    """ Returns a list of frames (t, hands) from a list of (gesture, duration) steps. """
+    frames = []
+    dt = 1 / fps
+    t = 0.0
+    for gesture, duration in script:
+        for _ in range(round(duration * fps)):
+            hands = [FakeHand(gesture, label, distance_4_8)] if gesture else []
+            frames.append((round(t, 6), hands))
+            t += dt
+    return frames
+
+def load_stream(path):
+    frames = []
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            d = json.loads(line)
+            hands = [FakeHand(d['gesture'], d.get('label', 'right'), d.get('distance_4_8', 0.4))] if d.get('gesture') else []
+            frames.append((d['t'], hands))
+    return frames
+
+def save_stream(path, frames):
+    with open(path, 'w') as f:
+        for t, hands in frames:
+            d = {'t': t}
+            if hands:
+                d.update(hands[0].to_dict())
+            f.write(json.dumps(d) + '\n')
+
+def record_live(path, nb_frames, config_path=DEFAULT_CONFIG_FILE):
+    """ Record the hands seen by the real HandTracker (OAK-D needed) into a stream file. """
+    from time import monotonic
+    from HandTrackerEdge import HandTracker
+    config = load_config(config_path)
+    tracker = HandTracker(**config['tracker']['args'])
+    frames = []
+    t0 = monotonic()
+    for _ in range(nb_frames):
+        frame, hands, _ = tracker.next_frame()
+        if frame is None:
+            break
+        hands = [FakeHand(h.gesture, h.label, getattr(h, 'distance_4_8', 0.4)) for h in hands]
+        frames.append((round(monotonic() - t0, 6), hands))
+    tracker.exit()
+    save_stream(path, frames)
+
+def event_line(frame_nb, now, e):
+    return f"{frame_nb:6d} {now:9.3f} {e.category} {e.name} [{e.pose}] hand: {e.handedness} trigger: {e.trigger} callback: {e.callback}"
+
+def replay(frames, config):
+    """ Feed frames through a HandController. Returns the event log (list of lines). """
+    ic = StubItemController(config)
+    tracker = FakeTracker(frames)
+    hc = HandController(ic, tracker=tracker)
+    log = []
+    while True:
+        frame, hands, _ = tracker.next_frame()
+        if frame is None:
+            break
+        for e in hc.process_frame(hands, now=tracker.now):
+            log.append(event_line(hc.frame_nb, tracker.now, e))
+    return log
+
+def check_golden(log, golden_path, update=False):
+    """ Compare an event log with a golden log. Returns True if they are equal (or the golden log was updated). """
+    if update:
+        with open(golden_path, 'w') as f:
+            f.write('\n'.join(log) + '\n')
+        print(f'Golden log {golden_path} updated ({len(log)} events)')
+        return True
+    with open(golden_path) as f:
+        golden = f.read().splitlines()
+    if golden == log:
+        print(f'OK: {len(log)} events match {golden_path}')
+        return True
+    print(f'FAILED: event log differs from {golden_path}')
+    for line in difflib.unified_diff(golden, log, 'golden', 'replay', lineterm=''):
+        print(line)
+    return False
+
+def bench(config, nb_frames=100000, fps=30):
+    """
+    Measure the throughput of the controller logic (HandController.process_frame) on a synthetic
+    stream cycling through all poses. Timestamps are simulated, so this runs much faster than real time.
+    Returns a dict of results.
+    """
+    script = []
+    for pose in ALL_POSES:
+        script += [(pose, 0.6), (None, 0.2)]
+    cycle = synthetic_stream(script, fps)
+    frames = []
+    t_offset = 0.0
+    cycle_duration = len(cycle) / fps
+    while len(frames) < nb_frames:
+        frames += [(t + t_offset, hands) for t, hands in cycle]
+        t_offset += cycle_duration
+    frames = frames[:nb_frames]
+
+    ic = StubItemController(config)
+    hc = HandController(ic, tracker=FakeTracker([]))
+    latencies = [0.0] * nb_frames
+    nb_events = 0
+    t_start = perf_counter()
+    for i, (t, hands) in enumerate(frames):
+        t0 = perf_counter()
+        nb_events += len(hc.process_frame(hands, now=t))
+        latencies[i] = perf_counter() - t0
+    total = perf_counter() - t_start
+    latencies.sort()
+    return {
+        'frames': nb_frames,
+        'events': nb_events,
+        'total_s': round(total, 4),
+        'frames_per_s': round(nb_frames / total),
+        'events_per_s': round(nb_events / total),
+        'latency_us_p50': round(latencies[nb_frames // 2] * 1e6, 2),
+        'latency_us_p99': round(latencies[int(nb_frames * 0.99)] * 1e6, 2),
+        'latency_us_max': round(latencies[-1] * 1e6, 2),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay hand streams through the HandController')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_FILE, help='config file (JSON or TOML)')
+    parser.add_argument('--stream', help='stream file (JSON lines), default: the example script')
+    parser.add_argument('--golden', help='golden event log to compare with')
+    parser.add_argument('--update', action='store_true', help='write the golden event log instead of comparing')
+    parser.add_argument('--save-stream', metavar='FILE', help='save the replayed stream (e.g. the example script)')
+    parser.add_argument('--record-live', metavar='FILE', help='record a stream from the OAK-D device')
+    parser.add_argument('--frames', type=int, default=900, help='number of frames for --record-live')
+    parser.add_argument('--bench', type=int, metavar='N', help='benchmark with N simulated frames')
+    args = parser.parse_args()
+
+    if args.record_live:
+        record_live(args.record_live, args.frames, args.config)
+        return
+    config = load_config(args.config)
+    if args.bench:
+        print(json.dumps(bench(config, args.bench), indent=2))
+        return
+    frames = load_stream(args.stream) if args.stream else synthetic_stream(EXAMPLE_SCRIPT)
+    if args.save_stream:
+        save_stream(args.save_stream, frames)
+    log = replay(frames, config)
+    if args.golden:
+        if not check_golden(log, args.golden, args.update):
+            sys.exit(1)
+    else:
+        print('\n'.join(log))
+
+if __name__ == '__main__':
+    main()
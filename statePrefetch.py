@@ -0,0 +1,82 @@
+"""
+Speculative prefetch of item states: when an area or a function is selected, the items the
+user can select next are known (ItemIndex.leaves()). Their states are fetched concurrently
+in a small thread pool while the user forms the next gesture, and stored in the item state
+cache (itemStateCache.py), where handle_booltype() / handle_percentagetype() find them.
+
+    - dedup: an item already current in the cache or already being fetched is not fetched again,
+      and ItemController.get_state() waits for a running fetch instead of sending a second request,
+    - cancellation: on back (or when the selections are cleared), the fetches not started yet
+      are cancelled; every prefetch() replaces the set of wanted items and queued fetches of
+      items no longer wanted are skipped. An item still wanted keeps its queued fetch.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
+import backends
+from HgcException import HgcException
+
+
+class StatePrefetcher:
+    def __init__(self, state_cache, workers=4, max_items=40, backend=None):
+        self.backend = backend or backends.default()
+        self.state_cache = state_cache
+        self.max_items = max_items
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='StatePrefetch')
+        self.lock = threading.RLock()     # done() is also called from within prefetch() and cancel()
+        self.in_flight = {}     # item name -> Future
+        self.wanted = set()     # items of the last prefetch()
+
+        # Statistics
+        self.nb_fetched = 0
+        self.nb_skipped = 0
+        self.nb_cancelled = 0
+
+    def prefetch(self, item_names):
+        """ Start fetching the states of item_names (at most max_items) in the background. """
+        with self.lock:
+            self.wanted = set(item_names[:self.max_items])
+            for name in item_names[:self.max_items]:
+                if name in self.in_flight or self.state_cache.is_current(name):
+                    self.nb_skipped += 1
+                    continue
+                future = self.executor.submit(self.fetch, name)
+                self.in_flight[name] = future
+                future.add_done_callback(lambda f, name=name: self.done(name, f))
+
+    def done(self, name, future):
+        with self.lock:
+            if self.in_flight.get(name) is future:
+                del self.in_flight[name]
+
+    def fetch(self, name):
+        if name not in self.wanted:
+            # Cancelled while queued
+            self.nb_cancelled += 1
+            return
+        try:
+            state = self.backend.get_state(name)
+        except HgcException as he:
+            print(f'StatePrefetcher: could not get state of {name}: {he.args[0]}')
+            return
+        if not state.startswith('Error'):
+            self.state_cache.set(name, state)
+            self.nb_fetched += 1
+
+    def cancel(self):
+        """ Cancel the fetches not started yet (e.g. the user went back). """
+        with self.lock:
+            self.wanted = set()
+            for future in list(self.in_flight.values()):
+                if future.cancel():
+                    self.nb_cancelled += 1
+
+    def wait(self, item_name, timeout=5):
+        """ Wait until a running fetch of item_name is finished (if any). """
+        future = self.in_flight.get(item_name)
+        if future is not None:
+            wait([future], timeout)
+
+    def shutdown(self):
+        self.cancel()
+        self.executor.shutdown(wait=False)